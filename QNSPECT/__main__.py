@@ -0,0 +1,5 @@
+import sys
+
+from QNSPECT.cli import main
+
+sys.exit(main())
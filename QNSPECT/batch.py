@@ -0,0 +1,257 @@
+"""
+Batch scenario runner.
+Runs the analysis configurations of a manifest in a pool of headless QGIS processes with one log
+file per run. A failing run (or a crashing worker) does not stop the other runs.
+
+Manifest (JSON):
+    {
+        "defaults": {<parameters shared by all runs>},
+        "runs": [
+            {"RunFile": "baseline.pol.json", "RunName": "scenario_1", "LandCoverRaster": "lc_1.tif"},
+            {"Algorithm": "erosion", "RunName": "scenario_2", ...},
+        ]
+    }
+Run parameters are the defaults, updated with the inputs of RunFile (a `.pol.json`/`.ero.json`
+saved by a previous run) and then with the parameters of the run itself.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+ALGORITHMS = {
+    "pollution": "qnspect:run_pollution_analysis",
+    "erosion": "qnspect:run_erosion_analysis",
+}
+RUN_FILE_ALGORITHMS = {".pol.json": "pollution", ".ero.json": "erosion"}
+
+# Runs with the same values for these parameters share their flow routing and LS-Factor intermediates
+SHARED_ROUTING_INPUTS = ("ElevationRaster", "MFD", "FlowRoutingEngine")
+
+
+def needs_grass(algorithm: str, parameters: dict) -> bool:
+    """Whether the algorithm runs GRASS with these parameters (analyses with the GRASS flow routing engine)"""
+    if algorithm in ALGORITHMS.values():
+        return str(parameters.get("FlowRoutingEngine", 0)) != "1"
+    return False
+
+
+class BatchRun(NamedTuple):
+    name: str
+    algorithm: str
+    parameters: dict
+
+
+def load_manifest(manifest: str) -> List[BatchRun]:
+    """Runs of a batch manifest. Raises ValueError for invalid manifests."""
+    with open(manifest) as f:
+        data = json.load(f)
+    defaults = data.get("defaults", {})
+
+    runs = []
+    for i, entry in enumerate(data.get("runs", [])):
+        entry = dict(entry)
+        parameters = dict(defaults)
+        algorithm = entry.pop("Algorithm", None)
+
+        run_file = entry.pop("RunFile", None)
+        if run_file:
+            with open(run_file) as f:
+                parameters.update(json.load(f)["Inputs"])
+            for suffix, alg in RUN_FILE_ALGORITHMS.items():
+                if run_file.lower().endswith(suffix):
+                    algorithm = algorithm or alg
+
+        parameters.update(entry)
+        # outputs can not be opened from a worker process
+        parameters["LoadOutputs"] = False
+
+        algorithm = ALGORITHMS.get(algorithm, algorithm)
+        if algorithm not in ALGORITHMS.values():
+            raise ValueError(
+                f"Run {i + 1}: Algorithm must be one of {list(ALGORITHMS)} or given through a RunFile."
+            )
+        if not parameters.get("RunName") or not parameters.get("ProjectLocation"):
+            raise ValueError(f"Run {i + 1}: RunName and ProjectLocation are required.")
+        runs.append(BatchRun(parameters["RunName"], algorithm, parameters))
+
+    names = [r.name for r in runs]
+    duplicates = {n for n in names if names.count(n) > 1}
+    if duplicates:
+        raise ValueError(f"Run names must be unique: {', '.join(sorted(duplicates))}")
+    return runs
+
+
+def routing_groups(runs: List[BatchRun]) -> List[List[BatchRun]]:
+    """Group runs that share their flow routing inputs, in manifest order"""
+    groups: Dict[str, List[BatchRun]] = {}
+    for run in runs:
+        key = json.dumps(
+            [run.parameters.get(k) for k in SHARED_ROUTING_INPUTS], default=str
+        )
+        groups.setdefault(key, []).append(run)
+    return list(groups.values())
+
+
+def python_executable() -> str:
+    """Python interpreter for the worker processes.
+    Inside QGIS sys.executable is the QGIS application, not a Python interpreter."""
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in ("python3", "python", "python3.exe", "python.exe"):
+            candidate = os.path.join(folder, name)
+            if os.path.isfile(candidate):
+                return candidate
+    return shutil.which("python3") or shutil.which("python") or sys.executable
+
+
+def _start_worker(grass: bool):
+    from QNSPECT.headless import start_qgis
+
+    start_qgis(grass)
+
+
+def execute_run(run: BatchRun, log_dir: str) -> dict:
+    """Run one configuration in a worker process. Errors are logged and returned, never raised."""
+    from QNSPECT.headless import LogFeedback, run_algorithm
+
+    log_file = str(Path(log_dir) / f"{run.name}.log")
+    summary = {"RunName": run.name, "Algorithm": run.algorithm, "Log": log_file}
+    start = time.perf_counter()
+    with open(log_file, "w", buffering=1) as log:
+        feedback = LogFeedback(log)
+        try:
+            summary["Results"] = run_algorithm(run.algorithm, run.parameters, feedback)
+            summary["Status"] = "succeeded"
+        except Exception as e:
+            feedback.reportError(traceback.format_exc())
+            summary["Status"] = "failed"
+            summary["Error"] = str(e)
+    summary["Seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def _terminate_workers(pool: ProcessPoolExecutor):
+    """Stop the worker processes of the pool without waiting for their runs to finish"""
+    if hasattr(pool, "terminate_workers"):  # Python 3.14+
+        pool.terminate_workers()
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+def run_batch(
+    runs: List[BatchRun],
+    log_dir: str,
+    processes: int = None,
+    feedback=None,
+) -> List[dict]:
+    """Run the batch in a process pool and return the summary of each run.
+
+    The first run of each group of runs sharing flow routing inputs is started first and the
+    rest of its group once it is done, so that they reuse its cached intermediates instead of
+    computing them concurrently. feedback is optional (setProgress, pushInfo, isCanceled).
+    On cancel the workers are terminated, and the runs not finished yet are summarized as canceled.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    processes = processes or max((os.cpu_count() or 2) - 1, 1)
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python_executable())
+
+    # GRASS is only loaded in the workers if a run needs it
+    grass = any(needs_grass(r.algorithm, r.parameters) for r in runs)
+    groups = routing_groups(runs)
+    waiting = {id(group[0]): group[1:] for group in groups}
+    queue = [group[0] for group in groups]
+    summaries, retried = [], set()
+
+    def new_pool():
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=_start_worker,
+            initargs=(grass,),
+        )
+
+    def finish(run: BatchRun, summary: dict):
+        summaries.append(summary)
+        queue.extend(waiting.pop(id(run), []))
+        if feedback is not None:
+            feedback.pushInfo(f"{summary['RunName']}: {summary['Status']}")
+            feedback.setProgress(100 * len(summaries) / len(runs))
+
+    def retry_or_fail(run: BatchRun):
+        """Runs of a broken pool are retried once, a run that breaks two pools is the culprit"""
+        if run.name not in retried:
+            retried.add(run.name)
+            queue.append(run)
+            return
+        finish(
+            run,
+            {
+                "RunName": run.name,
+                "Algorithm": run.algorithm,
+                "Status": "failed",
+                "Error": "Worker process terminated unexpectedly",
+            },
+        )
+
+    pool = new_pool()
+    running = {}
+    canceled = False
+    try:
+        while queue or running:
+            if feedback is not None and feedback.isCanceled():
+                canceled = True
+                break
+            while queue:
+                run = queue.pop(0)
+                running[pool.submit(execute_run, run, log_dir)] = run
+
+            # time out regularly to check for cancellation
+            done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                run = running.pop(future)
+                try:
+                    finish(run, future.result())
+                except BrokenProcessPool:
+                    # a worker died (e.g. a crash in native code)
+                    broken = True
+                    retry_or_fail(run)
+
+            if broken:
+                # every run still in the broken pool fails with it, resubmit them to a new pool
+                for run in running.values():
+                    retry_or_fail(run)
+                running.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = new_pool()
+    finally:
+        if canceled:
+            _terminate_workers(pool)
+        pool.shutdown(wait=not canceled, cancel_futures=True)
+
+    if canceled:
+        unfinished = list(running.values()) + queue
+        unfinished += [run for group in waiting.values() for run in group]
+        for run in unfinished:
+            summaries.append(
+                {"RunName": run.name, "Algorithm": run.algorithm, "Status": "canceled"}
+            )
+    return summaries
+
+
+def write_summary(summaries: List[dict], path: str) -> str:
+    with open(path, "w") as f:
+        json.dump(summaries, f, indent=4, default=str)
+    return path
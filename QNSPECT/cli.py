@@ -0,0 +1,120 @@
+"""
+QNSPECT command line interface.
+
+    python -m QNSPECT pollution my_run.pol.json --set RunName=scenario_1
+    python -m QNSPECT batch manifest.json --processes 8
+
+Configuration files are run files saved by the analyses (`.pol.json`, `.ero.json`) or JSON
+objects of algorithm parameters. Results are printed to stdout as JSON, messages go to stderr.
+QGIS is only imported once a command runs, and only the Processing providers the command needs
+are loaded (GRASS is skipped for analyses with the Native flow routing engine).
+"""
+
+import argparse
+import json
+import sys
+
+COMMANDS = {
+    "pollution": "qnspect:run_pollution_analysis",
+    "erosion": "qnspect:run_erosion_analysis",
+    "compare-pollution": "qnspect:compare_scenarios_pollution",
+    "compare-erosion": "qnspect:compare_scenarios_erosion",
+    "align": "qnspect:align_rasters",
+    "evaluate": "qnspect:evaluate_pollutant_coefficients",
+}
+
+
+def parse_override(text: str):
+    """KEY=VALUE, VALUE is read as JSON if possible (numbers, booleans, lists), as text otherwise"""
+    key, sep, value = text.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got {text}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def load_config(path: str, overrides) -> dict:
+    with open(path) as f:
+        config = json.load(f)
+    # run files keep the parameters under Inputs
+    parameters = dict(config.get("Inputs", config))
+    parameters.update(overrides)
+    # there is no map canvas to load outputs in
+    parameters["LoadOutputs"] = False
+    return parameters
+
+
+class _StderrFeedback:
+    """Minimal feedback for the batch command, which does not load QGIS in this process"""
+
+    def isCanceled(self):
+        return False
+
+    def pushInfo(self, info):
+        print(info, file=sys.stderr)
+
+    def setProgress(self, progress):
+        pass
+
+
+def run_command(args) -> int:
+    parameters = load_config(args.config, dict(args.set))
+
+    from QNSPECT.headless import LogFeedback, run_algorithm
+
+    log = open(args.log, "w") if args.log else sys.stderr
+    try:
+        results = run_algorithm(COMMANDS[args.command], parameters, LogFeedback(log))
+    finally:
+        if args.log:
+            log.close()
+    print(json.dumps(results, indent=4, default=str))
+    return 0
+
+
+def batch_command(args) -> int:
+    from QNSPECT.batch import load_manifest, run_batch
+
+    runs = load_manifest(args.manifest)
+    summaries = run_batch(runs, args.logs, args.processes, _StderrFeedback())
+    print(json.dumps(summaries, indent=4, default=str))
+    return 0 if all(s["Status"] == "succeeded" for s in summaries) else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="qnspect",
+        description="Run QNSPECT analyses without the QGIS GUI.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command, algorithm in COMMANDS.items():
+        sub = commands.add_parser(command, help=f"run {algorithm}")
+        sub.add_argument("config", help="run file or JSON file of parameters")
+        sub.add_argument(
+            "--set",
+            metavar="KEY=VALUE",
+            type=parse_override,
+            action="append",
+            default=[],
+            help="override a parameter, can be repeated",
+        )
+        sub.add_argument("--log", help="write messages to this file instead of stderr")
+        sub.set_defaults(func=run_command)
+
+    sub = commands.add_parser("batch", help="run a batch manifest in parallel")
+    sub.add_argument("manifest", help="batch manifest (see QNSPECT.batch)")
+    sub.add_argument("--processes", "-j", type=int, help="number of worker processes")
+    sub.add_argument("--logs", default="qnspect_logs", help="folder for the run logs")
+    sub.set_defaults(func=batch_command)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except Exception as e:
+        print(f"qnspect {args.command}: {e}", file=sys.stderr)
+        return 1
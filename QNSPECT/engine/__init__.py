@@ -0,0 +1,6 @@
+"""
+QNSPECT Engine Module
+
+NumPy/GDAL computation kernels used by the QNSPECT algorithms.
+Modules in this package must not import qgis so that they stay usable outside of a QGIS session.
+"""
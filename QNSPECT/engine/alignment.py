@@ -0,0 +1,88 @@
+"""
+Alignment shortcuts: rasters already on the target grid are copied instead of warped.
+Grids are compared from the raster headers only, no cells are read.
+"""
+
+import os
+import shutil
+
+from osgeo import gdal, osr
+
+from QNSPECT.engine.raster_io import RasterGrid, open_raster, raster_grid
+
+# Tolerance of the grid comparison as a fraction of the cell size
+GRID_TOLERANCE = 1e-6
+
+
+def target_grid(reference: str, cell_x: float, cell_y: float) -> RasterGrid:
+    """Grid of the rasters warped to the extent and CRS of reference with a (cell_x, cell_y) cell size,
+    as gdalwarp -te -tr"""
+    grid = raster_grid(reference)
+    x_min, x_res, _, y_max, _, y_res = grid.geotransform
+    width = grid.xsize * abs(x_res)
+    height = grid.ysize * abs(y_res)
+    return RasterGrid(
+        int(width / cell_x + 0.5),
+        int(height / cell_y + 0.5),
+        (x_min, cell_x, 0.0, y_max, 0.0, -cell_y),
+        grid.projection,
+    )
+
+
+def same_crs(projection_a: str, projection_b: str) -> bool:
+    if projection_a == projection_b:
+        return True
+    if not projection_a or not projection_b:
+        return False
+    srs_a, srs_b = osr.SpatialReference(), osr.SpatialReference()
+    srs_a.ImportFromWkt(projection_a)
+    srs_b.ImportFromWkt(projection_b)
+    return bool(srs_a.IsSame(srs_b))
+
+
+def is_aligned(raster: str, grid: RasterGrid) -> bool:
+    """True if raster has the size, origin, cell size and CRS of grid (a single band north-up raster)"""
+    try:
+        ds = open_raster(raster)
+    except IOError:
+        return False
+    if ds.RasterCount != 1 or (ds.RasterXSize, ds.RasterYSize) != (
+        grid.xsize,
+        grid.ysize,
+    ):
+        return False
+    tolerance = GRID_TOLERANCE * min(
+        abs(grid.geotransform[1]), abs(grid.geotransform[5])
+    )
+    if any(
+        abs(a - b) > tolerance for a, b in zip(ds.GetGeoTransform(), grid.geotransform)
+    ):
+        return False
+    return same_crs(ds.GetProjection(), grid.projection)
+
+
+def copy_aligned(raster: str, output: str, projection: str) -> str:
+    """Write an aligned raster to output (GeoTIFF, or VRT pointing to raster for a .vrt output)
+    without resampling, with the projection string of the other aligned rasters"""
+    ds = open_raster(raster)
+    virtual = output.lower().endswith(".vrt")
+    if (
+        not virtual
+        and ds.GetDriver().ShortName == "GTiff"
+        and ds.GetProjection() == projection
+    ):
+        ds = None
+        shutil.copyfile(raster, output)
+        return output
+    if os.path.exists(output):
+        os.remove(output)
+    out_ds = gdal.Translate(
+        output,
+        ds,
+        format="VRT" if virtual else "GTiff",
+        outputSRS=projection,
+    )
+    if out_ds is None:
+        raise IOError(f"Unable to write {output}")
+    out_ds = None
+    return output
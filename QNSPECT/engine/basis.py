@@ -0,0 +1,160 @@
+"""
+Class-decomposed accumulation basis of a pollution run.
+
+A pollutant load is runoff x coefficient(land cover class) and accumulation is linear, so the
+accumulated load of any set of coefficients is a weighted sum of the accumulated runoff of each
+land cover class:
+
+    accumulated load = sum over classes k of coefficient(k) * accumulated(runoff where class == k)
+
+The basis stores the accumulated runoff of each class once. New lookup coefficients or new
+pollutant columns are then evaluated block by block without any flow routing.
+"""
+
+import json
+import os
+import shutil
+from typing import Callable, Dict, Iterable
+
+import numpy as np
+
+from QNSPECT.engine.blocks import check_canceled, map_rasters, process_blocks
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.pollution import concentration
+
+BASIS_FILE = "basis.json"
+
+
+def class_runoff_raster(
+    lc_raster: str,
+    runoff_raster: str,
+    lc_value: float,
+    output: str,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    """Runoff of the cells of one land cover class, 0 for other classes"""
+    return map_rasters(
+        lambda lc, runoff: np.where(lc == lc_value, runoff, 0.0),
+        {"lc": lc_raster, "runoff": runoff_raster},
+        output,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
+
+
+def build_class_basis(
+    folder: str,
+    lc_raster: str,
+    runoff_raster: str,
+    lc_values: Iterable[float],
+    accumulate: Callable[[str, str], str],
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    """Accumulate the runoff (L) of each land cover class in lc_values and write the basis to folder.
+    accumulate(weight raster, output) accumulates a raster over the flow routing and returns
+    the output path. Returns the path of the basis file.
+    Raises Canceled before the basis file is written if the feedback is canceled."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, BASIS_FILE)
+    # a basis of a previous run would point to the rasters that are overwritten below
+    if os.path.isfile(path):
+        os.remove(path)
+    # the basis keeps its own copy of the local runoff, which may be a temporary file
+    runoff_copy = os.path.join(folder, "Runoff Local.tif")
+    if os.path.abspath(runoff_raster) != os.path.abspath(runoff_copy):
+        shutil.copyfile(runoff_raster, runoff_copy)
+
+    classes = {}
+    for lc_value in lc_values:
+        check_canceled(feedback)
+        name = f"Class {lc_value:g}"
+        weight = os.path.join(folder, f"{name} Runoff.tif")
+        class_runoff_raster(
+            lc_raster, runoff_copy, lc_value, weight, memory_mb, feedback
+        )
+        classes[str(float(lc_value))] = os.path.basename(
+            accumulate(weight, os.path.join(folder, f"{name}.tif"))
+        )
+        os.remove(weight)
+    # the last accumulation may have stopped early
+    check_canceled(feedback)
+
+    basis = {
+        "LandCoverRaster": lc_raster,
+        "RunoffLocal": os.path.basename(runoff_copy),
+        "Classes": classes,
+    }
+    with open(path, "w") as f:
+        json.dump(basis, f, indent=4)
+    return path
+
+
+def load_class_basis(folder: str) -> dict:
+    """Basis of a folder with absolute raster paths. Raises IOError if the folder has no basis."""
+    path = os.path.join(folder, BASIS_FILE)
+    if not os.path.isfile(path):
+        raise IOError(f"No class accumulation basis in {folder}")
+    with open(path) as f:
+        basis = json.load(f)
+    basis["RunoffLocal"] = os.path.join(folder, basis["RunoffLocal"])
+    basis["Classes"] = {
+        float(value): os.path.join(folder, raster)
+        for value, raster in basis["Classes"].items()
+    }
+    return basis
+
+
+def evaluate_class_basis(
+    folder: str,
+    lookup: LookupTable,
+    field: str,
+    outputs: Dict[str, str],
+    memory_mb: int = None,
+    feedback=None,
+) -> Dict[str, str]:
+    """Pollutant rasters of a lookup table field from the basis of folder.
+
+    outputs maps the raster name to its output path, valid names are `Local` (mg),
+    `Accumulated` (kg) and `Concentration` (mg/L). Classes missing from the lookup table
+    are NoData and do not contribute downstream, as in the full analysis."""
+    basis = load_class_basis(folder)
+    lc_values = list(basis["Classes"])
+    # coefficient of each basis class, missing classes and empty coefficients contribute 0
+    coefficients = np.nan_to_num(
+        lookup.field_values(field, lookup.class_index(np.array(lc_values)))
+    )
+    inputs = {"lc": basis["LandCoverRaster"], "runoff": basis["RunoffLocal"]}
+    for i, raster in enumerate(basis["Classes"].values()):
+        inputs[f"class_{i}"] = raster
+
+    def evaluate(data: dict) -> dict:
+        lc, lc_valid = data["lc"]
+        runoff, runoff_valid = data["runoff"]
+        index = lookup.class_index(lc)
+        valid = lc_valid & runoff_valid & (index != -1)
+
+        block = {}
+        if "Local" in outputs:
+            block["Local"] = (runoff * lookup.field_values(field, index), valid)
+        load = np.zeros(lc.shape)
+        runoff_acc = np.zeros(lc.shape)
+        for i, coefficient in enumerate(coefficients):
+            class_acc, class_valid = data[f"class_{i}"]
+            class_acc = np.where(class_valid, class_acc, 0.0)
+            load += coefficient * class_acc
+            runoff_acc += class_acc
+        load *= 1e-6  # mg to kg
+        block["Accumulated"] = (load, valid)
+        block["Concentration"] = (concentration(load, runoff_acc), valid)
+        return block
+
+    return process_blocks(
+        evaluate,
+        inputs,
+        outputs,
+        working_arrays=len(lc_values) + 8,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
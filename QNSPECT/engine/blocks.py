@@ -0,0 +1,165 @@
+"""
+Block-streaming execution over aligned rasters.
+Inputs are read window by window following the GeoTIFF tile/strip layout so that
+peak memory is bounded by the memory budget instead of the raster size.
+"""
+
+import os
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from osgeo import gdal
+
+from QNSPECT.engine.raster_io import NO_DATA, open_raster, valid_mask
+
+# Memory budget (MB) for the arrays of one block, can be overwritten through the environment
+DEFAULT_MEMORY_MB = int(os.environ.get("QNSPECT_MEMORY_MB", 512))
+
+# Window as (xoff, yoff, xsize, ysize)
+Window = Tuple[int, int, int, int]
+
+
+class Canceled(Exception):
+    """Raised when the feedback is canceled during a computation, so that a partly written
+    raster is never returned as a finished one"""
+
+
+def check_canceled(feedback) -> None:
+    if feedback is not None and feedback.isCanceled():
+        raise Canceled("Canceled")
+
+
+def block_windows(
+    ds: gdal.Dataset, cell_bytes: int, memory_mb: int = None
+) -> List[Window]:
+    """Split the dataset in windows made of whole natural blocks.
+    cell_bytes is the memory held per cell by a block computation (all arrays and temporaries).
+    """
+    if memory_mb is None:
+        memory_mb = DEFAULT_MEMORY_MB
+    budget_cells = max(int(memory_mb * 1024 * 1024) // max(cell_bytes, 1), 1)
+    xsize, ysize = ds.RasterXSize, ds.RasterYSize
+    block_x, block_y = ds.GetRasterBand(1).GetBlockSize()
+    block_x, block_y = min(block_x, xsize), min(block_y, ysize)
+
+    # full width strips as tall as the budget allows, narrower windows only for very wide rasters
+    if xsize * block_y <= budget_cells:
+        win_x = xsize
+        win_y = max(budget_cells // xsize // block_y, 1) * block_y
+    else:
+        win_y = block_y
+        win_x = max(budget_cells // block_y // block_x, 1) * block_x
+
+    return [
+        (xoff, yoff, min(win_x, xsize - xoff), min(win_y, ysize - yoff))
+        for yoff in range(0, ysize, win_y)
+        for xoff in range(0, xsize, win_x)
+    ]
+
+
+def read_window(band: gdal.Band, window: Window) -> Tuple[np.ndarray, np.ndarray]:
+    """Read a window of a band. Returns the values and a boolean mask of valid (not NoData) cells."""
+    values = band.ReadAsArray(*window)
+    return values, valid_mask(values, band.GetNoDataValue())
+
+
+def create_output(
+    path: str, ref: gdal.Dataset, nodata: float = NO_DATA, bands: int = 1
+):
+    """Create an empty tiled Float32 GeoTIFF on the grid of ref"""
+    options = ["BIGTIFF=IF_SAFER", "TILED=YES"]
+    if bands > 1:
+        # band interleaved, so that reading one band does not read the others
+        options.append("INTERLEAVE=BAND")
+    ds = gdal.GetDriverByName("GTiff").Create(
+        str(path),
+        ref.RasterXSize,
+        ref.RasterYSize,
+        bands,
+        gdal.GDT_Float32,
+        options=options,
+    )
+    if ds is None:
+        raise IOError(f"Unable to create raster {path}")
+    ds.SetGeoTransform(ref.GetGeoTransform())
+    ds.SetProjection(ref.GetProjection())
+    for band in range(1, bands + 1):
+        ds.GetRasterBand(band).SetNoDataValue(nodata)
+    return ds
+
+
+def process_blocks(
+    func: Callable[[Dict[str, tuple]], Dict[str, tuple]],
+    inputs: Dict[str, str],
+    outputs: Dict[str, str],
+    working_arrays: int = 8,
+    memory_mb: int = None,
+    feedback=None,
+) -> Dict[str, str]:
+    """Run func over aligned input rasters window by window and write the output rasters.
+
+    func receives {input name: (values, valid)} for one window and returns
+    {output name: (values, valid)}; cells outside of valid are written as NoData.
+    working_arrays is the number of float64 arrays of a window func holds at once.
+    feedback is optional and only needs setProgress and isCanceled (e.g. QgsProcessingFeedback).
+    Raises Canceled if the feedback is canceled before all windows are written.
+    """
+    datasets = {name: open_raster(path) for name, path in inputs.items()}
+    ref = next(iter(datasets.values()))
+    for name, ds in datasets.items():
+        if (ds.RasterXSize, ds.RasterYSize) != (ref.RasterXSize, ref.RasterYSize):
+            raise ValueError(
+                f"Raster {inputs[name]} is not aligned with {next(iter(inputs.values()))}"
+            )
+    bands = {name: ds.GetRasterBand(1) for name, ds in datasets.items()}
+    out_datasets = {name: create_output(path, ref) for name, path in outputs.items()}
+
+    windows = block_windows(ref, working_arrays * 8, memory_mb)
+    for i, window in enumerate(windows):
+        check_canceled(feedback)
+        data = {name: read_window(band, window) for name, band in bands.items()}
+        for name, (values, valid) in func(data).items():
+            if name not in out_datasets:
+                continue
+            out_band = out_datasets[name].GetRasterBand(1)
+            values = np.where(valid, values, out_band.GetNoDataValue())
+            out_band.WriteArray(values.astype(np.float32), window[0], window[1])
+        if feedback is not None:
+            feedback.setProgress(100 * (i + 1) / len(windows))
+
+    for ds in out_datasets.values():
+        ds.FlushCache()
+    return outputs
+
+
+def map_rasters(
+    func: Callable[..., np.ndarray],
+    inputs: Dict[str, str],
+    output: str,
+    working_arrays: int = 4,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    """Write func(**{input name: values}) block by block.
+    Output cells are NoData wherever any of the inputs is NoData."""
+
+    def apply(data: dict) -> dict:
+        valid = np.logical_and.reduce([v for _, v in data.values()])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            values = func(**{name: values for name, (values, _) in data.items()})
+        return {"OUTPUT": (values, valid)}
+
+    process_blocks(
+        apply,
+        inputs,
+        {"OUTPUT": output},
+        working_arrays=working_arrays,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
+    return output
+
+
+def scale_raster(raster: str, factor: float, output: str, **kwargs) -> str:
+    """Multiply a raster by a constant, e.g. for unit conversions"""
+    return map_rasters(lambda a: a * factor, {"a": raster}, output, **kwargs)
@@ -0,0 +1,285 @@
+"""
+Persistent on-disk cache of run intermediates (Curve Number, LS-Factor, accumulations, flow
+routing networks, ...) and of small results derived from rasters (e.g. land cover class counts).
+Entries are keyed by a hash of the input raster contents, the lookup table columns and the
+parameters they were computed with, and evicted least recently used first above a size cap.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import Callable, Iterator, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from QNSPECT.engine.routing import FlowRouting
+
+# Bump when a cached computation changes so that stale entries are not reused
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "QNSPECT_CACHE_DIR", str(Path.home() / ".cache" / "qnspect")
+)
+# Size cap (MB) of the cache, 0 disables caching
+DEFAULT_CACHE_MB = int(os.environ.get("QNSPECT_CACHE_MB", 4096))
+
+_FINGERPRINTS_FILE = "fingerprints.json"
+_LOCK_FILE = "fingerprints.lock"
+# Seconds after which a lock is considered left behind by a crashed run
+_LOCK_TIMEOUT = 10
+_DATA_SUFFIX = ".data.json"
+_ROUTING_SUFFIX = ".routing"
+_HASH_CHUNK = 8 * 1024 * 1024
+
+
+def vrt_sources(path: str) -> list:
+    """Paths of the rasters a VRT reads (including warped VRTs), empty if it can not be parsed"""
+    try:
+        root = ElementTree.parse(path).getroot()
+    except (ElementTree.ParseError, OSError):
+        return []
+    sources = []
+    for element in root.iter():
+        if element.tag not in ("SourceFilename", "SourceDataset") or not element.text:
+            continue
+        source = element.text.strip()
+        if element.get("relativeToVRT") == "1":
+            source = os.path.join(os.path.dirname(path), source)
+        sources.append(source)
+    return sources
+
+
+class IntermediateCache:
+    """Directory of cached rasters named `<key>.tif`, flow routing networks in `<key>.routing`
+    folders and JSON results named `<key>.data.json`.
+    The modification time of an entry is its last use and drives the LRU eviction of rasters and
+    networks, JSON results are small and only removed by clear."""
+
+    def __init__(self, directory: str = None, max_size_mb: float = None):
+        self.directory = Path(directory or DEFAULT_CACHE_DIR)
+        self.max_size_mb = DEFAULT_CACHE_MB if max_size_mb is None else max_size_mb
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._fingerprints = self._load_fingerprints()
+
+    def _load_fingerprints(self) -> dict:
+        try:
+            with open(self.directory / _FINGERPRINTS_FILE) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _fingerprints_lock(self):
+        """Lock file serializing the updates of the fingerprints file between runs and processes"""
+        lock = self.directory / _LOCK_FILE
+        deadline = time.monotonic() + _LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    # left behind by a run that crashed while holding it
+                    with suppress(OSError):
+                        os.unlink(lock)
+                    deadline = time.monotonic() + _LOCK_TIMEOUT
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            with suppress(OSError):
+                os.unlink(lock)
+
+    def _save_fingerprints(self, update: dict = None, prune: bool = False):
+        """Merge update into the fingerprints file, which other runs may have extended meanwhile.
+        With prune the fingerprints of files that no longer exist are dropped."""
+        with self._fingerprints_lock():
+            fingerprints = self._load_fingerprints()
+            fingerprints.update(update or {})
+            if prune:
+                fingerprints = {
+                    k: v for k, v in fingerprints.items() if os.path.exists(k)
+                }
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(fingerprints, f)
+            os.replace(tmp, self.directory / _FINGERPRINTS_FILE)
+        self._fingerprints = fingerprints
+
+    def fingerprint(self, raster: str) -> str:
+        """SHA-1 of the raster file content.
+        Digests are remembered by path, size and modification time so unchanged files are hashed once.
+        Sources that are not files (e.g. GDAL connection strings) are fingerprinted by name, and
+        VRTs (e.g. virtual aligned rasters) by their content and the rasters they read."""
+        path = os.path.abspath(str(raster))
+        if not os.path.isfile(path):
+            return hashlib.sha1(str(raster).encode()).hexdigest()
+        if path.lower().endswith(".vrt"):
+            digest = hashlib.sha1(self._file_digest(path).encode())
+            for source in vrt_sources(path):
+                digest.update(self.fingerprint(source).encode())
+            return digest.hexdigest()
+        return self._file_digest(path)
+
+    def _file_digest(self, path: str) -> str:
+        stat = os.stat(path)
+        for reload in (False, True):
+            if reload:
+                # another run may have hashed it in the meantime
+                self._fingerprints = self._load_fingerprints()
+            known = self._fingerprints.get(path)
+            if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+                return known[2]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                digest.update(chunk)
+        self._save_fingerprints(
+            {path: [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]}
+        )
+        return digest.hexdigest()
+
+    def key(
+        self,
+        name: str,
+        rasters: Sequence[str] = (),
+        tables: Mapping[str, np.ndarray] = None,
+        params: Mapping = None,
+    ) -> str:
+        """Cache key of the intermediate `name` computed from rasters, lookup table columns and parameters"""
+        digest = hashlib.sha1(f"{CACHE_VERSION}:{name}".encode())
+        for raster in rasters:
+            digest.update(self.fingerprint(raster).encode())
+        for field, values in sorted((tables or {}).items()):
+            digest.update(field.encode())
+            digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+        return f"{name}-{digest.hexdigest()}"
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / f"{key}.tif"
+
+    def fetch(self, key: str, output: str) -> Optional[str]:
+        """Copy the cached raster to output and return output, None on a miss.
+        Entries are copied out so that a later eviction can not remove a raster still in use."""
+        entry = self._entry(key)
+        try:
+            os.utime(entry)
+            shutil.copyfile(entry, output)
+        except FileNotFoundError:
+            return None
+        return str(output)
+
+    def _fits(self, size: int) -> bool:
+        """Whether an entry of size bytes fits in the cache, larger entries would be evicted at once"""
+        return size <= self.max_size_mb * 1024**2
+
+    def store(self, key: str, raster: str) -> Optional[str]:
+        """Copy a computed raster in the cache, then evict entries above the size cap.
+        Rasters larger than the cap are not copied, returns None."""
+        if not self._fits(os.path.getsize(raster)):
+            return None
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(raster, tmp)
+        os.replace(tmp, self._entry(key))
+        self.evict()
+        return str(self._entry(key))
+
+    def fetch_data(self, key: str):
+        """JSON result stored under key, None on a miss"""
+        entry = self.directory / f"{key}{_DATA_SUFFIX}"
+        try:
+            with open(entry) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(entry)
+        return data
+
+    def store_data(self, key: str, data) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.directory / f"{key}{_DATA_SUFFIX}")
+
+    def fetch_routing(self, key: str) -> Optional[FlowRouting]:
+        """Memory-mapped flow routing network stored under key, None on a miss"""
+        entry = self.directory / f"{key}{_ROUTING_SUFFIX}"
+        try:
+            routing = FlowRouting.load(entry, mmap=True)
+            os.utime(entry)
+        except OSError:
+            return None
+        return routing
+
+    def store_routing(self, key: str, routing: FlowRouting) -> None:
+        """Save a flow routing network, then evict entries above the size cap.
+        Networks larger than the cap are not saved."""
+        arrays = (routing.sources, routing.targets, routing.fractions)
+        if not self._fits(sum(a.nbytes for a in arrays if a is not None)):
+            return
+        routing.save(self.directory / f"{key}{_ROUTING_SUFFIX}")
+        self.evict()
+
+    def get_or_create(self, key: str, compute: Callable[[], str], output: str) -> str:
+        """Fetch the raster of key to output, or compute it (returns the written path) and store it"""
+        cached = self.fetch(key, output)
+        if cached is not None:
+            return cached
+        result = compute()
+        self.store(key, result)
+        return result
+
+    def _entries(self) -> Iterator[Tuple[float, int, Path]]:
+        """(last use, size, path) of the cached rasters and routing networks"""
+        for path in self.directory.glob("*.tif"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # evicted by another run in the meantime
+            yield stat.st_mtime, stat.st_size, path
+        for path in self.directory.glob(f"*{_ROUTING_SUFFIX}"):
+            try:
+                size = sum(p.stat().st_size for p in path.iterdir())
+                last_use = path.stat().st_mtime
+            except OSError:
+                continue
+            yield last_use, size, path
+
+    def size_mb(self) -> float:
+        return sum(size for _, size, _ in self._entries()) / 1024**2
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size_mb,
+        and the fingerprints of deleted files"""
+        self._save_fingerprints(prune=True)
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_size_mb * 1024**2
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+            except OSError:
+                continue  # in use by another process, retried on the next eviction
+            total -= size
+
+    def clear(self):
+        for pattern in ("*.tif", f"*{_DATA_SUFFIX}"):
+            for path in self.directory.glob(pattern):
+                path.unlink()
+        for path in self.directory.glob(f"*{_ROUTING_SUFFIX}"):
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,34 @@
+"""
+Cell by cell comparison of two scenario rasters
+"""
+
+from QNSPECT.engine.blocks import map_rasters
+
+
+def direct_difference(a, b):
+    return a - b
+
+
+def percent_difference(a, b):
+    # example A = [[5,1]] and B = [[1,2]] result = [[400%,-50%]] interpreted as [[A increased 400%, A decreased 50%]]
+    return 100 * ((a - b) / b)
+
+
+COMPARISONS = {"Direct": direct_difference, "Percent": percent_difference}
+
+
+def compare_rasters(
+    raster_a: str,
+    raster_b: str,
+    compare_type: str,
+    output: str,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    return map_rasters(
+        COMPARISONS[compare_type],
+        {"a": raster_a, "b": raster_b},
+        output,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
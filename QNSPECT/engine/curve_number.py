@@ -0,0 +1,66 @@
+"""
+Curve Number generation by gathering from the lookup table with (land cover, hydrologic soil group) indices
+"""
+
+import numpy as np
+
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.blocks import process_blocks
+
+# replacement soil group for dual category soils {hsg: replacement}
+DUAL_SOIL_RECLASS = {
+    0: {5: 4, 6: 4, 7: 4, 8: 4, 9: 4},  # Undrained
+    1: {5: 1, 6: 2, 7: 3, 8: 4, 9: 4},  # Drained
+}
+
+
+def soil_group_column(hsg: np.ndarray, dual_soil_type: int) -> np.ndarray:
+    """Column of LookupTable.curve_number_table for each soil cell.
+    Dual category soils are replaced per DUAL_SOIL_RECLASS, anything outside of 1-9 gets column 0.
+    """
+    columns = np.array([0, 1, 2, 3, 4, 0, 0, 0, 0, 0])
+    for old, new in DUAL_SOIL_RECLASS[dual_soil_type].items():
+        columns[old] = new
+    if np.issubdtype(hsg.dtype, np.integer):
+        return columns[np.where((hsg >= 0) & (hsg <= 9), hsg, 0)]
+    valid = np.isin(hsg, np.arange(10))
+    return columns[np.where(valid, hsg, 0).astype(np.intp)]
+
+
+def curve_number(
+    lookup: LookupTable, lc_index: np.ndarray, hsg: np.ndarray, dual_soil_type: int
+) -> np.ndarray:
+    """CN for each cell, a single gather from the (land cover, soil group) table.
+    With dual_soil_type 2 the undrained and drained CN are averaged."""
+    table = lookup.curve_number_table()
+    if dual_soil_type in [0, 1]:
+        return table[lc_index, soil_group_column(hsg, dual_soil_type)]
+
+    columns = (soil_group_column(hsg, 0), soil_group_column(hsg, 1))
+    return (table[lc_index, columns[0]] + table[lc_index, columns[1]]) / 2
+
+
+def write_curve_number_raster(
+    lc_raster: str,
+    soil_raster: str,
+    lookup: LookupTable,
+    dual_soil_type: int,
+    output: str,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    def cn_block(data: dict) -> dict:
+        lc, lc_valid = data["lc"]
+        hsg, hsg_valid = data["hsg"]
+        cn = curve_number(lookup, lookup.class_index(lc), hsg, dual_soil_type)
+        return {"CN": (cn, lc_valid & hsg_valid)}
+
+    process_blocks(
+        cn_block,
+        {"lc": lc_raster, "hsg": soil_raster},
+        {"CN": output},
+        working_arrays=6,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
+    return output
@@ -0,0 +1,166 @@
+"""
+RUSLE, Sediment Delivery Ratio and sediment yield kernels of the erosion analysis
+"""
+
+import math
+from typing import Dict
+
+import numpy as np
+
+from QNSPECT.engine.blocks import map_rasters, process_blocks
+from QNSPECT.engine.curve_number import curve_number
+from QNSPECT.engine.lookup import LookupTable
+
+DEFAULT_URBAN_K_FACTOR_VALUE = 0.3
+
+
+def fill_zero_k_factor(k: np.ndarray) -> np.ndarray:
+    """Zero values in the K-Factor grid should be assumed "urban" and given a default value."""
+    return np.where(k == 0, DEFAULT_URBAN_K_FACTOR_VALUE, np.where(k > 0, k, 0))
+
+
+def rusle(c, ls, k, r, cell_size_sq_meters: float) -> np.ndarray:
+    """RUSLE Soil Loss (ton/year) of each cell"""
+    ## -- The unit of RUSLE Soil Loss  is ton/acre/year
+    ## -- multiply by 0.0002 to convert from sq meters to acres
+    cell_size_acres = cell_size_sq_meters * 0.000247104369
+    return c * ls * k * r * cell_size_acres
+
+
+def sediment_delivery_ratio(rl, cn, cell_size_sq_meters: float) -> np.ndarray:
+    cell_size_sq_km = (math.sqrt(cell_size_sq_meters) / 1_000.0) ** 2
+    return (
+        1.366
+        * (10**-11)
+        * (cell_size_sq_km**-0.0998)
+        * np.power(rl, 0.3629, dtype=np.float64)
+        * np.power(cn, 5.444, dtype=np.float64)
+    )
+
+
+def sediment_yield(sdr, soil_loss) -> np.ndarray:
+    """Local sediment (kg/year)"""
+    return (
+        sdr * soil_loss * 907.18474
+    )  # Multiply by 907.18474 to convert from ton to kg
+
+
+def fill_zero_k_factor_raster(k_raster: str, output: str, **kwargs) -> str:
+    return map_rasters(fill_zero_k_factor, {"k": k_raster}, output, **kwargs)
+
+
+def rusle_raster(
+    c_raster: str,
+    ls_raster: str,
+    k_raster: str,
+    r_raster: str,
+    cell_size_sq_meters: float,
+    output: str,
+    **kwargs,
+) -> str:
+    return map_rasters(
+        lambda c, ls, k, r: rusle(c, ls, k, r, cell_size_sq_meters),
+        {"c": c_raster, "ls": ls_raster, "k": k_raster, "r": r_raster},
+        output,
+        working_arrays=6,
+        **kwargs,
+    )
+
+
+def sediment_delivery_ratio_raster(
+    rl_raster: str, cn_raster: str, cell_size_sq_meters: float, output: str, **kwargs
+) -> str:
+    return map_rasters(
+        lambda rl, cn: sediment_delivery_ratio(rl, cn, cell_size_sq_meters),
+        {"rl": rl_raster, "cn": cn_raster},
+        output,
+        **kwargs,
+    )
+
+
+def sediment_yield_raster(
+    sdr_raster: str, rusle_raster: str, output: str, **kwargs
+) -> str:
+    return map_rasters(
+        sediment_yield, {"sdr": sdr_raster, "soil_loss": rusle_raster}, output, **kwargs
+    )
+
+
+def sediment_rasters(
+    data: dict,
+    lookup: LookupTable,
+    dual_soil_type: int,
+    cell_size_sq_meters: float,
+) -> dict:
+    """C-Factor, CN, RUSLE (ton), SDR and Sediment Local (kg and Mg) of one block.
+    data holds the (values, valid) of the `lc`, `hsg`, `k`, `r`, `ls` and `rl` rasters, see process_blocks.
+    NoData propagates as in the chain of single rasters."""
+    lc, lc_valid = data["lc"]
+    hsg, hsg_valid = data["hsg"]
+    k, k_valid = data["k"]
+    r, r_valid = data["r"]
+    ls, ls_valid = data["ls"]
+    rl, rl_valid = data["rl"]
+
+    lc_index = lookup.class_index(lc)
+    c = lookup.field_values("c_factor", lc_index)
+    c_valid = lc_valid & (lc_index != -1)
+    cn = curve_number(lookup, lc_index, hsg, dual_soil_type)
+    cn_valid = lc_valid & hsg_valid
+
+    with np.errstate(invalid="ignore", over="ignore"):
+        soil_loss = rusle(
+            c, ls, fill_zero_k_factor(k), r.astype(np.float64), cell_size_sq_meters
+        )
+        sdr = sediment_delivery_ratio(rl, cn, cell_size_sq_meters)
+    rusle_valid = c_valid & ls_valid & k_valid & r_valid
+    sdr_valid = rl_valid & cn_valid
+
+    sediment = sediment_yield(sdr, soil_loss)  # kg
+    sediment_valid = rusle_valid & sdr_valid
+    return {
+        "C-Factor": (c, c_valid),
+        "Curve Number": (cn, cn_valid),
+        "RUSLE": (soil_loss, rusle_valid),
+        "Sediment Delivery Ratio": (sdr, sdr_valid),
+        "Sediment Local": (sediment, sediment_valid),
+        "Sediment Local Mg": (sediment / 1000, sediment_valid),
+    }
+
+
+def compute_sediment_rasters(
+    lc_raster: str,
+    soil_raster: str,
+    k_raster: str,
+    r_raster: str,
+    ls_raster: str,
+    rl_raster: str,
+    lookup: LookupTable,
+    outputs: Dict[str, str],
+    dual_soil_type: int,
+    cell_size_sq_meters: float,
+    memory_mb: int = None,
+    feedback=None,
+) -> Dict[str, str]:
+    """Compute and write the sediment rasters in one pass over the inputs, block by block.
+
+    outputs maps the raster name to its output path, valid names are the keys of
+    sediment_rasters, e.g. `Sediment Local` (kg) and `Sediment Local Mg` for the accumulation.
+    Names missing from outputs are not written."""
+    return process_blocks(
+        lambda data: sediment_rasters(
+            data, lookup, dual_soil_type, cell_size_sq_meters
+        ),
+        {
+            "lc": lc_raster,
+            "hsg": soil_raster,
+            "k": k_raster,
+            "r": r_raster,
+            "ls": ls_raster,
+            "rl": rl_raster,
+        },
+        outputs,
+        working_arrays=16,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
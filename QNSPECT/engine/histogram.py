@@ -0,0 +1,44 @@
+"""
+Cell counts of the classes (unique values) of a raster in a single streaming pass
+"""
+
+from typing import Dict
+
+import numpy as np
+
+from QNSPECT.engine.blocks import block_windows, check_canceled, read_window
+from QNSPECT.engine.raster_io import open_raster
+
+# Largest value range of an integer block counted with np.bincount, wider ranges use np.unique
+_BINCOUNT_RANGE = 1 << 20
+
+
+def block_counts(values: np.ndarray):
+    """Unique values of an array and their counts"""
+    if values.size == 0:
+        return values, np.zeros(0, dtype=np.int64)
+    if np.issubdtype(values.dtype, np.integer):
+        low, high = int(values.min()), int(values.max())
+        if high - low < _BINCOUNT_RANGE:
+            counts = np.bincount((values - low).astype(np.intp))
+            present = np.flatnonzero(counts)
+            return present + low, counts[present]
+    return np.unique(values, return_counts=True)
+
+
+def class_counts(raster: str, memory_mb: int = None, feedback=None) -> Dict[float, int]:
+    """Number of cells of each value of a raster, NoData excluded.
+    feedback is optional (setProgress, isCanceled), raises Canceled if it is canceled."""
+    ds = open_raster(raster)
+    band = ds.GetRasterBand(1)
+    totals: Dict[float, int] = {}
+    windows = block_windows(ds, 3 * 8, memory_mb)
+    for i, window in enumerate(windows):
+        check_canceled(feedback)
+        values, valid = read_window(band, window)
+        for value, count in zip(*block_counts(values[valid])):
+            value = float(value)
+            totals[value] = totals.get(value, 0) + int(count)
+        if feedback is not None:
+            feedback.setProgress(100 * (i + 1) / len(windows))
+    return dict(sorted(totals.items()))
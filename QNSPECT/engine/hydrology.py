@@ -0,0 +1,441 @@
+"""
+Native flow directions, flow routing and LS-Factor from a DEM.
+
+Depressions are handled with a priority-flood from the raster edges and NoData cells
+(Barnes et al. 2014), which, like the A* search of r.watershed, routes flow through depressions
+to their spill point instead of stopping at pits.
+Cells with a downslope neighbor on the flooded surface drain along the steepest descent (D8) or
+to all downslope neighbors (MFD, Holmgren 1994), flats drain toward their nearest cell with a
+downslope neighbor.
+"""
+
+import math
+from typing import Tuple
+
+import numpy as np
+
+from QNSPECT.engine.raster_io import read_array, raster_grid, write_array
+from QNSPECT.engine.routing import FlowRouting, _edge_positions
+from QNSPECT.engine.scheduler import available_memory_mb
+from QNSPECT.engine.terrain import relief_length_ratio
+
+# (row, column) offsets of the 8 neighbors
+NEIGHBOR_OFFSETS = [
+    (-1, 1),
+    (-1, 0),
+    (-1, -1),
+    (0, -1),
+    (1, -1),
+    (1, 0),
+    (1, 1),
+    (0, 1),
+]
+
+# r.watershed default MFD convergence factor
+DEFAULT_CONVERGENCE = 5
+
+# Peak memory per cell (bytes) of the whole-DEM arrays, dominated by the (8, rows, cols) float64
+# neighbor drops, weights and fractions of MFD
+MFD_BYTES_PER_CELL = 400
+D8_BYTES_PER_CELL = 200
+
+
+def priority_flood(dem: np.ndarray, valid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Flood the DEM from its edges and NoData cells.
+    Returns the flooded surface (depressions raised to their spill elevation) and, for each cell
+    of a flat (no lower neighbor on the flooded surface), the flat index of the neighbor it drains
+    toward (-1 for other cells, edge cells and NoData).
+
+    The surface is the one of the priority queue of Barnes et al. 2014, computed with whole array
+    operations on the graph of depressions instead of cell by cell, see _spill_levels."""
+    rows, cols = dem.shape
+    # padding with a NoData ring removes bound checks
+    width = cols + 2
+    padded_valid = np.zeros((rows + 2, width), dtype=bool)
+    padded_valid[1:-1, 1:-1] = valid
+    offsets = np.array([dr * width + dc for dr, dc in NEIGHBOR_OFFSETS])
+
+    # edge cells have a NoData neighbor
+    edge = np.zeros_like(padded_valid)
+    for dr, dc in NEIGHBOR_OFFSETS:
+        edge[1:-1, 1:-1] |= ~padded_valid[
+            1 + dr : rows + 1 + dr, 1 + dc : cols + 1 + dc
+        ]
+    edge &= padded_valid
+    padded_valid, edge = padded_valid.ravel(), edge.ravel()
+
+    # NoData is at infinity so that it is never a lowest neighbor
+    elevation = np.full((rows + 2, width), np.inf)
+    elevation[1:-1, 1:-1] = np.where(valid, dem, np.inf)
+    elevation = elevation.ravel()
+
+    # every cell descends to its lowest neighbor (the first one of equally low neighbors,
+    # so that flats descend too) until a pit or an edge cell
+    cells = np.flatnonzero(padded_valid)
+    neighbors = cells[:, None] + offsets
+    neighbor_elevation = elevation[neighbors]
+    lowest = neighbor_elevation.min(axis=1)
+    first = np.where(neighbor_elevation == lowest[:, None], neighbors, elevation.size)
+    first = first.min(axis=1)
+    descends = ~edge[cells] & (
+        (lowest < elevation[cells]) | ((lowest == elevation[cells]) & (first < cells))
+    )
+    downhill = np.arange(elevation.size)
+    downhill[cells[descends]] = first[descends]
+    while True:
+        jumped = downhill[downhill]
+        if np.array_equal(jumped, downhill):
+            break
+        downhill = jumped
+
+    # depressions drain to their pit, 0 drains out of the raster through an edge cell
+    pits = np.flatnonzero(
+        padded_valid & ~edge & (downhill == np.arange(elevation.size))
+    )
+    depression = np.zeros(elevation.size, dtype=np.int64)
+    depression[pits] = np.arange(1, pits.size + 1)
+    depression = depression[downhill]
+
+    # neighbors in different depressions, each pair once
+    forward = offsets[offsets > 0]
+    a = np.repeat(cells, forward.size)
+    b = (cells[:, None] + forward).ravel()
+    pair = padded_valid[b] & (depression[a] != depression[b])
+    a, b = a[pair], b[pair]
+    spill = _spill_levels(
+        pits.size + 1,
+        depression[a],
+        depression[b],
+        np.maximum(elevation[a], elevation[b]),
+    )
+    level = np.maximum(elevation, spill[depression])
+
+    # flats drain toward their outlets, found breadth first from the cells
+    # that do not need a parent: cells with a lower neighbor and edge cells
+    parent = np.full(level.size, -1, dtype=np.int64)
+    cells = np.flatnonzero(padded_valid)
+    has_lower = np.zeros(level.size, dtype=bool)
+    has_lower[cells] = level[cells[:, None] + offsets].min(axis=1) < level[cells]
+    reached = ~padded_valid | edge | has_lower
+    frontier = np.flatnonzero(padded_valid & reached)
+    while frontier.size:
+        source = np.repeat(frontier, offsets.size)
+        cell = (frontier[:, None] + offsets).ravel()
+        drains = ~reached[cell] & (level[cell] == level[source])
+        cell, source = cell[drains], source[drains]
+        parent[cell] = source
+        reached[cell] = True
+        # one of the sources of a cell is kept
+        frontier = cell[parent[cell] == source]
+
+    # back to flat indices of the unpadded raster
+    flooded = level.reshape(rows + 2, width)[1:-1, 1:-1]
+    flooded = np.where(valid, flooded, 0.0)
+    parent = parent.reshape(rows + 2, width)[1:-1, 1:-1]
+    has_parent = parent >= 0
+    parent = np.where(has_parent, (parent // width - 1) * cols + parent % width - 1, -1)
+    return flooded, parent
+
+
+def _spill_levels(
+    count: int, a: np.ndarray, b: np.ndarray, weight: np.ndarray
+) -> np.ndarray:
+    """Spill level of each of count depressions, node 0 being out of the raster, where
+    depression a[i] overflows into b[i] (and b[i] into a[i]) once the water is at weight[i].
+    It is the lowest level at which a depression connects to 0, the highest weight on the path to 0
+    of the minimum spanning tree, found with Boruvka's algorithm."""
+    order = np.argsort(weight, kind="stable")
+    a, b, weight = a[order], b[order], weight[order]
+    edges = np.arange(weight.size)
+
+    # each component joins the component of its lowest outgoing edge, until there is one
+    component = np.arange(count)
+    tree = []
+    while True:
+        ca, cb = component[a[edges]], component[b[edges]]
+        outgoing = ca != cb
+        edges, ca, cb = edges[outgoing], ca[outgoing], cb[outgoing]
+        if not edges.size:
+            break
+        best = np.full(count, weight.size)
+        np.minimum.at(best, ca, edges)
+        np.minimum.at(best, cb, edges)
+        joining = np.flatnonzero(best < weight.size)
+        chosen = best[joining]
+        tree.append(np.unique(chosen))
+
+        other = component[a[chosen]]
+        other = np.where(other == joining, component[b[chosen]], other)
+        parent = np.arange(count)
+        parent[joining] = other
+        # two components that chose the same edge: the lower one stays the root
+        mutual = parent[parent] == np.arange(count)
+        parent[mutual & (parent > np.arange(count))] = np.flatnonzero(
+            mutual & (parent > np.arange(count))
+        )
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+        component = parent[component]
+
+    # highest weight on the tree path from 0, breadth first
+    tree = np.concatenate(tree) if tree else np.zeros(0, dtype=np.int64)
+    source = np.concatenate([a[tree], b[tree]])
+    target = np.concatenate([b[tree], a[tree]])
+    tree_weight = np.concatenate([weight[tree], weight[tree]])
+    order = np.argsort(source, kind="stable")
+    source, target, tree_weight = source[order], target[order], tree_weight[order]
+    degree = np.bincount(source, minlength=count)
+    first_edge = np.concatenate([[0], np.cumsum(degree)[:-1]])
+
+    spill = np.full(count, np.nan)
+    spill[0] = -np.inf
+    frontier = np.array([0])
+    while frontier.size:
+        positions = _edge_positions(first_edge[frontier], degree[frontier])
+        reached = target[positions]
+        new = np.isnan(spill[reached])
+        spill[reached[new]] = np.maximum(
+            spill[source[positions[new]]], tree_weight[positions[new]]
+        )
+        frontier = reached[new]
+    return spill
+
+
+def _neighbor_drops(
+    surface: np.ndarray, valid: np.ndarray, cell_size: Tuple[float, float]
+) -> np.ndarray:
+    """Slope (drop / distance) toward each of the 8 neighbors, shape (8, rows, cols).
+    Neighbors outside of the raster or NoData get -inf."""
+    rows, cols = surface.shape
+    padded = np.full((rows + 2, cols + 2), -np.inf)
+    padded[1:-1, 1:-1] = np.where(valid, surface, -np.inf)
+    drops = np.empty((8, rows, cols))
+    for i, (dr, dc) in enumerate(NEIGHBOR_OFFSETS):
+        distance = math.hypot(dr * cell_size[1], dc * cell_size[0])
+        neighbor = padded[1 + dr : rows + 1 + dr, 1 + dc : cols + 1 + dc]
+        with np.errstate(invalid="ignore"):
+            drops[i] = np.where(
+                np.isinf(neighbor), -np.inf, (surface - neighbor) / distance
+            )
+    return drops
+
+
+def _neighbor_index(rows: int, cols: int) -> np.ndarray:
+    """Flat index of each of the 8 neighbors, shape (8, rows, cols). Clipped at the raster edge."""
+    r, c = np.indices((rows, cols))
+    return np.stack(
+        [
+            np.clip(r + dr, 0, rows - 1) * cols + np.clip(c + dc, 0, cols - 1)
+            for dr, dc in NEIGHBOR_OFFSETS
+        ]
+    )
+
+
+def d8_directions(
+    dem: np.ndarray, valid: np.ndarray, cell_size: Tuple[float, float]
+) -> np.ndarray:
+    """Flat index of the downstream cell of each cell, -1 where flow leaves the raster or for NoData"""
+    flooded, parent = priority_flood(dem, valid)
+    drops = _neighbor_drops(flooded, valid, cell_size)
+    steepest = np.argmax(drops, axis=0)
+    downslope = np.take_along_axis(drops, steepest[None], axis=0)[0] > 0
+    neighbors = _neighbor_index(*dem.shape)
+    receiver = np.take_along_axis(neighbors, steepest[None], axis=0)[0]
+    return np.where(valid, np.where(downslope, receiver, parent), -1)
+
+
+def d8_routing(
+    dem: np.ndarray, valid: np.ndarray, cell_size: Tuple[float, float]
+) -> FlowRouting:
+    """Single flow direction routing"""
+    downstream = d8_directions(dem, valid, cell_size).ravel()
+    sources = np.flatnonzero(downstream >= 0)
+    return FlowRouting(dem.shape, sources, downstream[sources])
+
+
+def mfd_routing(
+    dem: np.ndarray,
+    valid: np.ndarray,
+    cell_size: Tuple[float, float],
+    convergence: float = DEFAULT_CONVERGENCE,
+) -> FlowRouting:
+    """Multiple flow direction routing. Flow is split between downslope neighbors proportionally
+    to slope ** convergence, flats drain to the cell they were flooded from."""
+    flooded, parent = priority_flood(dem, valid)
+    drops = _neighbor_drops(flooded, valid, cell_size)
+    downslope = drops > 0
+    weights = np.where(downslope, np.power(np.maximum(drops, 0), convergence), 0)
+    total = weights.sum(axis=0)
+    # slopes so small that the power underflows still drain to the steepest neighbor
+    steepest = np.argmax(drops, axis=0)
+    underflow = downslope.any(axis=0) & (total == 0)
+    steepest_weight = np.take_along_axis(weights, steepest[None], 0)[0]
+    np.put_along_axis(
+        weights, steepest[None], np.where(underflow, 1.0, steepest_weight)[None], 0
+    )
+    total = np.where(underflow, 1.0, total)
+
+    neighbors = _neighbor_index(*dem.shape)
+    split = valid & (total > 0)
+    fractions = np.divide(weights, total, out=np.zeros_like(weights), where=split)
+    k, r, c = np.nonzero(fractions > 0)
+    sources = [r * dem.shape[1] + c]
+    targets = [neighbors[k, r, c]]
+    shares = [fractions[k, r, c]]
+
+    flat = valid & ~split & (parent >= 0)
+    sources.append(np.flatnonzero(flat))
+    targets.append(parent[flat])
+    shares.append(np.ones(int(flat.sum())))
+    return FlowRouting(
+        dem.shape,
+        np.concatenate(sources),
+        np.concatenate(targets),
+        np.concatenate(shares),
+    )
+
+
+def ls_factor(
+    dem: np.ndarray,
+    valid: np.ndarray,
+    cell_size: Tuple[float, float],
+    threshold: int = 500,
+    max_slope_length: float = None,
+) -> np.ndarray:
+    """RUSLE LS-Factor (McCool et al. 1987, 1989) along the D8 flow paths.
+    Elevation and cell size must be in meters. Slope length is the longest flow path from the
+    ridge and restarts on streams (flow accumulation above threshold cells), as in r.watershed."""
+    rows, cols = dem.shape
+    downstream = d8_directions(dem, valid, cell_size).ravel()
+    sources = np.flatnonzero(downstream >= 0)
+    receivers = downstream[sources]
+    routing = FlowRouting(dem.shape, sources, receivers)
+
+    # length and gradient of the outgoing flow segment of each cell
+    diagonal = (sources // cols != receivers // cols) & (
+        sources % cols != receivers % cols
+    )
+    straight = np.where(
+        sources // cols == receivers // cols, cell_size[0], cell_size[1]
+    )
+    segment = np.full(rows * cols, (cell_size[0] + cell_size[1]) / 2)
+    segment[sources] = np.where(diagonal, math.hypot(*cell_size), straight)
+    elevation = dem.astype(np.float64).ravel()
+    gradient = np.zeros(rows * cols)
+    gradient[sources] = (
+        np.maximum(elevation[sources] - elevation[receivers], 0) / segment[sources]
+    )
+
+    stream = routing.accumulate(valid.astype(np.float64)).ravel() >= threshold
+
+    # longest upstream path, routing edges are already in topological order
+    slope_length = segment.copy()
+    for start, stop in routing.levels:
+        src = routing.sources[start:stop]
+        dst = routing.targets[start:stop]
+        from_upstream = np.where(stream[dst], 0, slope_length[src]) + segment[dst]
+        np.maximum.at(slope_length, dst, from_upstream)
+    if max_slope_length:
+        np.minimum(slope_length, max_slope_length, out=slope_length)
+
+    sin_theta = np.sin(np.arctan(gradient))
+    rill_ratio = (sin_theta / 0.0896) / (3.0 * np.power(sin_theta, 0.8) + 0.56)
+    m = rill_ratio / (1 + rill_ratio)
+    l_factor = np.power(slope_length / 22.13, m)
+    s_factor = np.where(
+        gradient < 0.09, 10.8 * sin_theta + 0.03, 16.8 * sin_theta - 0.5
+    )
+    return (l_factor * s_factor).reshape(dem.shape)
+
+
+def check_memory(grid, bytes_per_cell: int, name: str):
+    """Raise MemoryError if name of the grid needs more memory than is available"""
+    needed_mb = grid.xsize * grid.ysize * bytes_per_cell / 1024**2
+    available_mb = available_memory_mb()
+    if available_mb is not None and needed_mb > available_mb:
+        raise MemoryError(
+            f"{name} of the {grid.xsize} x {grid.ysize} Elevation Raster needs about "
+            f"{needed_mb:.0f} MB of memory, {available_mb:.0f} MB are available"
+        )
+
+
+def _read_dem(
+    elevation_raster: str, bytes_per_cell: int, name: str, meters_per_unit=1.0
+):
+    grid = raster_grid(elevation_raster)
+    check_memory(grid, bytes_per_cell, name)
+    dem, valid = read_array(elevation_raster)
+    cell_size = (
+        abs(grid.geotransform[1]) * meters_per_unit,
+        abs(grid.geotransform[5]) * meters_per_unit,
+    )
+    return dem.astype(np.float64), valid, cell_size, grid
+
+
+def flow_routing(
+    elevation_raster: str, mfd: bool = False, convergence: float = DEFAULT_CONVERGENCE
+) -> FlowRouting:
+    """D8 or MFD flow routing of an elevation raster.
+    Raises MemoryError before reading the raster if it does not fit in the available memory."""
+    if mfd:
+        dem, valid, cell_size, _ = _read_dem(
+            elevation_raster, MFD_BYTES_PER_CELL, "MFD flow routing"
+        )
+    else:
+        dem, valid, cell_size, _ = _read_dem(
+            elevation_raster, D8_BYTES_PER_CELL, "D8 flow routing"
+        )
+    if mfd:
+        return mfd_routing(dem, valid, cell_size, convergence)
+    return d8_routing(dem, valid, cell_size)
+
+
+def ls_factor_raster(
+    elevation_raster: str,
+    output: str,
+    meters_per_unit: float = 1.0,
+    threshold: int = 500,
+    max_slope_length: float = None,
+) -> str:
+    """Write the LS-Factor of an elevation raster in meters.
+    meters_per_unit converts the CRS units of the cell size to meters.
+    Raises MemoryError before reading the raster if it does not fit in the available memory."""
+    dem, valid, cell_size, grid = _read_dem(
+        elevation_raster, D8_BYTES_PER_CELL, "LS-Factor", meters_per_unit
+    )
+    ls = ls_factor(dem, valid, cell_size, threshold, max_slope_length)
+    return write_array(output, ls, grid, valid)
+
+
+def terrain_rasters(
+    elevation_raster: str,
+    ls_output: str,
+    rl_output: str,
+    meters_per_unit: float = 1.0,
+    threshold: int = 500,
+    max_slope_length: float = None,
+) -> Tuple[str, str]:
+    """Write the LS-Factor and the relief length ratio of an elevation raster in meters from one
+    read of the DEM, see ls_factor_raster and terrain.relief_length_ratio_raster.
+    meters_per_unit converts the CRS units of the cell size to meters for the LS-Factor, the relief
+    length ratio keeps the CRS units as native:slope.
+    Raises MemoryError before reading the raster if it does not fit in the available memory."""
+    dem, valid, cell_size, grid = _read_dem(
+        elevation_raster, D8_BYTES_PER_CELL, "LS-Factor", meters_per_unit
+    )
+    ls = ls_factor(dem, valid, cell_size, threshold, max_slope_length)
+    write_array(ls_output, ls, grid, valid)
+    del ls
+
+    # cells outside of the raster are left out of the slope kernel
+    rl, rl_valid = relief_length_ratio(
+        np.pad(dem, 1),
+        np.pad(valid, 1),
+        abs(grid.geotransform[1]),
+        abs(grid.geotransform[5]),
+    )
+    write_array(rl_output, rl, grid, rl_valid)
+    return ls_output, rl_output
@@ -0,0 +1,190 @@
+"""
+Incremental re-analysis of a land cover modification.
+
+Local rasters only change inside the window of the modified cells. Accumulation is linear in its
+weight, so accumulated rasters only change downstream of the modified cells, by the accumulated
+change of the local rasters:
+
+    accumulated(modified) = accumulated(baseline) + accumulated(local(modified) - local(baseline))
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from QNSPECT.engine.blocks import Window, block_windows, read_window
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.pollution import concentration, local_rasters
+from QNSPECT.engine.raster_io import open_raster
+from QNSPECT.engine.routing import FlowRouting
+
+
+def changed_window(
+    baseline_raster: str, modified_raster: str, memory_mb: int = None
+) -> Optional[Window]:
+    """Bounding window of the cells whose value or NoData differs between two aligned rasters.
+    None if the rasters are equal."""
+    baseline = open_raster(baseline_raster)
+    modified = open_raster(modified_raster)
+    if (baseline.RasterXSize, baseline.RasterYSize) != (
+        modified.RasterXSize,
+        modified.RasterYSize,
+    ):
+        raise ValueError(
+            f"Raster {modified_raster} is not aligned with {baseline_raster}"
+        )
+    baseline_band = baseline.GetRasterBand(1)
+    modified_band = modified.GetRasterBand(1)
+
+    rows, cols = [], []
+    for window in block_windows(baseline, 4 * 8, memory_mb):
+        base_values, base_valid = read_window(baseline_band, window)
+        values, valid = read_window(modified_band, window)
+        changed = (base_valid != valid) | (valid & (base_values != values))
+        if changed.any():
+            r = np.flatnonzero(changed.any(axis=1))
+            c = np.flatnonzero(changed.any(axis=0))
+            rows += [window[1] + r[0], window[1] + r[-1]]
+            cols += [window[0] + c[0], window[0] + c[-1]]
+    if not rows:
+        return None
+    return (min(cols), min(rows), max(cols) - min(cols) + 1, max(rows) - min(rows) + 1)
+
+
+def window_local_rasters(
+    lc_raster: str,
+    soil_raster: str,
+    precip_raster: str,
+    window: Window,
+    lookup: LookupTable,
+    pollutants: Dict[str, str],
+    dual_soil_type: int,
+    precip_units: int,
+    raining_days: int,
+    cell_area_sq_feet: float,
+) -> dict:
+    """Runoff Local (L) and pollutant loads (mg and kg) inside a window, see pollution.local_rasters"""
+    data = {}
+    for name, path in (
+        ("lc", lc_raster),
+        ("hsg", soil_raster),
+        ("precip", precip_raster),
+    ):
+        data[name] = read_window(open_raster(path).GetRasterBand(1), window)
+    return local_rasters(
+        data,
+        lookup,
+        pollutants,
+        dual_soil_type,
+        precip_units,
+        raining_days,
+        cell_area_sq_feet,
+    )
+
+
+def local_change(baseline: tuple, modified: tuple) -> np.ndarray:
+    """Change of a local raster (values, valid), NoData counts as 0"""
+    base_values, base_valid = baseline
+    values, valid = modified
+    return np.where(valid, values, 0.0) - np.where(base_valid, base_values, 0.0)
+
+
+def write_window(path: str, window: Window, values: np.ndarray, valid: np.ndarray):
+    """Overwrite a window of an existing raster. Cells outside of valid are written as NoData."""
+    ds = open_raster(path, update=True)
+    band = ds.GetRasterBand(1)
+    values = np.where(valid, values, band.GetNoDataValue())
+    band.WriteArray(values.astype(np.float32), window[0], window[1])
+    band.FlushCache()
+
+
+def mask_window(path: str, window: Window, valid: np.ndarray):
+    """Set the cells of a window of an existing raster outside of valid to NoData"""
+    ds = open_raster(path, update=True)
+    band = ds.GetRasterBand(1)
+    values = band.ReadAsArray(*window)
+    band.WriteArray(
+        np.where(valid, values, band.GetNoDataValue()), window[0], window[1]
+    )
+    band.FlushCache()
+
+
+def cells_window(cells: np.ndarray, shape: Tuple[int, int]) -> Optional[Window]:
+    """Bounding window of cells (flat indices). None if there are no cells."""
+    if not len(cells):
+        return None
+    rows, cols = np.divmod(cells, shape[1])
+    return (
+        int(cols.min()),
+        int(rows.min()),
+        int(cols.max() - cols.min() + 1),
+        int(rows.max() - rows.min() + 1),
+    )
+
+
+def union_window(first: Optional[Window], second: Optional[Window]) -> Optional[Window]:
+    if first is None or second is None:
+        return first or second
+    x = min(first[0], second[0])
+    y = min(first[1], second[1])
+    return (
+        x,
+        y,
+        max(first[0] + first[2], second[0] + second[2]) - x,
+        max(first[1] + first[3], second[1] + second[3]) - y,
+    )
+
+
+def accumulate_change(
+    routing: FlowRouting, window: Window, change: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Accumulate the change of a local raster inside window over the routing.
+    Returns the flat indices of the changed cells and of all cells downstream of them,
+    and their accumulated change."""
+    xoff, yoff, xsize, ysize = window
+    if yoff + ysize > routing.shape[0] or xoff + xsize > routing.shape[1]:
+        raise ValueError("Window is outside of the flow routing grid")
+    r, c = np.nonzero(change)
+    cells = (r + yoff) * routing.shape[1] + (c + xoff)
+    return routing.accumulate_downstream(cells, change[r, c])
+
+
+def add_to_raster(path: str, cells: np.ndarray, values: np.ndarray) -> Optional[Window]:
+    """Add values to cells (flat indices) of an existing raster, NoData cells are left as is.
+    Only the bounding window of cells is read and written. Returns that window."""
+    ds = open_raster(path, update=True)
+    band = ds.GetRasterBand(1)
+    window = cells_window(cells, (ds.RasterYSize, ds.RasterXSize))
+    if window is None:
+        return None
+    current, valid = read_window(band, window)
+    current = current.astype(np.float64)
+    rows, cols = np.divmod(cells, ds.RasterXSize)
+    rows, cols = rows - window[1], cols - window[0]
+    keep = valid[rows, cols]
+    np.add.at(current, (rows[keep], cols[keep]), values[keep])
+    band.WriteArray(
+        np.where(valid, current, band.GetNoDataValue()).astype(np.float32),
+        window[0],
+        window[1],
+    )
+    band.FlushCache()
+    return window
+
+
+def update_concentration(
+    pollutant_acc_raster: str, runoff_acc_raster: str, output: str, window: Window
+):
+    """Recompute a concentration raster (mg/L) inside window"""
+    pol, pol_valid = read_window(
+        open_raster(pollutant_acc_raster).GetRasterBand(1), window
+    )
+    runoff, runoff_valid = read_window(
+        open_raster(runoff_acc_raster).GetRasterBand(1), window
+    )
+    write_window(
+        output,
+        window,
+        concentration(pol.astype(np.float64), runoff.astype(np.float64)),
+        pol_valid & runoff_valid,
+    )
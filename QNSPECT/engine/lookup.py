@@ -0,0 +1,70 @@
+"""
+Land cover lookup table held as NumPy arrays so that coefficients can be gathered per cell
+"""
+
+from typing import Iterable, Mapping
+
+import numpy as np
+
+HSG_FIELDS = ["cn_a", "cn_b", "cn_c", "cn_d"]
+
+
+def _to_float(value) -> float:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return np.nan
+    return float(value)
+
+
+class LookupTable:
+    """Land cover lookup table with one row per land cover class, sorted by lc_value"""
+
+    def __init__(self, records: Iterable[Mapping]):
+        rows = [{k.lower(): v for k, v in r.items()} for r in records]
+        rows.sort(key=lambda r: float(r["lc_value"]))
+        self.lc_values = np.array([float(r["lc_value"]) for r in rows])
+
+        # only keep the numeric columns (lc_name and other labels are dropped)
+        self.fields = {}
+        for name in rows[0].keys() if rows else []:
+            try:
+                self.fields[name] = np.array([_to_float(r.get(name)) for r in rows])
+            except (TypeError, ValueError):
+                continue
+
+        # direct index for integer land cover codes, avoids a binary search per cell
+        self._dense_index = None
+        if len(self) and np.all(self.lc_values == np.round(self.lc_values)):
+            if 0 <= self.lc_values.min() and self.lc_values.max() < 65536:
+                self._dense_index = np.full(int(self.lc_values.max()) + 2, -1)
+                self._dense_index[self.lc_values.astype(np.intp)] = np.arange(len(self))
+
+    def __len__(self) -> int:
+        return len(self.lc_values)
+
+    def class_index(self, lc: np.ndarray) -> np.ndarray:
+        """Row of the lookup table for each land cover cell. -1 where the class is not in the table."""
+        if not len(self):
+            return np.full(lc.shape, -1, dtype=np.intp)
+        if self._dense_index is not None and np.issubdtype(lc.dtype, np.integer):
+            # codes outside of the table range point at the trailing -1
+            last = len(self._dense_index) - 1
+            return self._dense_index[np.where((lc >= 0) & (lc < last), lc, last)]
+        idx = np.searchsorted(self.lc_values, lc)
+        np.clip(idx, 0, len(self) - 1, out=idx)
+        return np.where(self.lc_values[idx] == lc, idx, -1)
+
+    def field_values(
+        self, field: str, index: np.ndarray, fill: float = np.nan
+    ) -> np.ndarray:
+        """Gather the field value of each cell from class_index output. Missing classes get fill."""
+        # appending fill makes index -1 select it
+        values = np.append(self.fields[field.lower()], fill)
+        return values[index]
+
+    def curve_number_table(self) -> np.ndarray:
+        """CN table indexed by [class_index, hydrologic soil group].
+        Soil group column 0 and the trailing class row (missing classes) are 0."""
+        table = np.zeros((len(self) + 1, 5))
+        for i, field in enumerate(HSG_FIELDS, start=1):
+            table[:-1, i] = np.nan_to_num(self.fields[field])
+        return table
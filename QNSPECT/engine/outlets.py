@@ -0,0 +1,179 @@
+"""
+Total loads at outlet points (pour points, outfalls, monitoring stations) without writing
+accumulated rasters.
+
+With single flow direction routing each cell drains to exactly one nearest downstream outlet.
+The outlet index labels every cell with that outlet once per DEM and outlet set; the load of an
+outlet is then the sum of the local loads of its own cells (one streaming np.bincount pass per
+weight raster) plus the loads of the outlets draining into it.
+MFD splits the flow of a cell between outlets, so MFD totals are sampled from an in-memory
+accumulation instead.
+
+The transfer raster of an outlet is the adjoint of the accumulation: the fraction of a unit local
+load of each cell that reaches the outlet. Multiplied by a local load raster it gives the load of
+each cell that reaches the outlet, i.e. the outlet load reduction of removing that cell's load,
+for all candidate cells from one reverse sweep.
+"""
+
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from QNSPECT.engine.blocks import block_windows, map_rasters, read_window
+from QNSPECT.engine.raster_io import (
+    open_raster,
+    raster_grid,
+    read_array,
+    write_array,
+)
+from QNSPECT.engine.routing import FlowRouting
+
+
+def outlet_cells(
+    geotransform: tuple,
+    shape: Tuple[int, int],
+    xs: Sequence[float],
+    ys: Sequence[float],
+) -> np.ndarray:
+    """Flat index of the cell of each point (raster CRS coordinates), -1 outside of the raster"""
+    rows, cols = shape
+    col = np.floor((np.asarray(xs) - geotransform[0]) / geotransform[1]).astype(
+        np.int64
+    )
+    row = np.floor((np.asarray(ys) - geotransform[3]) / geotransform[5]).astype(
+        np.int64
+    )
+    inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+    return np.where(inside, row * cols + col, -1)
+
+
+def snap_outlets(routing: FlowRouting, cells: np.ndarray, radius: int) -> np.ndarray:
+    """Move each outlet to the cell with the largest contributing area within radius cells"""
+    if radius <= 0:
+        return cells
+    rows, cols = routing.shape
+    area = routing.accumulate(np.ones(routing.shape))
+    snapped = cells.copy()
+    for i, cell in enumerate(cells):
+        if cell < 0:
+            continue
+        r, c = divmod(int(cell), cols)
+        r0, c0 = max(r - radius, 0), max(c - radius, 0)
+        window = area[r0 : r + radius + 1, c0 : c + radius + 1]
+        wr, wc = np.unravel_index(np.argmax(window), window.shape)
+        snapped[i] = (r0 + wr) * cols + c0 + wc
+    return snapped
+
+
+class OutletIndex:
+    """Contributing cells of a set of outlets (flat cell indices, -1 for points outside of the raster)"""
+
+    def __init__(self, routing: FlowRouting, cells: np.ndarray):
+        self.routing = routing
+        self.cells = np.asarray(cells, dtype=np.int64)
+        # outlets sharing a cell share their totals
+        self.unique_cells, self.outlet_of = np.unique(
+            self.cells[self.cells >= 0], return_inverse=True
+        )
+        self.labels = None
+        if routing.fractions is None:
+            self._label_cells()
+
+    def _label_cells(self):
+        """Label each cell with its nearest downstream outlet and link each outlet to the next one"""
+        routing = self.routing
+        size = routing.shape[0] * routing.shape[1]
+        is_outlet = np.zeros(size, dtype=bool)
+        is_outlet[self.unique_cells] = True
+        labels = np.full(size, -1, dtype=np.int32)
+        labels[self.unique_cells] = np.arange(len(self.unique_cells))
+
+        # reverse topological order: the label of the receiver is final before its sources
+        for start, stop in reversed(routing.levels):
+            src = routing.sources[start:stop]
+            tgt = routing.targets[start:stop]
+            inherit = ~is_outlet[src]
+            labels[src[inherit]] = labels[tgt[inherit]]
+        self.labels = labels
+
+        # outgoing edge of each outlet, in topological order
+        edges = np.flatnonzero(is_outlet[routing.sources])
+        outlets = labels[routing.sources[edges]]
+        self.downstream = np.full(len(self.unique_cells), -1)
+        self.downstream[outlets] = labels[routing.targets[edges]]
+        self.order = outlets
+
+    def _outlet_totals(self, unique_totals: np.ndarray) -> np.ndarray:
+        """Totals of each outlet from the totals of each unique outlet cell, nan outside of the raster"""
+        totals = np.full(len(self.cells), np.nan)
+        totals[self.cells >= 0] = unique_totals[self.outlet_of]
+        return totals
+
+    def contributing_cells(self) -> np.ndarray:
+        """Number of cells draining to each outlet"""
+        if self.labels is None:
+            area = self.routing.accumulate(np.ones(self.routing.shape)).ravel()
+            return self._outlet_totals(area[self.unique_cells])
+        counts = np.bincount(self.labels + 1, minlength=len(self.unique_cells) + 1)
+        return self._outlet_totals(self._route_outlets(counts[1:].astype(np.float64)))
+
+    def _route_outlets(self, own: np.ndarray) -> np.ndarray:
+        """Add the totals of upstream outlets to the totals of the cells labeled with each outlet"""
+        totals = own.copy()
+        for outlet in self.order:
+            if self.downstream[outlet] >= 0:
+                totals[self.downstream[outlet]] += totals[outlet]
+        return totals
+
+    def totals(self, weight_raster: str, memory_mb: int = None) -> np.ndarray:
+        """Total weight draining to each outlet, nan for outlets outside of the raster.
+        NoData weights count as 0, as in the accumulated rasters."""
+        ds = open_raster(weight_raster)
+        if (ds.RasterYSize, ds.RasterXSize) != self.routing.shape:
+            raise ValueError(
+                f"Raster {weight_raster} is not aligned with the flow routing grid"
+            )
+        if self.labels is None:
+            weight, valid = read_array(weight_raster)
+            acc = self.routing.accumulate(np.where(valid, weight, 0)).ravel()
+            return self._outlet_totals(acc[self.unique_cells])
+
+        band = ds.GetRasterBand(1)
+        labels = self.labels.reshape(self.routing.shape)
+        own = np.zeros(len(self.unique_cells) + 1)
+        for xoff, yoff, xsize, ysize in block_windows(ds, 3 * 8, memory_mb):
+            values, valid = read_window(band, (xoff, yoff, xsize, ysize))
+            block_labels = labels[yoff : yoff + ysize, xoff : xoff + xsize]
+            valid &= ~np.isnan(values)
+            own += np.bincount(
+                block_labels[valid] + 1,
+                weights=values[valid].astype(np.float64),
+                minlength=len(own),
+            )
+        return self._outlet_totals(self._route_outlets(own[1:]))
+
+
+def transfer_raster(
+    routing: FlowRouting, cells: np.ndarray, elevation: str, output: str
+) -> str:
+    """Write the fraction of a unit weight of each cell that reaches cells (see FlowRouting.transfer).
+    The output has the grid and NoData cells of the elevation raster."""
+    _, valid = read_array(elevation)
+    if valid.shape != routing.shape:
+        raise ValueError(
+            f"Raster {elevation} is not aligned with the flow routing grid"
+        )
+    return write_array(output, routing.transfer(cells), raster_grid(elevation), valid)
+
+
+def contribution_raster(
+    transfer: str, local: str, output: str, memory_mb: int = None, feedback=None
+) -> str:
+    """Local load of each cell that reaches the outlet of a transfer raster, in the units of local"""
+    return map_rasters(
+        lambda transfer, local: transfer * local,
+        {"transfer": transfer, "local": local},
+        output,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
@@ -0,0 +1,173 @@
+"""
+Fused computation of the local rasters of the pollution analysis.
+Land Cover, Hydrologic Soil Group and Precipitation are streamed once block by block and
+CN -> S -> Q -> pollutant loads are computed in memory without intermediate files.
+"""
+
+from typing import Dict
+
+import numpy as np
+
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.curve_number import curve_number
+from QNSPECT.engine.blocks import process_blocks, map_rasters
+
+
+def potential_retention(cn: np.ndarray) -> np.ndarray:
+    """S (Potential Maximum Retention) (inches)"""
+    cn = cn.astype(np.float64)
+    s = np.divide(1000.0, cn, out=np.zeros(cn.shape), where=(cn != 0)) - 10
+    return np.maximum(s, 0)
+
+
+def runoff_volume(
+    precip: np.ndarray,
+    cn: np.ndarray,
+    raining_days: int,
+    cell_area_sq_feet: float,
+) -> np.ndarray:
+    """Runoff volume in Liters from precipitation (inches) and CN"""
+    s = potential_retention(cn)
+    p_ia = precip - (0.2 * s * raining_days)
+    q = np.divide(
+        p_ia**2,
+        precip + (0.8 * s * raining_days),
+        out=np.zeros(p_ia.shape),
+        where=(p_ia > 0),
+    )
+    # cell area to convert to volume * (28.3168/12) to convert inches to feet and cubic feet to Liters
+    q *= cell_area_sq_feet * 2.35973722
+    q[cn == 0] = 0
+    return q
+
+
+def concentration(pollutant_acc: np.ndarray, runoff_acc: np.ndarray) -> np.ndarray:
+    """Concentration (mg/L) from accumulated pollutant (kg) and accumulated runoff (L)"""
+    conc = np.divide(
+        pollutant_acc,
+        runoff_acc,
+        out=np.zeros(pollutant_acc.shape),
+        where=(runoff_acc != 0),
+    )
+    return conc * 1e6  # Convert kg back to mg
+
+
+def local_rasters(
+    data: dict,
+    lookup: LookupTable,
+    pollutants: Dict[str, str],
+    dual_soil_type: int,
+    precip_units: int,
+    raining_days: int,
+    cell_area_sq_feet: float,
+    kg: bool = True,
+) -> dict:
+    """CN, Runoff Local (L) and pollutant loads (mg, and kg if kg) of one block.
+    data holds the (values, valid) of the `lc`, `hsg` and `precip` rasters, see process_blocks."""
+    lc, lc_valid = data["lc"]
+    hsg, hsg_valid = data["hsg"]
+    precip, precip_valid = data["precip"]
+    precip = precip.astype(np.float64)
+    if precip_units == 1:
+        precip /= 25.4  # Millimeters to Inches
+
+    lc_index = lookup.class_index(lc)
+    cn_valid = lc_valid & hsg_valid
+    cn = curve_number(lookup, lc_index, hsg, dual_soil_type)
+
+    q_valid = cn_valid & precip_valid
+    q = runoff_volume(precip, cn, raining_days, cell_area_sq_feet)
+    block = {"CN": (cn, cn_valid), "Runoff Local": (q, q_valid)}
+
+    pol_valid = q_valid & (lc_index != -1)
+    for pol, field in pollutants.items():
+        load = q * lookup.field_values(field, lc_index)  # mg
+        block[f"{pol} Local"] = (load, pol_valid)
+        if kg:
+            block[f"{pol} Local kg"] = (load * 1e-6, pol_valid)
+    return block
+
+
+def compute_local_rasters(
+    lc_raster: str,
+    soil_raster: str,
+    precip_raster: str,
+    lookup: LookupTable,
+    pollutants: Dict[str, str],
+    outputs: Dict[str, str],
+    dual_soil_type: int,
+    precip_units: int,
+    raining_days: int,
+    cell_area_sq_feet: float,
+    memory_mb: int = None,
+    feedback=None,
+) -> Dict[str, str]:
+    """Compute and write local runoff and pollutant rasters block by block.
+
+    pollutants maps pollutant name to its lookup table field.
+    outputs maps the raster name to its output path, valid names are
+    `CN`, `Runoff Local`, `<pollutant> Local` (mg) and `<pollutant> Local kg`.
+    Names missing from outputs are not written."""
+    kg = any(name.endswith(" Local kg") for name in outputs)
+
+    return process_blocks(
+        lambda data: local_rasters(
+            data,
+            lookup,
+            pollutants,
+            dual_soil_type,
+            precip_units,
+            raining_days,
+            cell_area_sq_feet,
+            kg,
+        ),
+        {"lc": lc_raster, "hsg": soil_raster, "precip": precip_raster},
+        outputs,
+        working_arrays=8 + len(outputs),
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
+
+
+def compute_runoff_raster(
+    precip_raster: str,
+    cn_raster: str,
+    output: str,
+    precip_units: int,
+    raining_days: int,
+    cell_area_sq_feet: float,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    """Compute and write runoff volume (L) from precipitation and CN rasters block by block"""
+
+    def runoff(precip, cn):
+        precip = precip.astype(np.float64)
+        if precip_units == 1:
+            precip /= 25.4  # Millimeters to Inches
+        return runoff_volume(precip, cn, raining_days, cell_area_sq_feet)
+
+    return map_rasters(
+        runoff,
+        {"precip": precip_raster, "cn": cn_raster},
+        output,
+        working_arrays=6,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
+
+
+def compute_concentration_raster(
+    pollutant_acc_raster: str,
+    runoff_acc_raster: str,
+    output: str,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    return map_rasters(
+        lambda pol, runoff: concentration(pol.astype(np.float64), runoff),
+        {"pol": pollutant_acc_raster, "runoff": runoff_acc_raster},
+        output,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
@@ -0,0 +1,277 @@
+"""
+Run profiles: wall time, CPU time, I/O, temporary disk and peak memory of each stage, step and
+child algorithm of a run.
+
+Spans are recorded in the active profile of the process from any thread, so the steps of a run
+running in parallel are profiled without passing the profile around. A background thread samples
+the resident memory for the peak of each open span. Profiles are written into the run
+configuration file and, optionally, as a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+I/O counters are those of the QGIS process (not of GRASS child processes) and are only reported
+where the OS provides them.
+"""
+
+import ctypes
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Seconds between two resident memory samples
+SAMPLE_INTERVAL = 0.05
+
+# Spans that run one at a time in a run: they get the CPU time of all threads and the growth of the
+# temporary folder, other spans may overlap and get the CPU time of their thread only
+_RUN_WIDE_CATEGORIES = ("stage",)
+# Spans running child processes: they also get the CPU time of the child processes that ended
+_CHILD_CATEGORIES = ("stage", "child algorithm")
+
+_ACTIVE = []
+_ACTIVE_LOCK = threading.Lock()
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """Current resident memory of the process, None where it can not be read"""
+    if sys.platform == "win32":
+
+        class MemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", ctypes.c_ulong),
+                ("PageFaultCount", ctypes.c_ulong),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = MemoryCounters()
+        counters.cb = ctypes.sizeof(MemoryCounters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+            process, ctypes.byref(counters), counters.cb
+        ):
+            return None
+        return counters.WorkingSetSize
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None  # macOS has no /proc
+
+
+def io_bytes() -> Optional[tuple]:
+    """(read, written) bytes of the process so far, None where the OS does not report them"""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f if ":" in line)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def folder_bytes(folder: str) -> int:
+    """Size of the files in folder and its subfolders"""
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # removed during the scan
+    return total
+
+
+class RunProfile:
+    """Spans of a run. temp_folder is the folder of the temporary outputs of the run, its growth
+    is measured over the stages of the run only."""
+
+    def __init__(self, name: str = "", temp_folder: str = None):
+        self.name = name
+        self.temp_folder = temp_folder
+        self.spans = []
+        self._open = {}
+        self._stage = None
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._peak = 0
+
+    def _metrics(self, category: str) -> dict:
+        run_wide = category in _RUN_WIDE_CATEGORIES
+        metrics = {
+            "time": time.perf_counter(),
+            "cpu": time.process_time() if run_wide else time.thread_time(),
+            "io": io_bytes(),
+            "temp": None,
+        }
+        if category in _CHILD_CATEGORIES:
+            children = os.times()
+            metrics["cpu"] += children.children_user + children.children_system
+        if run_wide and self.temp_folder:
+            metrics["temp"] = folder_bytes(self.temp_folder)
+        return metrics
+
+    def _sample(self):
+        rss = resident_memory_bytes()
+        if rss is None:
+            return
+        with self._lock:
+            self._peak = max(self._peak, rss)
+            for span in self._open.values():
+                span["peak_rss"] = max(span["peak_rss"], rss)
+
+    def _sample_loop(self, stop: threading.Event):
+        while not stop.wait(SAMPLE_INTERVAL):
+            self._sample()
+
+    @contextmanager
+    def active(self):
+        """Make this the profile of the process spans are recorded in, and sample the memory"""
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_loop, args=(stop,), daemon=True)
+        with _ACTIVE_LOCK:
+            _ACTIVE.append(self)
+        sampler.start()
+        try:
+            yield self
+        finally:
+            self.stage(None)
+            stop.set()
+            sampler.join()
+            with _ACTIVE_LOCK:
+                _ACTIVE.remove(self)
+
+    def begin(self, name: str, category: str) -> int:
+        """Open a span, returns its key for end"""
+        span = {
+            "name": name,
+            "category": category,
+            "thread": threading.current_thread().name,
+            "start": self._metrics(category),
+            "peak_rss": resident_memory_bytes() or 0,
+        }
+        with self._lock:
+            key = id(span)
+            self._open[key] = span
+        return key
+
+    def end(self, key: int) -> None:
+        with self._lock:
+            category = self._open[key]["category"]
+        end = self._metrics(category)
+        self._sample()
+        with self._lock:
+            span = self._open.pop(key)
+        start = span.pop("start")
+        record = {
+            "Name": span["name"],
+            "Category": span["category"],
+            "Thread": span["thread"],
+            "Start": round(start["time"] - self._start, 6),
+            "Seconds": round(end["time"] - start["time"], 6),
+            # see _RUN_WIDE_CATEGORIES and _CHILD_CATEGORIES
+            "CPUSeconds": round(end["cpu"] - start["cpu"], 6),
+            "PeakRSSBytes": span["peak_rss"] or None,
+        }
+        if start["io"] is not None and end["io"] is not None:
+            record["ReadBytes"] = end["io"][0] - start["io"][0]
+            record["WrittenBytes"] = end["io"][1] - start["io"][1]
+        if start["temp"] is not None:
+            record["TempBytes"] = end["temp"] - start["temp"]
+        with self._lock:
+            self.spans.append(record)
+
+    @contextmanager
+    def span(self, name: str, category: str = "step"):
+        key = self.begin(name, category)
+        try:
+            yield
+        finally:
+            self.end(key)
+
+    def stage(self, name: Optional[str]) -> None:
+        """End the current stage of the run and start the next one (None only ends it)"""
+        if self._stage is not None:
+            self.end(self._stage)
+            self._stage = None
+        if name is not None:
+            self._stage = self.begin(name, "stage")
+
+    def summary(self) -> dict:
+        """Profile for the run configuration file, spans in order of their start"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["Start"])
+            peak = self._peak
+        return {
+            "Seconds": round(time.perf_counter() - self._start, 6),
+            "PeakRSSBytes": peak or None,
+            "Spans": spans,
+        }
+
+    def write_chrome_trace(self, path: str) -> str:
+        """Write the spans in the Chrome trace event format, one track per thread"""
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for span in self.summary()["Spans"]:
+            tid = threads.setdefault(span["Thread"], len(threads) + 1)
+            args = {
+                key: value
+                for key, value in span.items()
+                if key not in ("Name", "Category", "Thread", "Start", "Seconds")
+            }
+            events.append(
+                {
+                    "name": span["Name"],
+                    "cat": span["Category"],
+                    "ph": "X",
+                    "ts": span["Start"] * 1e6,
+                    "dur": span["Seconds"] * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        events += [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread},
+            }
+            for thread, tid in threads.items()
+        ]
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": self.name or "QNSPECT run"},
+            }
+        )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+def active_profile() -> Optional[RunProfile]:
+    """Profile of the running analysis, None if no run is profiled"""
+    with _ACTIVE_LOCK:
+        return _ACTIVE[-1] if _ACTIVE else None
+
+
+@contextmanager
+def profiled(name: str, category: str = "step"):
+    """Record the enclosed code as a span of the active profile, if any"""
+    profile = active_profile()
+    if profile is None:
+        yield
+        return
+    with profile.span(name, category):
+        yield
@@ -0,0 +1,87 @@
+"""
+Read and write single band rasters as NumPy arrays through GDAL
+"""
+
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from osgeo import gdal
+
+# NoData value shared by all QNSPECT float outputs (same as the GDAL Raster Calculator steps)
+NO_DATA = -999999
+
+
+class RasterGrid(NamedTuple):
+    """Size, georeferencing and projection of a raster"""
+
+    xsize: int
+    ysize: int
+    geotransform: tuple
+    projection: str
+
+    @property
+    def cell_area(self) -> float:
+        """Cell area in squared CRS units"""
+        return abs(self.geotransform[1] * self.geotransform[5])
+
+
+def open_raster(path: str, update: bool = False) -> gdal.Dataset:
+    ds = gdal.Open(str(path), gdal.GA_Update if update else gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"Unable to open raster {path}")
+    return ds
+
+
+def raster_grid(path: str) -> RasterGrid:
+    ds = open_raster(path)
+    return RasterGrid(
+        ds.RasterXSize, ds.RasterYSize, ds.GetGeoTransform(), ds.GetProjection()
+    )
+
+
+def read_array(path: str, band: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Read a raster band. Returns the values and a boolean mask of valid (not NoData) cells."""
+    ds = open_raster(path)
+    rb = ds.GetRasterBand(band)
+    values = rb.ReadAsArray()
+    return values, valid_mask(values, rb.GetNoDataValue())
+
+
+def valid_mask(values: np.ndarray, nodata) -> np.ndarray:
+    """Boolean mask of the cells that are not NoData"""
+    if nodata is None:
+        return np.ones(values.shape, dtype=bool)
+    if np.isnan(nodata):
+        return ~np.isnan(values)
+    return values != nodata
+
+
+def write_array(
+    path: str,
+    values: np.ndarray,
+    grid: RasterGrid,
+    valid: np.ndarray = None,
+    nodata: float = NO_DATA,
+) -> str:
+    """Write values as a Float32 GeoTIFF. Cells outside of valid are written as NoData."""
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(
+        str(path),
+        grid.xsize,
+        grid.ysize,
+        1,
+        gdal.GDT_Float32,
+        options=["BIGTIFF=IF_SAFER"],
+    )
+    if ds is None:
+        raise IOError(f"Unable to create raster {path}")
+    ds.SetGeoTransform(grid.geotransform)
+    ds.SetProjection(grid.projection)
+    rb = ds.GetRasterBand(1)
+    rb.SetNoDataValue(nodata)
+    if valid is not None:
+        values = np.where(valid, values, nodata)
+    rb.WriteArray(values.astype(np.float32))
+    rb.FlushCache()
+    ds = None
+    return str(path)
@@ -0,0 +1,79 @@
+"""
+Reclassify land cover rasters with the coefficients of the lookup table
+"""
+
+from typing import Sequence
+
+import numpy as np
+
+from QNSPECT.engine.blocks import (
+    block_windows,
+    check_canceled,
+    create_output,
+    process_blocks,
+    read_window,
+)
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.raster_io import open_raster
+
+
+def reclassify_by_lookup(
+    lc_raster: str,
+    lookup: LookupTable,
+    field: str,
+    output: str,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    """Write the lookup table field value of each land cover cell.
+    Land cover classes missing from the lookup table are written as NoData."""
+
+    def reclassify(data: dict) -> dict:
+        lc, lc_valid = data["lc"]
+        index = lookup.class_index(lc)
+        return {"OUTPUT": (lookup.field_values(field, index), lc_valid & (index != -1))}
+
+    process_blocks(
+        reclassify,
+        {"lc": lc_raster},
+        {"OUTPUT": output},
+        working_arrays=3,
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )
+    return output
+
+
+def reclassify_by_lookup_fields(
+    lc_raster: str,
+    lookup: LookupTable,
+    fields: Sequence[str],
+    output: str,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    """Write the lookup table values of several fields as the bands of one raster (band i + 1 is
+    fields[i], named after the field), reading the land cover once.
+    Land cover classes missing from the lookup table are written as NoData."""
+    ds = open_raster(lc_raster)
+    lc_band = ds.GetRasterBand(1)
+    out = create_output(output, ds, bands=len(fields))
+    for i, field in enumerate(fields):
+        out.GetRasterBand(i + 1).SetDescription(field)
+
+    windows = block_windows(ds, (len(fields) + 3) * 8, memory_mb)
+    for w, window in enumerate(windows):
+        check_canceled(feedback)
+        lc, lc_valid = read_window(lc_band, window)
+        index = lookup.class_index(lc)
+        valid = lc_valid & (index != -1)
+        for i, field in enumerate(fields):
+            out_band = out.GetRasterBand(i + 1)
+            values = np.where(
+                valid, lookup.field_values(field, index), out_band.GetNoDataValue()
+            )
+            out_band.WriteArray(values.astype(np.float32), window[0], window[1])
+        if feedback is not None:
+            feedback.setProgress(100 * (w + 1) / len(windows))
+    out.FlushCache()
+    return output
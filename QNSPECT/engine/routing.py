@@ -0,0 +1,272 @@
+"""
+Flow routing over a raster as a network of weighted edges between cells.
+The network is sorted topologically once, then any number of weight rasters can be accumulated
+with one sweep each instead of a full watershed analysis per weight.
+Networks can be saved as NumPy arrays and memory-mapped back, so that a DEM is routed once per study.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from typing import List, Tuple
+
+import numpy as np
+
+from QNSPECT.engine.raster_io import raster_grid, read_array, write_array
+
+# Bump when the saved network layout changes
+ROUTING_FORMAT_VERSION = 1
+
+# (row, column) offset of the r.watershed drainage directions,
+# numbered counter-clockwise from North-East. Negative values flow out of the region.
+DRAINAGE_OFFSETS = {
+    1: (-1, 1),  # NE
+    2: (-1, 0),  # N
+    3: (-1, -1),  # NW
+    4: (0, -1),  # W
+    5: (1, -1),  # SW
+    6: (1, 0),  # S
+    7: (1, 1),  # SE
+    8: (0, 1),  # E
+}
+
+
+def _edge_positions(first: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Positions first[i], ..., first[i] + counts[i] - 1 of all i, concatenated"""
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(first, counts) + offsets
+
+
+class FlowRouting:
+    """Flow network of a raster. Edge i moves fractions[i] of the accumulated flow of cell
+    sources[i] to cell targets[i] (flat indices). Edges are stored in topological order of their
+    source cells, grouped in levels whose sources only receive flow from previous levels.
+    fractions is None for single flow direction networks, where every edge moves all the flow."""
+
+    def __init__(
+        self,
+        shape: Tuple[int, int],
+        sources: np.ndarray,
+        targets: np.ndarray,
+        fractions: np.ndarray = None,
+    ):
+        self.shape = tuple(shape)
+        size = self.shape[0] * self.shape[1]
+        index_type = np.int32 if size < 2**31 else np.int64
+        sources = np.asarray(sources, dtype=index_type)
+        targets = np.asarray(targets, dtype=index_type)
+
+        order, self.levels = self._topological_levels(size, sources, targets)
+        self.sources = sources[order]
+        self.targets = targets[order]
+        self.fractions = None
+        if fractions is not None:
+            self.fractions = np.asarray(fractions, dtype=np.float64)[order]
+        self._outgoing = None
+
+    def save(self, directory: str) -> str:
+        """Save the network as .npy files in directory (replaced if it exists), see load"""
+        directory = os.path.abspath(directory)
+        parent = os.path.dirname(directory)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, suffix=".tmp")
+        np.save(os.path.join(tmp, "sources.npy"), self.sources)
+        np.save(os.path.join(tmp, "targets.npy"), self.targets)
+        if self.fractions is not None:
+            np.save(os.path.join(tmp, "fractions.npy"), self.fractions)
+        np.save(
+            os.path.join(tmp, "levels.npy"),
+            np.array(self.levels, dtype=np.int64).reshape(-1, 2),
+        )
+        with open(os.path.join(tmp, "routing.json"), "w") as f:
+            json.dump({"version": ROUTING_FORMAT_VERSION, "shape": self.shape}, f)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+        return directory
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True):
+        """Network saved with save. With mmap the edge arrays are memory-mapped instead of read,
+        so loading is instant and the pages are shared between processes routing the same DEM.
+        Raises IOError if the directory has no network of the current format."""
+        try:
+            with open(os.path.join(directory, "routing.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise IOError(f"No flow routing in {directory}")
+        if meta.get("version") != ROUTING_FORMAT_VERSION:
+            raise IOError(f"Flow routing in {directory} has an outdated format")
+
+        mode = "r" if mmap else None
+        routing = cls.__new__(cls)
+        routing.shape = tuple(meta["shape"])
+        routing.sources = np.load(
+            os.path.join(directory, "sources.npy"), mmap_mode=mode
+        )
+        routing.targets = np.load(
+            os.path.join(directory, "targets.npy"), mmap_mode=mode
+        )
+        fractions = os.path.join(directory, "fractions.npy")
+        routing.fractions = (
+            np.load(fractions, mmap_mode=mode) if os.path.isfile(fractions) else None
+        )
+        routing.levels = [
+            (int(start), int(stop))
+            for start, stop in np.load(os.path.join(directory, "levels.npy"))
+        ]
+        routing._outgoing = None
+        return routing
+
+    @staticmethod
+    def _topological_levels(
+        size: int, sources: np.ndarray, targets: np.ndarray
+    ) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+        """Edge order and (start, stop) of each level in that order (Kahn's algorithm on wavefronts)"""
+        by_source = np.argsort(sources, kind="stable")
+        out_degree = np.bincount(sources, minlength=size)
+        first_edge = np.concatenate([[0], np.cumsum(out_degree)[:-1]])
+        in_degree = np.bincount(targets, minlength=size)
+
+        order, levels, start = [], [], 0
+        frontier = np.flatnonzero((in_degree == 0) & (out_degree > 0))
+        while frontier.size:
+            # outgoing edges of the frontier cells
+            edges = by_source[
+                _edge_positions(first_edge[frontier], out_degree[frontier])
+            ]
+            order.append(edges)
+            levels.append((start, start + edges.size))
+            start += edges.size
+
+            receivers, received = np.unique(targets[edges], return_counts=True)
+            in_degree[receivers] -= received
+            frontier = receivers[
+                (in_degree[receivers] == 0) & (out_degree[receivers] > 0)
+            ]
+
+        # edges in flow cycles (never reached) are left out
+        order = np.concatenate(order) if order else np.zeros(0, dtype=np.intp)
+        return order, levels
+
+    @classmethod
+    def from_drainage(cls, drainage: np.ndarray, valid: np.ndarray = None):
+        """Single flow direction routing from an r.watershed drainage direction raster"""
+        rows, cols = drainage.shape
+        if valid is None:
+            valid = np.ones(drainage.shape, dtype=bool)
+        direction = np.where(valid, drainage, 0).astype(np.int64)
+
+        sources, targets = [], []
+        for code, (drow, dcol) in DRAINAGE_OFFSETS.items():
+            r, c = np.nonzero(direction == code)
+            r_to, c_to = r + drow, c + dcol
+            inside = (r_to >= 0) & (r_to < rows) & (c_to >= 0) & (c_to < cols)
+            r, c, r_to, c_to = r[inside], c[inside], r_to[inside], c_to[inside]
+            # flow into NoData cells leaves the network
+            into_valid = valid[r_to, c_to]
+            sources.append(r[into_valid] * cols + c[into_valid])
+            targets.append(r_to[into_valid] * cols + c_to[into_valid])
+        return cls(drainage.shape, np.concatenate(sources), np.concatenate(targets))
+
+    def _flow(self, acc: np.ndarray, edges) -> np.ndarray:
+        """Flow moved along edges (a slice or positions) from the accumulation of their sources"""
+        flow = acc[self.sources[edges]]
+        if self.fractions is None:
+            return flow
+        return flow * self.fractions[edges]
+
+    def accumulate(self, weight: np.ndarray) -> np.ndarray:
+        """Accumulated weight of each cell: its own weight plus the weight of all upstream cells.
+        NaN weights are accumulated as 0."""
+        weight = np.asarray(weight, dtype=np.float64)
+        acc = np.nan_to_num(weight.ravel(), nan=0.0)
+        for start, stop in self.levels:
+            edges = slice(start, stop)
+            np.add.at(acc, self.targets[edges], self._flow(acc, edges))
+        return acc.reshape(self.shape)
+
+    def transfer(self, cells: np.ndarray) -> np.ndarray:
+        """Fraction of a unit weight of each cell that reaches cells (flat indices), the adjoint of
+        accumulate: accumulate(weight) at a cell is the sum of weight * transfer([cell]).
+        Flow stops at the first of cells it reaches, so each weight is counted once."""
+        size = self.shape[0] * self.shape[1]
+        is_outlet = np.zeros(size, dtype=bool)
+        is_outlet[np.asarray(cells, dtype=np.int64)] = True
+        share = is_outlet.astype(np.float64)
+        # reverse topological order: the shares of the receivers are final before their sources
+        for start, stop in reversed(self.levels):
+            sources = self.sources[start:stop]
+            moved = share[self.targets[start:stop]]
+            if self.fractions is not None:
+                moved *= self.fractions[start:stop]
+            moved[is_outlet[sources]] = 0.0
+            if self.fractions is None:
+                # one edge per source
+                share[sources] += moved
+            else:
+                np.add.at(share, sources, moved)
+        return share.reshape(self.shape)
+
+    def accumulate_downstream(
+        self, cells: np.ndarray, weight: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Accumulate a weight that is 0 everywhere except at cells (flat indices).
+        Only the edges downstream of cells are swept. Returns the flat indices of cells and of
+        all cells downstream of them, and their accumulated weight (0 everywhere else)."""
+        size = self.shape[0] * self.shape[1]
+        if self._outgoing is None:
+            # edge positions grouped by source cell
+            by_source = np.argsort(self.sources, kind="stable")
+            out_degree = np.bincount(self.sources, minlength=size)
+            first_edge = np.concatenate([[0], np.cumsum(out_degree)[:-1]])
+            self._outgoing = (by_source, first_edge, out_degree)
+        by_source, first_edge, out_degree = self._outgoing
+
+        acc = np.zeros(size)
+        np.add.at(
+            acc,
+            np.asarray(cells, dtype=np.int64),
+            np.nan_to_num(np.asarray(weight, dtype=np.float64), nan=0.0),
+        )
+
+        # edges reachable from cells, found wavefront by wavefront
+        frontier = np.unique(np.asarray(cells, dtype=np.int64))
+        reached = np.zeros(size, dtype=bool)
+        reached[frontier] = True
+        edges = []
+        while frontier.size:
+            out = by_source[_edge_positions(first_edge[frontier], out_degree[frontier])]
+            edges.append(out)
+            receivers = np.unique(self.targets[out])
+            frontier = receivers[~reached[receivers]]
+            reached[frontier] = True
+
+        # edge positions follow the topological order, sweep them level by level
+        edges = np.sort(np.concatenate(edges)) if edges else np.zeros(0, np.int64)
+        level_starts = np.array([start for start, _ in self.levels], dtype=np.int64)
+        level = np.searchsorted(level_starts, edges, side="right")
+        for group in np.split(edges, np.flatnonzero(np.diff(level)) + 1):
+            if group.size:
+                np.add.at(acc, self.targets[group], self._flow(acc, group))
+
+        affected = np.flatnonzero(reached)
+        return affected, acc[affected]
+
+
+def read_drainage_routing(drainage_raster: str) -> FlowRouting:
+    drainage, valid = read_array(drainage_raster)
+    return FlowRouting.from_drainage(drainage, valid)
+
+
+def accumulate_raster(routing: FlowRouting, weight_raster: str, output: str) -> str:
+    """Accumulate a weight raster over the routing and write it.
+    Cells where the weight is NoData are written as NoData."""
+    weight, valid = read_array(weight_raster)
+    if weight.shape != routing.shape:
+        raise ValueError(
+            f"Raster {weight_raster} is not aligned with the flow routing grid"
+        )
+    acc = routing.accumulate(np.where(valid, weight, 0))
+    return write_array(output, acc, raster_grid(weight_raster), valid)
@@ -0,0 +1,139 @@
+"""
+Dependency graph of the steps of a run.
+Steps whose dependencies are done run at the same time in a thread pool: the heavy work of the
+steps (GDAL, NumPy, GRASS child processes) releases the GIL, so independent branches overlap.
+"""
+
+import ctypes
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional, Sequence
+
+# Steps running at the same time (further bounded by the available memory), 1 runs the steps one
+# after the other in the calling thread
+DEFAULT_MAX_WORKERS = int(os.environ.get("QNSPECT_MAX_WORKERS", os.cpu_count() or 1))
+
+
+def available_memory_mb() -> Optional[float]:
+    """Physical memory (MB) available to new allocations, None where it can not be read"""
+    if sys.platform == "win32":
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return None
+        return status.ullAvailPhys / 1024**2
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (AttributeError, ValueError, OSError):
+        return None  # macOS has no SC_AVPHYS_PAGES
+
+
+def bounded_workers(
+    max_workers: int, step_mb: float, available_mb: Optional[float]
+) -> int:
+    """max_workers limited to the steps of step_mb (MB) fitting in available_mb, at least 1"""
+    if available_mb is None or step_mb <= 0:
+        return max(max_workers, 1)
+    return max(min(max_workers, int(available_mb // step_mb)), 1)
+
+
+class StepGraph:
+    """Steps added with their dependencies, run with StepGraph.run.
+    A step is called as func(feedback, *results of its dependencies)."""
+
+    def __init__(self):
+        self._steps = {}
+
+    def add(self, name: str, func: Callable, depends: Sequence[str] = ()) -> None:
+        """Add a step. Dependencies must be added first, which keeps the graph acyclic."""
+        if name in self._steps:
+            raise ValueError(f"Step {name} is already in the graph")
+        missing = [dep for dep in depends if dep not in self._steps]
+        if missing:
+            raise ValueError(f"Step {name} depends on unknown steps {missing}")
+        self._steps[name] = (func, tuple(depends))
+
+    def wrapped(self, wrap: Callable[[str, Callable], Callable]) -> "StepGraph":
+        """Graph of the same steps with wrap(name, func) as functions"""
+        graph = StepGraph()
+        for name, (func, depends) in self._steps.items():
+            graph.add(name, wrap(name, func), depends)
+        return graph
+
+    def __len__(self):
+        return len(self._steps)
+
+    def run(
+        self, max_workers: int = DEFAULT_MAX_WORKERS, feedback=None, step_feedback=None
+    ) -> Dict[str, object]:
+        """Run every step once its dependencies are done, up to max_workers steps at a time.
+        step_feedback(name) returns the feedback passed to a step (default feedback); feedback
+        (setProgress, isCanceled) reports the done steps.
+        Returns the results by step name. Steps are not started once feedback is canceled or a
+        step failed; the first exception is raised after the running steps finish."""
+        results = {}
+        pending = dict(self._steps)
+        running = {}
+        error = None
+
+        def progress():
+            if feedback is not None:
+                feedback.setProgress(100 * len(results) / max(len(self._steps), 1))
+
+        def start(pool=None):
+            for name, (func, depends) in list(pending.items()):
+                if len(running) >= max_workers:
+                    return
+                if not all(dep in results for dep in depends):
+                    continue
+                del pending[name]
+                args = [step_feedback(name) if step_feedback else feedback]
+                args += [results[dep] for dep in depends]
+                if pool is None:
+                    # sequential runs stay in the calling thread
+                    results[name] = func(*args)
+                    progress()
+                    return
+                running[pool.submit(func, *args)] = name
+
+        max_workers = max(int(max_workers), 1)
+        if max_workers == 1:
+            while pending:
+                if feedback is not None and feedback.isCanceled():
+                    break
+                start()
+            return results
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                canceled = feedback is not None and feedback.isCanceled()
+                if error is None and not canceled:
+                    start(pool)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+                progress()
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,148 @@
+"""
+Relief length ratio of a DEM computed block by block.
+Each window is read with a halo of neighboring cells, so that the 3x3 slope kernel
+(Horn 1981) gives the same result as over the whole raster while only one window of the DEM
+is in memory.
+"""
+
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from QNSPECT.engine.blocks import block_windows, check_canceled, create_output
+from QNSPECT.engine.raster_io import open_raster, valid_mask
+
+# Cells read around each window for the 3x3 kernel
+HALO = 1
+
+
+def process_halo_blocks(
+    func: Callable[[np.ndarray, np.ndarray], Dict[str, tuple]],
+    raster: str,
+    outputs: Dict[str, str],
+    halo: int = HALO,
+    working_arrays: int = 12,
+    memory_mb: int = None,
+    feedback=None,
+) -> Dict[str, str]:
+    """Run func over a raster window by window and write the output rasters.
+
+    func receives the values and valid mask of a window padded by halo cells on each side
+    (cells outside of the raster are not valid) and returns {output name: (values, valid)}
+    of the window without the halo, see blocks.process_blocks."""
+    ds = open_raster(raster)
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    out_datasets = {name: create_output(path, ds) for name, path in outputs.items()}
+
+    windows = block_windows(ds, working_arrays * 8, memory_mb)
+    for i, (xoff, yoff, xsize, ysize) in enumerate(windows):
+        check_canceled(feedback)
+        # window grown by the halo, clipped to the raster
+        x0, y0 = max(xoff - halo, 0), max(yoff - halo, 0)
+        x1 = min(xoff + xsize + halo, ds.RasterXSize)
+        y1 = min(yoff + ysize + halo, ds.RasterYSize)
+        read = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0).astype(np.float64)
+
+        values = np.zeros((ysize + 2 * halo, xsize + 2 * halo))
+        valid = np.zeros(values.shape, dtype=bool)
+        rows = slice(y0 - yoff + halo, y1 - yoff + halo)
+        cols = slice(x0 - xoff + halo, x1 - xoff + halo)
+        values[rows, cols] = read
+        valid[rows, cols] = valid_mask(read, nodata)
+
+        for name, (out, out_valid) in func(values, valid).items():
+            if name not in out_datasets:
+                continue
+            out_band = out_datasets[name].GetRasterBand(1)
+            out = np.where(out_valid, out, out_band.GetNoDataValue())
+            out_band.WriteArray(out.astype(np.float32), xoff, yoff)
+        if feedback is not None:
+            feedback.setProgress(100 * (i + 1) / len(windows))
+
+    for out_ds in out_datasets.values():
+        out_ds.FlushCache()
+    return outputs
+
+
+def _kernel_difference(
+    before: Tuple[np.ndarray, np.ndarray],
+    middle: Tuple[np.ndarray, np.ndarray],
+    after: Tuple[np.ndarray, np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Difference across one row or column of the kernel, from (values, valid) of its 3 cells,
+    and its weight: 2 across the row, 1 to or from the middle cell when one end is NoData,
+    0 when the difference cannot be taken."""
+    (z0, v0), (z1, v1), (z2, v2) = before, middle, after
+    full = v0 & v2
+    to_middle = ~full & v0 & v1
+    from_middle = ~full & ~to_middle & v2 & v1
+    difference = np.select(
+        [full, to_middle, from_middle], [z2 - z0, z1 - z0, z2 - z1], 0.0
+    )
+    weight = np.select([full, to_middle, from_middle], [2.0, 1.0, 1.0], 0.0)
+    return difference, weight
+
+
+def horn_gradient(
+    z: np.ndarray, valid: np.ndarray, cell_x: float, cell_y: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Gradient (rise over run, tan of the slope) of the cells of a window padded by one cell,
+    and its valid mask. NoData neighbors and neighbors outside of the raster are left out of the
+    kernel as in the QGIS derivative filter of native:slope (see _kernel_difference).
+    Cells without any difference along x or along y are NoData."""
+    rows, cols = z.shape
+
+    def neighbor(drow: int, dcol: int) -> Tuple[np.ndarray, np.ndarray]:
+        window = (slice(1 + drow, rows - 1 + drow), slice(1 + dcol, cols - 1 + dcol))
+        return z[window], valid[window]
+
+    sum_x = weight_x = sum_y = weight_y = 0.0
+    for offset, factor in ((-1, 1.0), (0, 2.0), (1, 1.0)):
+        difference, weight = _kernel_difference(
+            neighbor(offset, -1), neighbor(offset, 0), neighbor(offset, 1)
+        )
+        sum_x, weight_x = sum_x + factor * difference, weight_x + factor * weight
+        difference, weight = _kernel_difference(
+            neighbor(-1, offset), neighbor(0, offset), neighbor(1, offset)
+        )
+        sum_y, weight_y = sum_y + factor * difference, weight_y + factor * weight
+
+    gradient_valid = valid[1:-1, 1:-1] & (weight_x > 0) & (weight_y > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dz_dx = sum_x / (weight_x * cell_x)
+        dz_dy = sum_y / (weight_y * cell_y)
+    return np.where(gradient_valid, np.hypot(dz_dx, dz_dy), 0.0), gradient_valid
+
+
+def relief_length_ratio(
+    z: np.ndarray, valid: np.ndarray, cell_x: float, cell_y: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Relief length ratio (m/km) and valid mask of the cells of a window padded by one cell"""
+    gradient, gradient_valid = horn_gradient(z, valid, cell_x, cell_y)
+    # rise over one cell divided by the cell size, divided by 1000 for m/km
+    return gradient / 1000.0, gradient_valid
+
+
+def relief_length_ratio_raster(
+    elevation_raster: str,
+    output: str,
+    meters_per_unit: float = 1.0,
+    memory_mb: int = None,
+    feedback=None,
+) -> str:
+    """Write the relief length ratio (m/km) of an elevation raster in meters from one read of the DEM.
+    meters_per_unit converts the CRS units of the cell size to meters."""
+    geotransform = open_raster(elevation_raster).GetGeoTransform()
+    cell_x = abs(geotransform[1]) * meters_per_unit
+    cell_y = abs(geotransform[5]) * meters_per_unit
+
+    return process_halo_blocks(
+        lambda z, valid: {
+            "Relief Length Ratio": relief_length_ratio(z, valid, cell_x, cell_y)
+        },
+        elevation_raster,
+        {"Relief Length Ratio": output},
+        memory_mb=memory_mb,
+        feedback=feedback,
+    )["Relief Length Ratio"]
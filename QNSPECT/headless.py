@@ -0,0 +1,120 @@
+"""
+Run QNSPECT algorithms without the QGIS GUI, e.g. from the command line or in batch worker processes
+"""
+
+import os
+import sys
+
+from qgis.core import QgsProcessingFeedback
+
+from QNSPECT.batch import needs_grass
+
+# keep references so that the application and provider are not garbage collected
+_QGIS = {}
+
+
+def start_qgis(grass: bool = True):
+    """Start a QGIS application without GUI and register the Processing providers QNSPECT uses:
+    QGIS native, GDAL, GRASS (if grass) and QNSPECT.
+    Only these providers are loaded, which starts much faster than Processing.initialize().
+    Reuses the running application inside QGIS. Safe to call more than once per process."""
+    from qgis.core import QgsApplication
+
+    app = _QGIS.get("app") or QgsApplication.instance()
+    if app is None:
+        if os.environ.get("QGIS_PREFIX_PATH"):
+            QgsApplication.setPrefixPath(os.environ["QGIS_PREFIX_PATH"], True)
+        app = QgsApplication([], False)
+        app.initQgis()
+    _QGIS["app"] = app
+
+    # the Processing plugin ships with QGIS but is not on the path of a plain Python interpreter
+    plugins = os.path.join(QgsApplication.pkgDataPath(), "python", "plugins")
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+
+    registry = QgsApplication.processingRegistry()
+    providers = _QGIS.setdefault("providers", [])
+    if registry.providerById("native") is None:
+        from qgis.analysis import QgsNativeAlgorithms
+
+        providers.append(QgsNativeAlgorithms())
+        registry.addProvider(providers[-1])
+    if registry.providerById("gdal") is None:
+        from processing.core.ProcessingConfig import ProcessingConfig
+        from processing.algs.gdal.GdalAlgorithmProvider import GdalAlgorithmProvider
+
+        ProcessingConfig.initialize()
+        providers.append(GdalAlgorithmProvider())
+        registry.addProvider(providers[-1])
+    if grass and not (
+        registry.providerById("grass7") or registry.providerById("grass")
+    ):
+        providers.append(_grass_provider())
+        registry.addProvider(providers[-1])
+    if registry.providerById("qnspect") is None:
+        from QNSPECT.processing import QNSPECTProvider
+
+        providers.append(QNSPECTProvider())
+        registry.addProvider(providers[-1])
+    return app
+
+
+def _grass_provider():
+    """GRASS provider, its module moved between QGIS versions"""
+    try:
+        from grassprovider.grass_provider import GrassProvider
+
+        return GrassProvider()
+    except ImportError:
+        pass
+    try:
+        from grassprovider.Grass7AlgorithmProvider import Grass7AlgorithmProvider
+    except ImportError:
+        from processing.algs.grass7.Grass7AlgorithmProvider import (
+            Grass7AlgorithmProvider,
+        )
+    return Grass7AlgorithmProvider()
+
+
+def run_algorithm(algorithm: str, parameters: dict, feedback=None) -> dict:
+    """Run a Processing algorithm in the headless application"""
+    start_qgis(grass=needs_grass(algorithm, parameters))
+    import processing
+    from qgis.core import QgsProject, QgsProcessingContext
+
+    context = QgsProcessingContext()
+    context.setProject(QgsProject.instance())
+    return processing.run(algorithm, parameters, context=context, feedback=feedback)
+
+
+class LogFeedback(QgsProcessingFeedback):
+    """Processing feedback that writes the algorithm messages to a text stream (e.g. a log file)"""
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def _write(self, message: str):
+        self.stream.write(f"{message}\n")
+
+    def setProgressText(self, text):
+        self._write(text)
+
+    def pushInfo(self, info):
+        self._write(info)
+
+    def pushCommandInfo(self, info):
+        self._write(info)
+
+    def pushDebugInfo(self, info):
+        self._write(info)
+
+    def pushConsoleInfo(self, info):
+        self._write(info)
+
+    def pushWarning(self, warning):
+        self._write(f"WARNING: {warning}")
+
+    def reportError(self, error, fatalError=False):
+        self._write(f"ERROR: {error}")
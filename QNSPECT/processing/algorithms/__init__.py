@@ -8,6 +8,14 @@ from .create_lookup_table_template.create_lookup_table_template import (
 )
 from .run_analysis.run_pollution_analysis import RunPollutionAnalysis
 from .run_analysis.run_erosion_analysis import RunErosionAnalysis
+from .run_analysis.run_incremental_pollution_analysis import (
+    RunIncrementalPollutionAnalysis,
+)
+from .run_analysis.evaluate_pollutant_coefficients import (
+    EvaluatePollutantCoefficients,
+)
+from .run_analysis.outlet_transfer_analysis import OutletTransferAnalysis
 from .load_run.load_run import LoadPreviousRun
+from .batch_run.run_batch_scenarios import RunBatchScenarios
 from .compare_scenarios.compare_pollution import ComparePollution
 from .compare_scenarios.compare_erosion import CompareErosion
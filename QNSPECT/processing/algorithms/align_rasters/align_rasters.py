@@ -32,6 +32,7 @@ from qgis.core import (
     QgsProcessingParameterEnum,
     QgsProcessingParameterDistance,
     QgsProcessingParameterFeatureSource,
+    QgsProcessingFeatureSourceDefinition,
     QgsProcessingParameterFolderDestination,
     QgsProcessingParameterBoolean,
     QgsProcessingContext,
@@ -39,14 +40,27 @@ from qgis.core import (
     QgsProcessingParameterNumber,
     QgsRasterLayer,
     QgsVectorLayer,
+    QgsProcessingParameterDefinition,
+    QgsProcessingUtils,
 )
 
 from QNSPECT.processing.qnspect_algorithm import QNSPECTAlgorithm
-from QNSPECT.processing.algorithms.qnspect_utils import select_group, create_group
+from QNSPECT.engine.alignment import copy_aligned, is_aligned, target_grid
+from QNSPECT.engine.raster_io import raster_grid
+from QNSPECT.engine.scheduler import StepGraph
+from QNSPECT.processing.algorithms.qnspect_utils import (
+    select_group,
+    create_group,
+    run_step_graph,
+    cached_intermediate,
+)
 
 
 class AlignRasters(QNSPECTAlgorithm):
     rasterCellSize: str = "RasterCellSize"
+    parallelAlignment: str = "ParallelAlignment"
+    alignThreads: str = "AlignThreads"
+    virtualOutputs: str = "VirtualOutputs"
     resamplingMethods = [
         ("Nearest Neighbour", "near"),
         ("Bilinear", "bilinear"),
@@ -121,6 +135,29 @@ class AlignRasters(QNSPECTAlgorithm):
                 defaultValue=None,
             )
         )
+        param = QgsProcessingParameterBoolean(
+            self.parallelAlignment,
+            "Align Rasters in Parallel",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.alignThreads,
+            "Maximum CPU Threads for Parallel Alignment (0 for all)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.virtualOutputs,
+            "Write Virtual Rasters (VRT)",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
         self.addParameter(
             QgsProcessingParameterBoolean(
                 "LoadOutputs",
@@ -140,13 +177,7 @@ class AlignRasters(QNSPECTAlgorithm):
     def processAlgorithm(self, parameters, context, model_feedback):
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
         # overall progress through the model
-
-        if parameters["RastersToAlign"]:
-            feedback = QgsProcessingMultiStepFeedback(
-                3 + len(parameters["RastersToAlign"]), model_feedback
-            )
-        else:
-            feedback = QgsProcessingMultiStepFeedback(3, model_feedback)
+        feedback = QgsProcessingMultiStepFeedback(4, model_feedback)
         results = {}
         outputs = {}
 
@@ -154,6 +185,11 @@ class AlignRasters(QNSPECTAlgorithm):
         self.load_outputs = self.parameterAsBool(parameters, "LoadOutputs", context)
         ref_layer = self.parameterAsRasterLayer(parameters, "ReferenceRaster", context)
         resample_method = self.parameterAsEnum(parameters, "ResamplingMethod", context)
+        parallel = self.parameterAsBool(parameters, self.parallelAlignment, context)
+        virtual = self.parameterAsBool(parameters, self.virtualOutputs, context)
+        extension = "vrt" if virtual else "tif"
+        threads = self.parameterAsInt(parameters, self.alignThreads, context)
+        threads = threads or os.cpu_count() or 1
 
         # Check if the reference raster is in a geographic CRS and terminate if it is
         # This will:
@@ -206,7 +242,10 @@ class AlignRasters(QNSPECTAlgorithm):
                     "JOIN_STYLE": 0,
                     "MITER_LIMIT": 2,
                     "SEGMENTS": 5,
-                    "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
+                    # a file, memory layers can not be read from the contexts of parallel alignments
+                    "OUTPUT": QgsProcessingUtils.generateTempFilename(
+                        "MaskBuffer.gpkg"
+                    ),
                 }
                 outputs["Buffer"] = processing.run(
                     "native:buffer",
@@ -220,6 +259,8 @@ class AlignRasters(QNSPECTAlgorithm):
                 mask_layer = self.parameterAsVectorLayer(
                     parameters, "MaskLayer", context
                 )
+                if parallel:
+                    mask_layer = self.mask_file(mask_layer, context, feedback)
 
         feedback.setCurrentStep(2)
         if feedback.isCanceled():
@@ -237,116 +278,222 @@ class AlignRasters(QNSPECTAlgorithm):
             parameters, "RastersToAlign", context
         )
 
+        # (name, source, output path) of the rasters, the reference raster first
+        jobs = []
         all_out_paths = []
-
-        enum_start = 3
-        for i, rast in enumerate(rasters_to_align, start=enum_start):
+        for i, rast in enumerate(rasters_to_align):
             # Prevent the reference raster from being alignd multiple times
-            if (i != enum_start) and (rast.source() == ref_source):
+            if (i != 0) and (rast.source() == ref_source):
                 continue
 
             rast_name = rast.name()
-            out_path = os.path.join(output_dir, f"{rast_name}.tif")
+            out_path = os.path.join(output_dir, f"{rast_name}.{extension}")
 
             j = 1  # prevent self overwriting in algorithm outputs if two rasters have same display name
             while out_path in all_out_paths:
                 rast_name = f"{rast.name()}_{j}"
-                out_path = os.path.join(output_dir, f"{rast_name}.tif")
+                out_path = os.path.join(output_dir, f"{rast_name}.{extension}")
                 j += 1
             all_out_paths.append(out_path)
+            # sources, as the layers belong to this thread
+            jobs.append((rast_name, rast.source(), out_path))
+
+        # the thread budget is shared by the rasters aligned at the same time
+        workers = min(threads, len(jobs)) if parallel else 1
+        warp_threads = max(threads // workers, 1) if parallel else 1
+
+        # Warped outputs are kept in the intermediate cache, keyed by the sources, the mask and the
+        # target grid. Virtual rasters are not cached, they are written in no time.
+        cacheable = not virtual
+        cache_sources = [ref_source]
+        if parameters["MaskLayer"]:
+            mask_input = self.parameterAsVectorLayer(parameters, "MaskLayer", context)
+            # edits of layers that are not files and feature selections can not be fingerprinted
+            cacheable = (
+                cacheable
+                and mask_input.providerType() == "ogr"
+                and not (
+                    isinstance(
+                        parameters["MaskLayer"], QgsProcessingFeatureSourceDefinition
+                    )
+                    and parameters["MaskLayer"].selectedFeaturesOnly
+                )
+            )
+            # the file is fingerprinted, the full source keeps the layer name and subset in the key
+            cache_sources.append(mask_input.source().split("|")[0])
+        cache_params = {
+            "resampling": self.resamplingMethods[resample_method][1],
+            "cell_size": [res_x, res_y],
+            "user_size": user_size,
+            "crs": ref_layer_crs.toWkt(),
+            "mask_buffer": parameters["MaskBuffer"]
+            if parameters["MaskLayer"]
+            else None,
+            "mask_source": mask_input.source() if parameters["MaskLayer"] else None,
+        }
+
+        def cached_alignment(source, out_path, is_reference, compute, feedback) -> str:
+            if not cacheable:
+                return compute(out_path)
+            return cached_intermediate(
+                "Alignment",
+                compute,
+                feedback,
+                output=out_path,
+                rasters=[source] + cache_sources,
+                params={**cache_params, "reference": is_reference},
+            )
 
-            if i == enum_start:  # first item will be ref_layer
+        def warped_path(rast_name: str) -> str:
+            if virtual:
+                # read by the masked virtual raster, kept next to it
+                os.makedirs(os.path.join(output_dir, "warped"), exist_ok=True)
+                return os.path.join(output_dir, "warped", f"{rast_name}.vrt")
+            return QgsProcessingUtils.generateTempFilename("Warped.vrt")
+
+        def align_reference(context, feedback):
+            rast_name, source, out_path = jobs[0]
+
+            def compute(output):
                 if parameters["MaskLayer"]:
                     if not user_size:
                         # mask ref layer with crop_to_cutline=True to match original cell alignment to preserve integrity
-                        outputs[rast_name] = self.mask_raster(
-                            rast,
+                        return self.mask_raster(
+                            source,
                             mask_layer,
-                            out_path,
+                            output,
                             True,
+                            threads=warp_threads,
                             context=context,
                             feedback=feedback,
-                        )
-                    else:
+                        )["OUTPUT"]
+                    # a warped VRT, the warp is computed as the mask is applied without an intermediate raster
+                    temp_rast_layer = self.warp_raster(
+                        source,
+                        ref_layer_crs,
+                        mask_layer,
+                        resample_method,
+                        res_x,
+                        res_y,
+                        warped_path(rast_name),
+                        threads=warp_threads,
+                        context=context,
+                        feedback=feedback,
+                    )["OUTPUT"]
+                    return self.mask_raster(
+                        temp_rast_layer,
+                        mask_layer,
+                        output,
+                        False,
+                        threads=warp_threads,
+                        context=context,
+                        feedback=feedback,
+                    )["OUTPUT"]
+                return self.warp_raster(
+                    source,
+                    ref_layer_crs,
+                    ref_source,
+                    resample_method,
+                    res_x,
+                    res_y,
+                    output,
+                    threads=warp_threads,
+                    context=context,
+                    feedback=feedback,
+                )["OUTPUT"]
+
+            return cached_alignment(source, out_path, True, compute, feedback)
+
+        def align_step(rast_name: str, source: str, out_path: str):
+            # with a mask layer the rasters take the extent of the masked reference raster
+            def align(context, feedback, reference=ref_source):
+                def compute(output):
+                    if parameters["MaskLayer"]:
+                        # a warped VRT, the warp is computed as the mask is applied without an intermediate raster
                         temp_rast_layer = self.warp_raster(
-                            rast,
-                            ref_layer,
-                            mask_layer,
+                            source,
+                            ref_layer_crs,
+                            reference,
                             resample_method,
                             res_x,
                             res_y,
+                            warped_path(rast_name),
+                            threads=warp_threads,
                             context=context,
                             feedback=feedback,
                         )["OUTPUT"]
-                        outputs[rast_name] = self.mask_raster(
+                        return self.mask_raster(
                             temp_rast_layer,
                             mask_layer,
-                            out_path,
+                            output,
                             False,
+                            threads=warp_threads,
                             context=context,
                             feedback=feedback,
-                        )
-                    ref_layer = QgsRasterLayer(
-                        outputs[rast_name]["OUTPUT"], "ref layer"
-                    )
-                else:
-                    outputs[rast_name] = self.warp_raster(
-                        rast,
-                        ref_layer,
-                        ref_layer,
+                        )["OUTPUT"]
+                    return self.warp_raster(
+                        source,
+                        ref_layer_crs,
+                        reference,
                         resample_method,
                         res_x,
                         res_y,
-                        out_path,
+                        output,
+                        threads=warp_threads,
                         context=context,
                         feedback=feedback,
-                    )
+                    )["OUTPUT"]
 
-            elif parameters["MaskLayer"]:
-                temp_rast_layer = self.warp_raster(
-                    rast,
-                    ref_layer,
-                    ref_layer,
-                    resample_method,
-                    res_x,
-                    res_y,
-                    context=context,
-                    feedback=feedback,
-                )["OUTPUT"]
-                outputs[rast_name] = self.mask_raster(
-                    temp_rast_layer,
-                    mask_layer,
-                    out_path,
-                    False,
-                    context=context,
-                    feedback=feedback,
-                )
+                return cached_alignment(source, out_path, False, compute, feedback)
 
-            else:
-                outputs[rast_name] = self.warp_raster(
-                    rast,
-                    ref_layer,
-                    ref_layer,
-                    resample_method,
-                    res_x,
-                    res_y,
-                    out_path,
-                    context=context,
-                    feedback=feedback,
+            return align
+
+        def copy_step(source: str, out_path: str):
+            # takes the projection string of the aligned reference raster
+            def copy(context, feedback, reference):
+                feedback.pushInfo(
+                    f"{source} is already on the reference grid, copying it without resampling."
                 )
+                return copy_aligned(source, out_path, raster_grid(reference).projection)
+
+            return copy
+
+        # Without a mask, rasters that already have the grid of the outputs are not warped.
+        # Only the raster headers are compared.
+        grid = None
+        if not parameters["MaskLayer"]:
+            grid = target_grid(ref_source, res_x, res_y)
+
+        graph = StepGraph()
+        graph.add(jobs[0][0], align_reference)
+        for rast_name, source, out_path in jobs[1:]:
+            if grid is not None and is_aligned(source, grid):
+                graph.add(rast_name, copy_step(source, out_path), [jobs[0][0]])
+                continue
+            graph.add(
+                rast_name,
+                align_step(rast_name, source, out_path),
+                [jobs[0][0]] if parameters["MaskLayer"] else [],
+            )
+
+        feedback.setCurrentStep(3)
+        if parallel:
+            feedback.pushInfo(
+                f"Aligning {workers} rasters at a time with {warp_threads} threads each ..."
+            )
+        aligned = run_step_graph(graph, context, feedback, workers=workers)
+        if aligned is None:
+            return {}
 
+        for rast_name, _, _ in jobs:
             if self.load_outputs:
                 context.addLayerToLoadOnCompletion(
-                    outputs[rast_name]["OUTPUT"],
+                    aligned[rast_name],
                     QgsProcessingContext.LayerDetails(
                         rast_name, context.project(), rast_name
                     ),
                 )
-            results[rast_name] = outputs[rast_name]["OUTPUT"]
-
-            feedback.setCurrentStep(i)
-            if feedback.isCanceled():
-                return {}
+            results[rast_name] = aligned[rast_name]
 
         return results
 
@@ -375,7 +522,8 @@ class AlignRasters(QNSPECTAlgorithm):
     def shortHelpString(self):
         return """<html><body>
 <h2>Algorithm description</h2>
-<p>The algorithm aligns one or more rasters to a reference raster. The aligned rasters will adopt the CRS, cell size, and origin of the reference raster. The aligned rasters will be saved as TIFF files.</p>
+<p>The algorithm aligns one or more rasters to a reference raster. The aligned rasters will adopt the CRS, cell size, and origin of the reference raster. The aligned rasters will be saved as TIFF files, or as virtual rasters.</p>
+<p>Without a Mask Layer, rasters that already have the CRS, origin, cell size, and extent of the outputs are copied without resampling. Aligned TIFF files are kept in the QNSPECT intermediate cache (see the QNSPECT Processing settings), so aligning the same rasters for the same study area again copies them from the cache.</p>
 <h2>Input parameters</h2>
 <h3>Reference Raster</h3>
 <p>The raster used for determining the CRS and origin coordinates of the output rasters.</p>
@@ -389,9 +537,16 @@ class AlignRasters(QNSPECTAlgorithm):
 <p>Buffer added around the Mask Layer. If the Mask Layer is not provided, no buffer will be applied.</p>
 <h3>Output Cell Size [optional]</h3>
 <p>The raster cell size of the output rasters. If this is not set, the cell size will be the same as the reference raster.</p>
+<h2>Advanced Parameters</h2>
+<h3>Align Rasters in Parallel</h3>
+<p>If checked, the rasters are aligned at the same time, and each alignment uses the multithreaded GDAL warper. This makes aligning several large rasters faster on multi-core machines. The outputs are the same as when the rasters are aligned one after the other. Default is unchecked.</p>
+<h3>Maximum CPU Threads for Parallel Alignment (0 for all)</h3>
+<p>The total number of threads used by parallel alignment. The threads are divided among the rasters aligned at the same time. Lower it to leave cores free for other work. Default is 0, which uses all CPU cores.</p>
+<h3>Write Virtual Rasters (VRT)</h3>
+<p>If checked, the aligned rasters are saved as virtual rasters (`.vrt`) that point to the source rasters instead of TIFF files. Alignment then takes seconds and almost no disk space, and the cells are resampled when the analyses read them, only for the area they process. This suits exploratory runs over large areas. Each run reads and resamples the sources again, so write TIFF files for rasters used in many runs. The virtual rasters stop working if the source rasters are moved or deleted. With a Mask Layer, the unmasked virtual rasters are kept in the `warped` folder of the Output Directory. Default is unchecked.</p>
 <h2>Outputs</h2>
 <h3>Output Directory</h3>
-<p>The output directory the aligned rasters will be saved to. The aligned rasters will have the same name as their source files.</p>
+<p>The output directory the aligned rasters will be saved to. The aligned rasters will have the same name as their source files, with a `.tif` or, for virtual rasters, a `.vrt` extension.</p>
 <br></body></html>"""
 
     def createInstance(self):
@@ -406,17 +561,39 @@ class AlignRasters(QNSPECTAlgorithm):
             ras_size_y = rast_layer.rasterUnitsPerPixelY()
             return ras_size_x, ras_size_y, False
 
+    def mask_file(self, mask_layer: QgsVectorLayer, context, feedback) -> str:
+        """Source of the mask layer readable from the contexts of parallel alignments.
+        Layers that are not files (e.g. memory layers) are saved to a temporary file."""
+        if mask_layer.providerType() == "ogr":
+            return mask_layer.source()
+        alg_params = {
+            "INPUT": mask_layer,
+            "OPERATION": "",
+            "TARGET_CRS": mask_layer.crs(),
+            "OUTPUT": QgsProcessingUtils.generateTempFilename("MaskLayer.gpkg"),
+        }
+        return processing.run(
+            "native:reprojectlayer",
+            alg_params,
+            context=context,
+            feedback=feedback,
+            is_child_algorithm=True,
+        )["OUTPUT"]
+
     def mask_raster(
         self,
-        rast: QgsRasterLayer,
+        rast: Union[str, QgsRasterLayer],
         mask_layer: Union[str, QgsVectorLayer],
         out_path: str = QgsProcessing.TEMPORARY_OUTPUT,
         crop_to_cutline: bool = False,
         extra: str = "-wo CUTLINE_ALL_TOUCHED=TRUE",
+        threads: int = 1,
         context=None,
         feedback=None,
     ):
         # Clip raster by mask layer
+        if threads > 1:
+            extra = f"{extra} -wo NUM_THREADS={threads}"
         alg_params = {
             "ALPHA_BAND": False,
             "CROP_TO_CUTLINE": crop_to_cutline,
@@ -425,7 +602,7 @@ class AlignRasters(QNSPECTAlgorithm):
             "INPUT": rast,
             "KEEP_RESOLUTION": False,
             "MASK": mask_layer,
-            "MULTITHREADING": False,
+            "MULTITHREADING": threads > 1,
             "NODATA": None,
             "OPTIONS": "",
             "SET_RESOLUTION": False,
@@ -445,7 +622,7 @@ class AlignRasters(QNSPECTAlgorithm):
 
     def warp_raster(
         self,
-        rast: QgsRasterLayer,
+        rast: Union[str, QgsRasterLayer],
         ref_layer,
         extent_layer,
         resample: int,
@@ -453,14 +630,17 @@ class AlignRasters(QNSPECTAlgorithm):
         res_y: float,
         out_path: str = QgsProcessing.TEMPORARY_OUTPUT,
         extra: str = "",
+        threads: int = 1,
         context=None,
         feedback=None,
     ):
         # Warp (reproject)
+        if threads > 1:
+            extra = f"{extra} -wo NUM_THREADS={threads}"
         alg_params = {
             "DATA_TYPE": 0,
             "INPUT": rast,
-            "MULTITHREADING": False,
+            "MULTITHREADING": threads > 1,
             "NODATA": None,
             "OPTIONS": "",
             "RESAMPLING": resample,
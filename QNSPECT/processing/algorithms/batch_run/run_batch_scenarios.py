@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "NOAA"
+__date__ = "2022-02-15"
+__copyright__ = "(C) 2021 by NOAA"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import os
+
+from qgis.core import (
+    QgsProcessingParameterFile,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingException,
+)
+
+from QNSPECT.batch import load_manifest, run_batch, write_summary
+from QNSPECT.processing.qnspect_algorithm import QNSPECTAlgorithm
+
+
+class RunBatchScenarios(QNSPECTAlgorithm):
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "Manifest",
+                "Batch Manifest",
+                behavior=QgsProcessingParameterFile.File,
+                fileFilter="JSON Files (*.json)",
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "Processes",
+                "Number of Parallel Processes",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=max((os.cpu_count() or 2) - 1, 1),
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                "LogFolder",
+                "Folder for Run Logs",
+                createByDefault=True,
+                defaultValue=None,
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        manifest = self.parameterAsString(parameters, "Manifest", context)
+        processes = self.parameterAsInt(parameters, "Processes", context)
+        log_dir = self.parameterAsString(parameters, "LogFolder", context)
+
+        try:
+            runs = load_manifest(manifest)
+        except (OSError, ValueError, KeyError) as e:
+            raise QgsProcessingException(f"Invalid batch manifest: {e}")
+        if not runs:
+            feedback.pushWarning("The batch manifest has no runs. \n")
+            return {}
+
+        feedback.pushInfo(f"Running {len(runs)} runs in {processes} processes ...")
+        summaries = run_batch(runs, log_dir, processes, feedback)
+
+        failed = [s for s in summaries if s["Status"] != "succeeded"]
+        for summary in failed:
+            feedback.reportError(
+                f"{summary['RunName']} failed: {summary.get('Error')}. See {summary.get('Log')}",
+                fatalError=False,
+            )
+
+        return {
+            "Summary": write_summary(
+                summaries, os.path.join(log_dir, "batch_summary.json")
+            ),
+            "Succeeded": len(summaries) - len(failed),
+            "Failed": len(failed),
+        }
+
+    def name(self):
+        return "run_batch_scenarios"
+
+    def displayName(self):
+        return self.tr("Run Batch Scenarios")
+
+    def group(self):
+        return self.tr("Analysis")
+
+    def groupId(self):
+        return "analysis"
+
+    def createInstance(self):
+        return RunBatchScenarios()
+
+    def shortHelpString(self):
+        return """<html><body>
+<a href="https://www.noaa.gov/">Documentation</a>
+
+<h2>Algorithm Description</h2>
+
+<p>The `Run Batch Scenarios` tool runs many pollution and erosion analyses in parallel, each in its own background QGIS process. A run that fails does not stop the other runs; the error is reported at the end and written to the log file of the run.</p>
+
+<p>Runs that use the same Elevation Raster and flow routing options share their flow routing and LS-Factor. The first of these runs is started before the others so that they reuse its cached results.</p>
+
+<h2>Input Parameters</h2>
+
+<h3>Batch Manifest</h3>
+<p>JSON file listing the runs. Parameters under <code>defaults</code> apply to every run. Each entry of <code>runs</code> either names a <code>RunFile</code> (a `.pol.json` or `.ero.json` file saved by a previous run) or an <code>Algorithm</code> (<code>pollution</code> or <code>erosion</code>), and overrides any parameter, e.g. <code>RunName</code> and <code>LandCoverRaster</code>:</p>
+<pre>{
+  "defaults": {"ProjectLocation": "C:/scenarios", "ElevationRaster": "C:/data/dem.tif"},
+  "runs": [
+    {"RunFile": "C:/runs/baseline/baseline.pol.json", "RunName": "scenario_1", "LandCoverRaster": "C:/data/lc_1.tif"},
+    {"RunFile": "C:/runs/baseline/baseline.pol.json", "RunName": "scenario_2", "LandCoverRaster": "C:/data/lc_2.tif"}
+  ]
+}</pre>
+<p>Parameter names are the ones in the run configuration files. Every run must have a unique `RunName` and a `ProjectLocation`. Use full paths for input files.</p>
+
+<h3>Number of Parallel Processes</h3>
+<p>Number of runs executed at the same time. Each process needs its own memory for raster processing, see the memory budget in the QNSPECT Processing settings.</p>
+
+<h2>Outputs</h2>
+
+<h3>Folder for Run Logs</h3>
+<p>One log file per run and a `batch_summary.json` file with the status, outputs, and run time of each run are saved in this folder. Run outputs are saved in the `Folder for Run Outputs` of each run.</p>
+</body></html>"""
@@ -30,6 +30,7 @@ from qgis.core import (
 )
 import processing
 
+from QNSPECT.processing.algorithms.qnspect_utils import cancelable
 from QNSPECT.processing.algorithms.compare_scenarios.comparison_utils import (
     run_direct_and_percent_comparisons,
 )
@@ -86,6 +87,7 @@ class CompareErosion(QNSPECTCompareAlgorithm):
             )
         )
 
+    @cancelable
     def processAlgorithm(self, parameters, context, model_feedback):
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
         # overall progress through the model
@@ -37,7 +37,7 @@ from QNSPECT.processing.algorithms.compare_scenarios.comparison_utils import (
 from QNSPECT.processing.algorithms.compare_scenarios.qnspect_compare_algorithm import (
     QNSPECTCompareAlgorithm,
 )
-from QNSPECT.processing.algorithms.qnspect_utils import filter_matrix
+from QNSPECT.processing.algorithms.qnspect_utils import filter_matrix, cancelable
 
 
 def find_all_matching(
@@ -147,6 +147,7 @@ class ComparePollution(QNSPECTCompareAlgorithm):
             )
         )
 
+    @cancelable
     def processAlgorithm(self, parameters, context, model_feedback):
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
         # overall progress through the model
@@ -1,9 +1,9 @@
-import processing
 from pathlib import Path
 
 from qgis.core import QgsProcessingContext
 
-from QNSPECT.processing.algorithms.qnspect_utils import perform_raster_math
+from QNSPECT.engine.comparison import compare_rasters
+from QNSPECT.processing.algorithms.qnspect_utils import memory_budget
 
 
 def run_direct_and_percent_comparisons(
@@ -16,55 +16,42 @@ def run_direct_and_percent_comparisons(
     outputs,
     load_outputs: bool,
 ):
-    input_dict = {
-        "band_a": 1,
-        "band_b": 1,
-        "input_a": str(scenario_dir_a / f"{name}.tif"),
-        "input_b": str(scenario_dir_b / f"{name}.tif"),
-    }
-    _run_comparison_type(
-        output_dir=output_dir,
-        input_dict=input_dict,
-        name=name,
-        compare_type="Direct",
-        expression="A - B",
-        feedback=feedback,
-        context=context,
-        outputs=outputs,
-        load_outputs=load_outputs,
-    )
-    _run_comparison_type(
-        output_dir=output_dir,
-        input_dict=input_dict,
-        name=name,
-        compare_type="Percent",
-        expression="100 * ((A - B) / B)",  # example A = [[5,1]] and B = [[1,2]] result = [[400%,-50%]] interpreted as [[A increased 400%, A decreased 50%]]
-        feedback=feedback,
-        context=context,
-        outputs=outputs,
-        load_outputs=load_outputs,
-    )
+    for compare_type in ["Direct", "Percent"]:
+        _run_comparison_type(
+            output_dir=output_dir,
+            raster_a=str(scenario_dir_a / f"{name}.tif"),
+            raster_b=str(scenario_dir_b / f"{name}.tif"),
+            name=name,
+            compare_type=compare_type,
+            feedback=feedback,
+            context=context,
+            outputs=outputs,
+            load_outputs=load_outputs,
+        )
 
 
 def _run_comparison_type(
     output_dir: Path,
-    input_dict: dict,
+    raster_a: str,
+    raster_b: str,
     name: str,  # ex: Lead Local
     compare_type: str,
-    expression: str,
     feedback,
     context,
     outputs,
     load_outputs: bool,
 ):
     type_name = f"{name} {compare_type}"
-    output = outputs[type_name] = perform_raster_math(
-        exprs=expression,
-        input_dict=input_dict,
-        context=context,
-        feedback=feedback,
-        output=str(output_dir / f"{type_name}.tif"),
-    )
+    output = outputs[type_name] = {
+        "OUTPUT": compare_rasters(
+            raster_a,
+            raster_b,
+            compare_type,
+            str(output_dir / f"{type_name}.tif"),
+            memory_mb=memory_budget(),
+            feedback=feedback,
+        )
+    }
     layer_name = f"{type_name} "
     if load_outputs:
         context.addLayerToLoadOnCompletion(
@@ -1,22 +1,68 @@
 """
 Store common functions that are required by different QNSPECT Modules
 """
+import copy
+import csv
+import functools
+import threading
+from typing import Dict
+
+import numpy as np
+
 from qgis.core import (
     QgsRasterBandStats,
     QgsSingleBandPseudoColorRenderer,
     QgsGradientColorRamp,
     QgsProcessingLayerPostProcessorInterface,
     QgsProcessing,
+    QgsProcessingUtils,
+    QgsProcessingException,
     QgsLayerTreeGroup,
     QgsLayerTree,
+    QgsCoordinateTransform,
+    QgsProcessingContext,
+    QgsProcessingFeedback,
 )
 
 from qgis.PyQt.QtGui import QColor
 
-from qgis.utils import iface
 from qgis.PyQt.QtCore import *
 
 import processing
+from processing.core.ProcessingConfig import ProcessingConfig
+
+from QNSPECT.engine.blocks import DEFAULT_MEMORY_MB, Canceled
+from QNSPECT.engine.routing import (
+    FlowRouting,
+    read_drainage_routing,
+    accumulate_raster,
+)
+from QNSPECT.engine.hydrology import flow_routing
+from QNSPECT.engine.outlets import OutletIndex, outlet_cells, snap_outlets
+from QNSPECT.engine.raster_io import raster_grid, read_array
+from QNSPECT.engine.scheduler import (
+    StepGraph,
+    DEFAULT_MAX_WORKERS,
+    available_memory_mb,
+    bounded_workers,
+)
+from QNSPECT.engine.cache import (
+    IntermediateCache,
+    DEFAULT_CACHE_DIR,
+    DEFAULT_CACHE_MB,
+)
+from QNSPECT.engine.profile import RunProfile, profiled
+
+# Options of the Flow Routing Engine parameter
+FLOW_ROUTING_ENGINES = ["GRASS r.watershed [Default]", "Native"]
+
+MEMORY_BUDGET_SETTING = "QNSPECT_MEMORY_MB"
+CACHE_DIR_SETTING = "QNSPECT_CACHE_DIR"
+CACHE_SIZE_SETTING = "QNSPECT_CACHE_MB"
+MAX_WORKERS_SETTING = "QNSPECT_MAX_WORKERS"
+
+# GRASS algorithms of a QGIS session share one temporary mapset, which each run removes when done
+_GRASS_LOCK = threading.Lock()
 
 
 class LayerPostProcessor(QgsProcessingLayerPostProcessorInterface):
@@ -49,6 +95,9 @@ def create_group(name: str, root: QgsLayerTree) -> None:
     Create a group (if doesn't exist) in QGIS layer tree.
     """
 
+    # imported here so that the module can be used without the QGIS GUI
+    from qgis.utils import iface
+
     group = root.findGroup(name)  # find group in whole hierarchy
     if not group:  # if group does not already exists
         selected_nodes = iface.layerTreeView().selectedNodes()  # get all selected nodes
@@ -71,6 +120,8 @@ def select_group(name: str) -> bool:
     Select group item of a node tree
     """
 
+    from qgis.utils import iface
+
     view = iface.layerTreeView()
     m = view.model()
 
@@ -100,6 +151,199 @@ def filter_matrix(matrix: list) -> list:
     return matrix_filtered
 
 
+def memory_budget() -> int:
+    """Memory budget (MB) of the block-streaming raster steps from the QNSPECT Processing settings"""
+    value = ProcessingConfig.getSetting(MEMORY_BUDGET_SETTING)
+    return int(value) if value else DEFAULT_MEMORY_MB
+
+
+def run_grass(algorithm: str, parameters: dict, context) -> dict:
+    """Run a GRASS child algorithm, one at a time for the whole QGIS session (see _GRASS_LOCK)"""
+    with _GRASS_LOCK:
+        return run_child(algorithm, parameters, context, None)
+
+
+def run_child(algorithm: str, parameters: dict, context, feedback) -> dict:
+    """Run a child algorithm, recorded in the profile of the running analysis"""
+    with profiled(algorithm, "child algorithm"):
+        return processing.run(
+            algorithm,
+            parameters,
+            context=context,
+            feedback=feedback,
+            is_child_algorithm=True,
+        )
+
+
+def cancelable(process_algorithm):
+    """Decorator of the processAlgorithm of the algorithms computing rasters with the engine.
+    A computation stopped by canceling the feedback ends the algorithm with no results, as when it
+    checks isCanceled between steps, instead of failing."""
+
+    @functools.wraps(process_algorithm)
+    def process(self, parameters, context, feedback):
+        try:
+            return process_algorithm(self, parameters, context, feedback)
+        except Canceled:
+            return {}
+
+    return process
+
+
+def profile_run(process_algorithm):
+    """Decorator of the processAlgorithm of the run algorithms.
+    Profiles the stages, steps and child algorithms of the run in self.profile, see RunProfile."""
+
+    @functools.wraps(process_algorithm)
+    def process(self, parameters, context, feedback):
+        self.profile = RunProfile(self.name(), QgsProcessingUtils.tempFolder())
+        with self.profile.active():
+            # until the first stage of the run: input checks and loading
+            self.profile.stage("Setup")
+            return process_algorithm(self, parameters, context, feedback)
+
+    return process
+
+
+def max_workers() -> int:
+    """Number of independent run steps running at the same time from the QNSPECT Processing settings"""
+    value = ProcessingConfig.getSetting(MAX_WORKERS_SETTING)
+    return max(int(value), 1) if value else DEFAULT_MAX_WORKERS
+
+
+class StepFeedback(QgsProcessingFeedback):
+    """Feedback of a step running next to other steps. Messages go to the algorithm feedback
+    prefixed with the step name and canceling the algorithm cancels the step.
+    The progress of the step is not forwarded, the algorithm reports the done steps."""
+
+    def __init__(self, name: str, feedback: QgsProcessingFeedback):
+        super().__init__()
+        self.name = name
+        self.feedback = feedback
+        feedback.canceled.connect(self.cancel, Qt.DirectConnection)
+        if feedback.isCanceled():
+            self.cancel()
+
+    def pushInfo(self, info):
+        self.feedback.pushInfo(f"[{self.name}] {info}")
+
+    def pushWarning(self, warning):
+        self.feedback.pushWarning(f"[{self.name}] {warning}")
+
+    def reportError(self, error, fatalError=False):
+        self.feedback.reportError(f"[{self.name}] {error}", fatalError)
+
+    def pushCommandInfo(self, info):
+        self.feedback.pushCommandInfo(f"[{self.name}] {info}")
+
+    def pushDebugInfo(self, info):
+        self.feedback.pushDebugInfo(f"[{self.name}] {info}")
+
+    def pushConsoleInfo(self, info):
+        self.feedback.pushConsoleInfo(f"[{self.name}] {info}")
+
+
+def run_step_graph(
+    graph: StepGraph, context, feedback, step_mb: float = None, workers: int = None
+) -> dict:
+    """Run the steps of graph in parallel up to the Maximum parallel run steps setting (or workers
+    if given) and, if step_mb (memory of a step in MB) is given, to the number of steps fitting in
+    the available memory.
+    A step is called as func(context, feedback, *dependency results). Parallel steps get their own
+    processing context, as contexts can not be shared between threads.
+    Returns the results by step name, or None if the run was canceled."""
+    workers = min(workers or max_workers(), len(graph))
+    if step_mb is not None:
+        workers = bounded_workers(workers, step_mb, available_memory_mb())
+
+    def context_step(name, func):
+        def step(step_feedback, *args):
+            with profiled(name):
+                if workers == 1:
+                    return func(context, step_feedback, *args)
+                # created in the worker thread, which owns the context and its layers
+                step_context = QgsProcessingContext()
+                step_context.copyThreadSafeSettings(context)
+                return func(step_context, step_feedback, *args)
+
+        return step
+
+    results = graph.wrapped(context_step).run(
+        workers,
+        feedback,
+        step_feedback=(lambda name: StepFeedback(name, feedback))
+        if workers > 1
+        else None,
+    )
+    if feedback.isCanceled():
+        return None
+    return results
+
+
+def intermediate_cache() -> IntermediateCache:
+    """Intermediate cache from the QNSPECT Processing settings. None if caching is disabled (size 0)."""
+    size_mb = ProcessingConfig.getSetting(CACHE_SIZE_SETTING)
+    size_mb = DEFAULT_CACHE_MB if size_mb is None else int(size_mb)
+    if size_mb <= 0:
+        return None
+    directory = ProcessingConfig.getSetting(CACHE_DIR_SETTING) or DEFAULT_CACHE_DIR
+    return IntermediateCache(directory, size_mb)
+
+
+def cached_intermediate(
+    name: str,
+    compute,
+    feedback,
+    output=None,
+    rasters=(),
+    tables=None,
+    params=None,
+) -> str:
+    """Reuse the intermediate raster from the cache if its inputs did not change, otherwise compute it.
+    compute receives the output path and returns the path of the written raster.
+    rasters are the input raster paths, tables the lookup table columns and params the parameters
+    the intermediate depends on."""
+    if output is None or output == QgsProcessing.TEMPORARY_OUTPUT:
+        output = QgsProcessingUtils.generateTempFilename(f"{name}.tif")
+
+    cache = intermediate_cache()
+    if cache is None:
+        with profiled(name, "intermediate"):
+            return compute(output)
+
+    key = cache.key(name, rasters, tables, params)
+    cached = cache.fetch(key, output)
+    if cached is not None:
+        feedback.pushInfo(f"Reusing cached {name} raster.")
+        return cached
+    with profiled(name, "intermediate"):
+        result = compute(output)
+    # child algorithms stop early on cancel, their outputs may be incomplete
+    if not feedback.isCanceled():
+        cache.store(key, result)
+    return result
+
+
+def cached_routing(compute, feedback, rasters=(), params=None) -> FlowRouting:
+    """Reuse the flow routing network from the cache if its inputs did not change, otherwise compute it.
+    Cached networks are memory-mapped, so runs and processes routing the same DEM share one copy."""
+    cache = intermediate_cache()
+    if cache is None:
+        with profiled("Flow Routing", "intermediate"):
+            return compute()
+
+    key = cache.key("Routing", rasters, params=params)
+    routing = cache.fetch_routing(key)
+    if routing is not None:
+        feedback.pushInfo("Reusing cached flow routing.")
+        return routing
+    with profiled("Flow Routing", "intermediate"):
+        routing = compute()
+    if not feedback.isCanceled():
+        cache.store_routing(key, routing)
+    return routing
+
+
 def perform_raster_math(
     exprs,
     input_dict,
@@ -129,83 +373,296 @@ def perform_raster_math(
         "RTYPE": 5,
         "OUTPUT": output,
     }
-    return processing.run(
-        "gdal:rastercalculator",
-        alg_params,
-        context=context,
-        feedback=feedback,
-        is_child_algorithm=True,
-    )
+    return run_child("gdal:rastercalculator", alg_params, context, feedback)
 
 
 def grass_material_transport(
-    elevation,
-    weight,
+    elevation: str,
+    weight: str,
     context,
     feedback,
     mfd=True,
     output=QgsProcessing.TEMPORARY_OUTPUT,
     threshold=500,
 ) -> dict:
-    # r.watershed
-    alg_params = {
-        "-4": False,
-        "-a": True,
-        "-b": False,
-        "-m": False,
-        "-s": not mfd,  # single flow direction
-        "GRASS_RASTER_FORMAT_META": "",
-        "GRASS_RASTER_FORMAT_OPT": "",
-        "GRASS_REGION_CELLSIZE_PARAMETER": 0,
-        "GRASS_REGION_PARAMETER": None,
-        "blocking": None,
-        "convergence": 5,
-        "depression": None,
-        "disturbed_land": None,
-        "elevation": elevation,
-        "flow": weight,
-        "max_slope_length": None,
-        "memory": 300,
-        "threshold": threshold,  # can be an input advanced parameter
-        "accumulation": QgsProcessing.TEMPORARY_OUTPUT,
-    }
-    feedback.pushInfo("\nGRASS Input parameters:")
-    feedback.pushCommandInfo(str(alg_params))
-    grass_accumulation = processing.run(
-        "grass7:r.watershed",
-        alg_params,
-        context=context,
-        feedback=None,
-        is_child_algorithm=True,
-    )["accumulation"]
-
-    # Grass output has 0 values marked as nodata
-    # Following is a temporary workaround, refer Github issue #29
-
-    # Fill NoData cells
-    alg_params = {
-        "BAND": 1,
-        "FILL_VALUE": 0,
-        "INPUT": grass_accumulation,
-        "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
-    }
-    all_filled = processing.run(
-        "native:fillnodata",
-        alg_params,
-        context=context,
-        feedback=feedback,
-        is_child_algorithm=True,
-    )["OUTPUT"]
-
-    # Get back original nodata cells
-    input_dict = {
-        "input_a": all_filled,
-        "band_a": 1,
-        "input_b": weight,
-        "band_b": 1,
+    """Accumulate the weight raster over the flow network of the elevation raster (paths) with r.watershed.
+    Accumulations are reused from the intermediate cache for unchanged elevation and weight rasters."""
+
+    def accumulate(output):
+        # r.watershed
+        alg_params = {
+            "-4": False,
+            "-a": True,
+            "-b": False,
+            "-m": False,
+            "-s": not mfd,  # single flow direction
+            "GRASS_RASTER_FORMAT_META": "",
+            "GRASS_RASTER_FORMAT_OPT": "",
+            "GRASS_REGION_CELLSIZE_PARAMETER": 0,
+            "GRASS_REGION_PARAMETER": None,
+            "blocking": None,
+            "convergence": 5,
+            "depression": None,
+            "disturbed_land": None,
+            "elevation": elevation,
+            "flow": weight,
+            "max_slope_length": None,
+            "memory": 300,
+            "threshold": threshold,  # can be an input advanced parameter
+            "accumulation": QgsProcessing.TEMPORARY_OUTPUT,
+        }
+        feedback.pushInfo("\nGRASS Input parameters:")
+        feedback.pushCommandInfo(str(alg_params))
+        grass_accumulation = run_grass("grass7:r.watershed", alg_params, context)[
+            "accumulation"
+        ]
+
+        # Grass output has 0 values marked as nodata
+        # Following is a temporary workaround, refer Github issue #29
+
+        # Fill NoData cells
+        alg_params = {
+            "BAND": 1,
+            "FILL_VALUE": 0,
+            "INPUT": grass_accumulation,
+            "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
+        }
+        all_filled = run_child("native:fillnodata", alg_params, context, feedback)[
+            "OUTPUT"
+        ]
+
+        # Get back original nodata cells
+        input_dict = {
+            "input_a": all_filled,
+            "band_a": 1,
+            "input_b": weight,
+            "band_b": 1,
+        }
+        exprs = "A + ( B * 0)"
+
+        return perform_raster_math(
+            exprs, input_dict, context=context, feedback=feedback, output=output
+        )["OUTPUT"]
+
+    return {
+        "OUTPUT": cached_intermediate(
+            "Accumulation",
+            accumulate,
+            feedback,
+            output,
+            rasters=[elevation, weight],
+            params={"mfd": mfd, "threshold": threshold},
+        )
     }
-    exprs = "A + ( B * 0)"
 
-    return perform_raster_math(
-        exprs, input_dict, context=context, feedback=feedback, output=output
+
+class MaterialTransport:
+    """Accumulates weight rasters over the flow network of one elevation raster (path).
+    The flow routing is computed once per DEM and each weight raster is accumulated over it with a single NumPy sweep.
+
+    With the GRASS engine, single flow direction routing comes from the r.watershed drainage directions.
+    r.watershed does not export its MFD flow weights, so GRASS MFD accumulations run r.watershed per weight.
+    The native engine computes D8 and MFD routing from the DEM without GRASS (see engine.hydrology)."""
+
+    def __init__(
+        self,
+        elevation: str,
+        context,
+        feedback,
+        mfd=True,
+        threshold=500,
+        native=False,
+    ):
+        self.elevation = elevation
+        self.context = context
+        self.feedback = feedback
+        self.mfd = mfd
+        self.threshold = threshold
+        self.native = native
+        self._routing = None
+
+    def for_step(self, context, feedback) -> "MaterialTransport":
+        """Transport for a step running in another thread, sharing the flow routing computed so far"""
+        transport = copy.copy(self)
+        transport.context = context
+        transport.feedback = feedback
+        return transport
+
+    def accumulation_memory_mb(self) -> float:
+        """Memory (MB) of one accumulation besides the shared flow routing"""
+        grid = raster_grid(self.elevation)
+        # weight, valid mask and accumulation of every cell
+        in_memory = grid.xsize * grid.ysize * 17 / 1024**2
+        if self.mfd and not self.native:
+            return max(in_memory, 300)  # r.watershed memory parameter
+        return in_memory
+
+    def routing(self) -> FlowRouting:
+        """Flow routing of the elevation raster, computed once per DEM and kept in the intermediate cache"""
+        if self._routing is None:
+            self._routing = cached_routing(
+                self._compute_routing,
+                self.feedback,
+                rasters=[self.elevation],
+                params={"mfd": self.mfd and self.native, "native": self.native},
+            )
+        return self._routing
+
+    def _compute_routing(self) -> FlowRouting:
+        if self.native:
+            self.feedback.pushInfo("Computing flow routing ...")
+            try:
+                return flow_routing(self.elevation, self.mfd)
+            except MemoryError as e:
+                raise QgsProcessingException(
+                    f"{e}. Use the GRASS Flow Routing Engine for this raster."
+                )
+        drainage = cached_intermediate(
+            "Drainage",
+            self._drainage,
+            self.feedback,
+            rasters=[self.elevation],
+            params={"mfd": False},
+        )
+        return read_drainage_routing(drainage)
+
+    def _drainage(self, output):
+        alg_params = {
+            "-4": False,
+            "-a": True,
+            "-b": False,
+            "-m": False,
+            "-s": True,
+            "GRASS_RASTER_FORMAT_META": "",
+            "GRASS_RASTER_FORMAT_OPT": "",
+            "GRASS_REGION_CELLSIZE_PARAMETER": 0,
+            "GRASS_REGION_PARAMETER": None,
+            "blocking": None,
+            "convergence": 5,
+            "depression": None,
+            "disturbed_land": None,
+            "elevation": self.elevation,
+            "flow": None,
+            "max_slope_length": None,
+            "memory": 300,
+            "threshold": self.threshold,
+            "drainage": output,
+        }
+        self.feedback.pushInfo("\nGRASS Input parameters:")
+        self.feedback.pushCommandInfo(str(alg_params))
+        return run_grass("grass7:r.watershed", alg_params, self.context)["drainage"]
+
+    def accumulate(self, weight: str, output=QgsProcessing.TEMPORARY_OUTPUT) -> dict:
+        """Accumulate the weight raster (path). Cells where the weight is NoData are NoData in the output."""
+        if self.mfd and not self.native:
+            return grass_material_transport(
+                self.elevation,
+                weight,
+                self.context,
+                self.feedback,
+                mfd=True,
+                output=output,
+                threshold=self.threshold,
+            )
+
+        # a sweep over the cached flow routing costs less than hashing and copying its output,
+        # so the accumulation itself is not cached
+        if output is None or output == QgsProcessing.TEMPORARY_OUTPUT:
+            output = QgsProcessingUtils.generateTempFilename("Accumulation.tif")
+        routing = self.routing()
+        with profiled("Accumulation", "intermediate"):
+            try:
+                return {"OUTPUT": accumulate_raster(routing, weight, output)}
+            except ValueError as e:
+                raise QgsProcessingException(
+                    f"{e}. All input rasters must be aligned with the Elevation Raster."
+                )
+
+    def outlet_totals(
+        self, cells: np.ndarray, weights: Dict[str, str]
+    ) -> Dict[str, np.ndarray]:
+        """Accumulated value of each weight raster (name: path) at the outlet cells (flat indices, -1 outside).
+        No accumulated raster is written, except for GRASS MFD which has no flow routing to index."""
+        if self.mfd and not self.native:
+            totals = {}
+            for name, weight in weights.items():
+                acc, valid = read_array(self.accumulate(weight)["OUTPUT"])
+                acc = np.where(valid, acc, np.nan).ravel()
+                totals[name] = np.where(cells >= 0, acc[cells], np.nan)
+            return totals
+
+        index = OutletIndex(self.routing(), cells)
+        totals = {}
+        for name, weight in weights.items():
+            try:
+                totals[name] = index.totals(weight, memory_budget())
+            except ValueError as e:
+                raise QgsProcessingException(
+                    f"{e}. All input rasters must be aligned with the Elevation Raster."
+                )
+        return totals
+
+
+def outlet_layer_cells(
+    transport: MaterialTransport,
+    outlet_layer,
+    elevation_layer,
+    context,
+    snap_distance: int = 0,
+):
+    """Feature ids, coordinates (Elevation Raster CRS) and flat cell indices (-1 outside) of outlet points"""
+    to_raster = QgsCoordinateTransform(
+        outlet_layer.crs(), elevation_layer.crs(), context.transformContext()
+    )
+    ids, xs, ys = [], [], []
+    for feature in outlet_layer.getFeatures():
+        if not feature.hasGeometry():
+            continue
+        point = to_raster.transform(feature.geometry().centroid().asPoint())
+        ids.append(feature.id())
+        xs.append(point.x())
+        ys.append(point.y())
+
+    grid = raster_grid(transport.elevation)
+    cells = outlet_cells(grid.geotransform, (grid.ysize, grid.xsize), xs, ys)
+    if (cells < 0).any():
+        transport.feedback.pushWarning(
+            f"{int((cells < 0).sum())} outlet points are outside of the Elevation Raster.\n"
+        )
+    if snap_distance > 0:
+        if transport.mfd and not transport.native:
+            transport.feedback.pushWarning(
+                "Outlet snapping requires the SFD or Native flow routing. Outlets are not snapped.\n"
+            )
+        else:
+            cells = snap_outlets(transport.routing(), cells, snap_distance)
+    return ids, xs, ys, cells
+
+
+def write_outlet_report(
+    transport: MaterialTransport,
+    outlet_layer,
+    elevation_layer,
+    weights: Dict[str, str],
+    output: str,
+    context,
+    snap_distance: int = 0,
+) -> str:
+    """Write the accumulated value of each weight raster (column name: path) at each outlet point to a CSV file"""
+    ids, xs, ys, cells = outlet_layer_cells(
+        transport, outlet_layer, elevation_layer, context, snap_distance
     )
+    totals = transport.outlet_totals(cells, weights)
+    grid = raster_grid(transport.elevation)
+    gt = grid.geotransform
+    rows, cols = np.divmod(cells, grid.xsize)
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Outlet", "X", "Y", "Cell X", "Cell Y"] + list(totals))
+        for i, fid in enumerate(ids):
+            inside = cells[i] >= 0
+            cell_x = gt[0] + (cols[i] + 0.5) * gt[1] if inside else ""
+            cell_y = gt[3] + (rows[i] + 0.5) * gt[5] if inside else ""
+            values = ["" if np.isnan(t[i]) else t[i] for t in totals.values()]
+            writer.writerow([fid, xs[i], ys[i], cell_x, cell_y] + values)
+    return output
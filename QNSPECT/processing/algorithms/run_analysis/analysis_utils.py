@@ -3,77 +3,89 @@ Store common functions that are required by different analysis modules
 """
 
 
+from typing import Dict, List
+
 from qgis.core import (
-    QgsProcessing,
+    QgsProcessingUtils,
     QgsVectorLayer,
-    Qgis,
-    QgsRasterLayer,
     QgsProcessingException,
+    NULL,
+)
+
+from QNSPECT.engine.histogram import class_counts
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.reclassify import reclassify_by_lookup, reclassify_by_lookup_fields
+from QNSPECT.processing.algorithms.qnspect_utils import (
+    memory_budget,
+    intermediate_cache,
 )
-import processing
 
 
-def convert_raster_data_type_to_float(
-    raster_layer: QgsRasterLayer,
+def reclassify_land_cover_raster_by_table_field(
+    lc_raster: str,
+    lookup_layer: QgsVectorLayer,
+    value_field: str,
     context,
     feedback,
     output=None,
 ):
-    """Converts the input raster layer's data type from an integer to a float 32.
-    If the input raster's data type is already a float, it will return the input raster layer."""
+    """Reclassify the land cover raster (path) with a lookup table field, block by block.
+    Land cover classes missing from the lookup table get NoData."""
     if output is None:
-        output = QgsProcessing.TEMPORARY_OUTPUT
-    data_type = raster_layer.dataProvider().dataType(1)
-    if data_type not in [Qgis.Float32, Qgis.Float64, Qgis.CFloat32, Qgis.CFloat64]:
-        alg_params = {
-            "BANDS": [1],
-            "DATA_TYPE": 6,  # Float 32
-            "INPUT": raster_layer,
-            "OPTIONS": "",
-            "OUTPUT": output,
-        }
-        return processing.run(
-            "gdal:rearrange_bands",
-            alg_params,
-            context=context,
+        output = QgsProcessingUtils.generateTempFilename(f"{value_field}.tif")
+
+    return {
+        "OUTPUT": reclassify_by_lookup(
+            lc_raster,
+            lookup_table_arrays(lookup_layer),
+            value_field,
+            output,
+            memory_mb=memory_budget(),
             feedback=feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
-    return raster_layer
+        )
+    }
 
 
-def reclassify_land_cover_raster_by_table_field(
+def reclassify_land_cover_raster_by_table_fields(
     lc_raster: str,
     lookup_layer: QgsVectorLayer,
-    value_field: str,
+    value_fields: List[str],
     context,
     feedback,
     output=None,
 ):
-    """Wrapper around QGIS Reclassify by Layer"""
+    """Reclassify the land cover raster (path) with several lookup table fields in one pass over the
+    land cover. Band i + 1 of the output holds value_fields[i].
+    Land cover classes missing from the lookup table get NoData."""
     if output is None:
-        output = QgsProcessing.TEMPORARY_OUTPUT
-
-    alg_params = {
-        "DATA_TYPE": 5,
-        "INPUT_RASTER": lc_raster,
-        "INPUT_TABLE": lookup_layer,
-        "MAX_FIELD": "lc_value",
-        "MIN_FIELD": "lc_value",
-        "NODATA_FOR_MISSING": True,
-        "NO_DATA": -999999,
-        "RANGE_BOUNDARIES": 2,
-        "RASTER_BAND": 1,
-        "VALUE_FIELD": value_field,
-        "OUTPUT": output,
+        output = QgsProcessingUtils.generateTempFilename("Coefficients.tif")
+
+    return {
+        "OUTPUT": reclassify_by_lookup_fields(
+            lc_raster,
+            lookup_table_arrays(lookup_layer),
+            value_fields,
+            output,
+            memory_mb=memory_budget(),
+            feedback=feedback,
+        )
     }
-    return processing.run(
-        "native:reclassifybylayer",
-        alg_params,
-        context=context,
-        feedback=feedback,
-        is_child_algorithm=True,
-    )
+
+
+def raster_class_counts(raster: str, feedback) -> Dict[float, int]:
+    """Number of cells of each value of the raster (path), NoData excluded.
+    Counts are reused from the intermediate cache for unchanged rasters."""
+    cache = intermediate_cache()
+    key = cache.key("ClassCounts", [raster]) if cache is not None else None
+    if cache is not None:
+        cached = cache.fetch_data(key)
+        if cached is not None:
+            return {float(value): count for value, count in cached}
+
+    counts = class_counts(raster, memory_mb=memory_budget(), feedback=feedback)
+    if cache is not None and not feedback.isCanceled():
+        cache.store_data(key, list(counts.items()))
+    return counts
 
 
 def check_raster_values_in_lookup_table(
@@ -81,32 +93,36 @@ def check_raster_values_in_lookup_table(
     lookup_table_layer,
     context,
     feedback,
-):
+) -> Dict[float, int]:
     """Finds the land cover lookup values, then compares with the raster.
-    If there area any values in the raster that are not in the lookup table, a QgsProcessingException is raised."""
+    If there area any values in the raster that are not in the lookup table, a QgsProcessingException is raised.
+    Returns the number of cells of each land cover class in the raster."""
     lc_codes = set()
     for land_cover in lookup_table_layer.getFeatures():
         lc_codes.add(float(land_cover["lc_value"]))
 
-    alg_params = {
-        "BAND": 1,
-        "INPUT": raster,
-        "OUTPUT_TABLE": QgsProcessing.TEMPORARY_OUTPUT,
-    }
-    values_table = processing.run(
-        "native:rasterlayeruniquevaluesreport",
-        alg_params,
-        context=context,
-        feedback=feedback,
-        is_child_algorithm=True,
-    )["OUTPUT_TABLE"]
-    values_table_layer = context.takeResultLayer(values_table)
-
-    error_codes = []
-    for feature in values_table_layer.getFeatures():
-        if feature["value"] not in lc_codes:
-            error_codes.append(feature["value"])
+    counts = raster_class_counts(raster.source(), feedback)
+
+    error_codes = [value for value in counts if value not in lc_codes]
     if error_codes:
         raise QgsProcessingException(
             f"The following land cover raster values were not found in the lookup table provided: {', '.join([str(ec) for ec in sorted(error_codes)])}"
         )
+    return counts
+
+
+def lookup_table_records(lookup_layer: QgsVectorLayer) -> list:
+    """Attributes of each lookup table feature as a dictionary. NULL values are returned as None."""
+    field_names = lookup_layer.fields().names()
+    return [
+        {
+            name: (None if value == NULL else value)
+            for name, value in zip(field_names, feature.attributes())
+        }
+        for feature in lookup_layer.getFeatures()
+    ]
+
+
+def lookup_table_arrays(lookup_layer: QgsVectorLayer) -> LookupTable:
+    """Lookup table layer as a LookupTable for the in-memory computations."""
+    return LookupTable(lookup_table_records(lookup_layer))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "NOAA"
+__date__ = "2022-02-15"
+__copyright__ = "(C) 2021 by NOAA"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import os
+from json import load
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingMultiStepFeedback,
+    QgsProcessingParameterString,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterVectorLayer,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterDefinition,
+    QgsProcessingException,
+)
+
+from QNSPECT.engine.basis import evaluate_class_basis
+from QNSPECT.processing.algorithms.run_analysis.run_pollution_analysis import (
+    RunPollutionAnalysis,
+)
+from QNSPECT.processing.algorithms.qnspect_utils import cancelable, memory_budget
+from QNSPECT.processing.algorithms.run_analysis.analysis_utils import (
+    lookup_table_arrays,
+)
+from QNSPECT.processing.algorithms.run_analysis.qnspect_run_algorithm import (
+    QNSPECTRunAlgorithm,
+)
+
+
+class EvaluatePollutantCoefficients(QNSPECTRunAlgorithm):
+    def __init__(self):
+        super().__init__()
+        self.run_name = ""
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterString(
+                "RunName",
+                "Run Name",
+                multiLine=False,
+                optional=False,
+                defaultValue="",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "RunFile",
+                "Run File with Class Accumulation Basis",
+                behavior=QgsProcessingParameterFile.File,
+                fileFilter="QNSPECT Pollution Files (*pol.json)",
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "LookupTable",
+                "Land Cover Lookup Table [optional, defaults to the lookup table of the run]",
+                optional=True,
+                types=[QgsProcessing.TypeVector],
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                "Pollutants",
+                "Pollutants (lookup table columns, comma separated)",
+                multiLine=False,
+                optional=False,
+                defaultValue="",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "LoadOutputs",
+                "Open output files after running algorithm",
+                defaultValue=True,
+            )
+        )
+        param = QgsProcessingParameterBoolean(
+            "ConcOutputs", "Output Concentration Rasters", defaultValue=False
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                "ProjectLocation",
+                "Folder for Run Outputs",
+                createByDefault=True,
+                defaultValue=None,
+            )
+        )
+
+    @cancelable
+    def processAlgorithm(self, parameters, context, model_feedback):
+        results = {}
+
+        ## Extract inputs
+        run_file = self.parameterAsString(parameters, "RunFile", context)
+        pollutants = [
+            pol.strip()
+            for pol in self.parameterAsString(parameters, "Pollutants", context).split(
+                ","
+            )
+            if pol.strip()
+        ]
+        conc_out = self.parameterAsBool(parameters, "ConcOutputs", context)
+        self.load_outputs = self.parameterAsBool(parameters, "LoadOutputs", context)
+        self.run_name = self.parameterAsString(parameters, "RunName", context)
+        proj_loc = self.parameterAsString(parameters, "ProjectLocation", context)
+
+        with open(run_file) as f:
+            run = load(f)
+        basis_dir = run.get("ClassBasis")
+        if not basis_dir:
+            raise QgsProcessingException(
+                "The run has no class accumulation basis. Run the pollution analysis with `Store Class Accumulation Basis` checked.\n"
+            )
+        if not os.path.isdir(basis_dir):
+            # the run folder may have been moved
+            basis_dir = os.path.join(
+                os.path.dirname(os.path.abspath(run_file)), "Class Basis"
+            )
+
+        ## Extract Lookup Table
+        if parameters.get("LookupTable"):
+            lookup_layer = self.parameterAsVectorLayer(
+                parameters, "LookupTable", context
+            )
+        else:
+            # the lookup table of the run, read through the parameter definitions of the pollution analysis
+            baseline = RunPollutionAnalysis()
+            baseline.initAlgorithm()
+            inputs = dict(run["Inputs"])
+            inputs.setdefault("LookupTable", None)
+            lookup_layer = baseline.extract_lookup_table(inputs, context)
+        lookup_fields = {f.name().lower(): f.name() for f in lookup_layer.fields()}
+
+        ## Assertions
+        if not pollutants:
+            model_feedback.pushWarning("No output desired. \n")
+            return {}
+        if not all([pol.lower() in lookup_fields.keys() for pol in pollutants]):
+            raise QgsProcessingException(
+                "One or more of the Pollutants is not a column in the Land Cover Lookup Table.\n"
+                + f"Missing Pollutants:\n{[pol.lower() for pol in pollutants if not pol.lower() in lookup_fields.keys()]}\n"
+            )
+
+        feedback = QgsProcessingMultiStepFeedback(len(pollutants), model_feedback)
+        run_out_dir = os.path.join(proj_loc, self.run_name)
+        os.makedirs(run_out_dir, exist_ok=True)
+        lookup = lookup_table_arrays(lookup_layer)
+        raining_days = int(run["Inputs"].get("RainingDays") or 1)
+        time_unit = "/year" if raining_days > 1 else "/event"
+
+        for i, pol in enumerate(pollutants):
+            feedback.setCurrentStep(i)
+            if feedback.isCanceled():
+                return {}
+            feedback.pushInfo(f"Evaluating {pol} rasters from the class basis ...")
+            paths = {
+                "Local": os.path.join(run_out_dir, f"{pol} Local.tif"),
+                "Accumulated": os.path.join(run_out_dir, f"{pol} Accumulated.tif"),
+            }
+            if conc_out:
+                paths["Concentration"] = os.path.join(
+                    run_out_dir, f"{pol} Concentration.tif"
+                )
+            try:
+                evaluate_class_basis(
+                    basis_dir,
+                    lookup,
+                    lookup_fields[pol.lower()],
+                    paths,
+                    memory_mb=memory_budget(),
+                    feedback=feedback,
+                )
+            except (IOError, ValueError) as e:
+                raise QgsProcessingException(str(e))
+
+            units = {
+                "Local": "mg" + time_unit,
+                "Accumulated": "kg" + time_unit,
+                "Concentration": "mg/L",
+            }
+            for kind, path in paths.items():
+                results[f"{pol} {kind}"] = path
+                if self.load_outputs:
+                    self.handle_post_processing(
+                        pol.lower(), path, f"{pol} {kind} ({units[kind]})", context
+                    )
+
+        return results
+
+    def name(self):
+        return "evaluate_pollutant_coefficients"
+
+    def displayName(self):
+        return self.tr("Evaluate Pollutant Coefficients")
+
+    def shortHelpString(self):
+        return """<html><body>
+<a href="https://www.noaa.gov/">Documentation</a>
+<h2>Algorithm Description</h2>
+<p>The `Evaluate Pollutant Coefficients` algorithm computes local, accumulated, and concentration pollutant rasters for new lookup table coefficients or new pollutant columns from a finished pollution analysis run, without flow routing.</p>
+<p>Pollutant loads are runoff times a land cover coefficient, so the accumulated load of any coefficients is a weighted sum of the accumulated runoff of each land cover class. The run must have been made with the `Store Class Accumulation Basis` option of `Run Pollution Analysis`, which saves these rasters. Each evaluation then takes seconds, e.g. to calibrate coefficients. The results are the same as a pollution analysis with the new coefficients, up to floating point rounding.</p>
+<h2>Input Parameters</h2>
+<h3>Run Name</h3>
+<p>Name of the evaluation. The algorithm will create a folder with this name and save all outputs in that folder.</p>
+<h3>Run File with Class Accumulation Basis</h3>
+<p>`.pol.json` file created by `Run Pollution Analysis` with the `Store Class Accumulation Basis` option checked.</p>
+<h3>Land Cover Lookup Table [optional]</h3>
+<p>Lookup table with the new coefficients. Curve Numbers of this table are not used: runoff is taken from the run. If no table is provided, the lookup table of the run is used, e.g. to evaluate pollutants that were not output by the run.</p>
+<h3>Pollutants</h3>
+<p>Comma separated names of the lookup table columns to evaluate, e.g. <code>Lead, Nitrogen</code>.</p>
+<h2>Advanced Parameters</h2>
+<h3>Output Concentration Raster</h3>
+<p>The concentration raster will only be outputted if this option is checked. Default is unchecked.</p>
+<h2>Outputs</h2>
+<h3>Folder for Run Outputs</h3>
+<p>The algorithm outputs will be saved in this directory in a separate folder.</p>
+</body></html>"""
+
+    def createInstance(self):
+        return EvaluatePollutantCoefficients()
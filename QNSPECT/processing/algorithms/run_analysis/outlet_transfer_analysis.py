@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "NOAA"
+__date__ = "2022-02-22"
+__copyright__ = "(C) 2021 by NOAA"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import os
+from json import load
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingMultiStepFeedback,
+    QgsProcessingParameterString,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterVectorLayer,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterBoolean,
+    QgsProcessingException,
+)
+
+from QNSPECT.engine.outlets import transfer_raster, contribution_raster
+from QNSPECT.processing.algorithms.run_analysis.run_pollution_analysis import (
+    RunPollutionAnalysis,
+)
+from QNSPECT.processing.algorithms.run_analysis.run_erosion_analysis import (
+    RunErosionAnalysis,
+)
+from QNSPECT.processing.algorithms.qnspect_utils import (
+    MaterialTransport,
+    cancelable,
+    memory_budget,
+    outlet_layer_cells,
+)
+from QNSPECT.processing.algorithms.run_analysis.qnspect_run_algorithm import (
+    QNSPECTRunAlgorithm,
+)
+
+
+class OutletTransferAnalysis(QNSPECTRunAlgorithm):
+    def __init__(self):
+        super().__init__()
+        self.run_name = ""
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterString(
+                "RunName",
+                "Run Name",
+                multiLine=False,
+                optional=False,
+                defaultValue="",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "RunFile",
+                "Pollution or Erosion Run File",
+                behavior=QgsProcessingParameterFile.File,
+                fileFilter="QNSPECT Run Files (*pol.json *ero.json)",
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "OutletPoints",
+                "Outlet Points",
+                types=[QgsProcessing.TypeVectorPoint],
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "OutletSnapDistance",
+                "Outlet Snap Distance (cells)",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "LoadOutputs",
+                "Open output files after running algorithm",
+                defaultValue=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                "ProjectLocation",
+                "Folder for Run Outputs",
+                createByDefault=True,
+                defaultValue=None,
+            )
+        )
+
+    @cancelable
+    def processAlgorithm(self, parameters, context, model_feedback):
+        results = {}
+
+        ## Extract inputs
+        run_file = self.parameterAsString(parameters, "RunFile", context)
+        outlet_layer = self.parameterAsVectorLayer(parameters, "OutletPoints", context)
+        snap_distance = self.parameterAsInt(parameters, "OutletSnapDistance", context)
+        self.load_outputs = self.parameterAsBool(parameters, "LoadOutputs", context)
+        self.run_name = self.parameterAsString(parameters, "RunName", context)
+        proj_loc = self.parameterAsString(parameters, "ProjectLocation", context)
+
+        with open(run_file) as f:
+            run = load(f)
+        run_dir = os.path.dirname(os.path.abspath(run_file))
+
+        # the run inputs are read through the parameter definitions of the analysis
+        erosion = run_file.lower().endswith("ero.json")
+        analysis = RunErosionAnalysis() if erosion else RunPollutionAnalysis()
+        analysis.initAlgorithm()
+        inputs = dict(run["Inputs"])
+        mfd = not erosion and analysis.parameterAsBool(inputs, "MFD", context)
+        native_routing = (
+            analysis.parameterAsEnum(inputs, "FlowRoutingEngine", context) == 1
+        )
+        elev_raster = analysis.parameterAsRasterLayer(
+            inputs, "ElevationRaster", context
+        )
+
+        ## Assertions
+        if mfd and not native_routing:
+            raise QgsProcessingException(
+                "Transfer rasters need the flow routing network, which GRASS r.watershed does not export for MFD routing. "
+                + "Run the analysis with the Native flow routing engine.\n"
+            )
+
+        # local load rasters of the run, also found next to the run file if the run folder was moved
+        local_outputs = {}
+        for name, path in run["Outputs"].items():
+            if not name.endswith(" Local"):
+                continue
+            if not os.path.isfile(path):
+                path = os.path.join(run_dir, os.path.basename(path))
+            if not os.path.isfile(path):
+                raise QgsProcessingException(f"Run output {name} is missing.\n")
+            local_outputs[name[: -len(" Local")]] = path
+
+        transport = MaterialTransport(
+            elev_raster.source(), context, model_feedback, mfd, native=native_routing
+        )
+        ids, _, _, cells = outlet_layer_cells(
+            transport, outlet_layer, elev_raster, context, snap_distance
+        )
+        outlets = [(fid, cell) for fid, cell in zip(ids, cells) if cell >= 0]
+        if not outlets:
+            raise QgsProcessingException(
+                "None of the Outlet Points is inside of the Elevation Raster.\n"
+            )
+
+        feedback = QgsProcessingMultiStepFeedback(1 + len(outlets), model_feedback)
+        run_out_dir = os.path.join(proj_loc, self.run_name)
+        os.makedirs(run_out_dir, exist_ok=True)
+
+        feedback.setCurrentStep(0)
+        if feedback.isCanceled():
+            return {}
+        feedback.pushInfo("Loading flow routing ...")
+        routing = transport.routing()
+
+        for i, (fid, cell) in enumerate(outlets):
+            feedback.setCurrentStep(1 + i)
+            if feedback.isCanceled():
+                return {}
+
+            # Fraction of the local load of each cell that reaches the outlet
+            feedback.pushInfo(f"Generating transfer raster of outlet {fid} ...")
+            name = f"Transfer Outlet {fid}"
+            try:
+                results[name] = transfer_raster(
+                    routing,
+                    [cell],
+                    elev_raster.source(),
+                    os.path.join(run_out_dir, f"{name}.tif"),
+                )
+            except ValueError as e:
+                raise QgsProcessingException(str(e))
+            if self.load_outputs:
+                self.handle_post_processing(
+                    "default", results[name], f"{name} (fraction)", context
+                )
+
+            # Load of each cell that reaches the outlet, the outlet reduction of removing it
+            for output, local in local_outputs.items():
+                contribution = f"{output} Reaching Outlet {fid}"
+                results[contribution] = contribution_raster(
+                    results[name],
+                    local,
+                    os.path.join(run_out_dir, f"{contribution}.tif"),
+                    memory_mb=memory_budget(),
+                )
+                if self.load_outputs:
+                    self.handle_post_processing(
+                        output.lower(), results[contribution], contribution, context
+                    )
+
+        return results
+
+    def name(self):
+        return "outlet_transfer_analysis"
+
+    def displayName(self):
+        return self.tr("Outlet Transfer Analysis")
+
+    def shortHelpString(self):
+        return """<html><body>
+<a href="https://www.noaa.gov/">Documentation</a>
+<h2>Algorithm Description</h2>
+<p>The `Outlet Transfer Analysis` algorithm computes, for every cell, the fraction of its local load that reaches an outlet, and the local load of each cell of a finished pollution or erosion run that reaches the outlet.</p>
+<p>The load of a cell reaching the outlet is the reduction of the outlet load if that cell's load is removed, e.g. by a best management practice. Candidate sites can therefore be ranked for all cells at once, instead of one land cover modification and analysis per candidate. Each outlet takes one reverse sweep over the flow routing of the run.</p>
+<h2>Input Parameters</h2>
+<h3>Run Name</h3>
+<p>Name of the analysis. The algorithm will create a folder with this name and save all outputs in that folder.</p>
+<h3>Pollution or Erosion Run File</h3>
+<p>`.pol.json` or `.ero.json` file of a finished run. The Elevation Raster and flow routing options of the run are used. Pollution runs with GRASS MFD routing are not supported; use the Native flow routing engine.</p>
+<h3>Outlet Points</h3>
+<p>Point layer of outlets, e.g. pour points, outfalls, or monitoring stations. Outputs are created for each point inside of the Elevation Raster.</p>
+<h3>Outlet Snap Distance (cells)</h3>
+<p>Each outlet is moved to the cell with the largest drainage area within this many cells, so that points digitized next to a stream fall on the stream. Default is 0 (no snapping).</p>
+<h2>Outputs</h2>
+<h3>Folder for Run Outputs</h3>
+<p>For each outlet, `Transfer Outlet [id]` holds the fraction (0 to 1) of a unit local load of each cell that reaches the outlet, and `[output] Reaching Outlet [id]` holds the local runoff, pollutant, or sediment load of each cell that reaches the outlet, in the units of the local raster of the run.</p>
+</body></html>"""
+
+    def createInstance(self):
+        return OutletTransferAnalysis()
@@ -36,6 +36,7 @@ from json import load
 
 from qgis.core import QgsVectorLayer, QgsProcessingException
 
+from QNSPECT.engine.profile import RunProfile
 from QNSPECT.processing.qnspect_algorithm import QNSPECTAlgorithm
 from QNSPECT.processing.algorithms.qnspect_utils import (
     LayerPostProcessor,
@@ -63,6 +64,8 @@ class QNSPECTRunAlgorithm(QNSPECTAlgorithm):
         # necessary to store LayerPostProcessor instances in class variable because of scoping issue
         self.styler_dict = {}
         self.load_outputs = False
+        # replaced by the profile of each run, see qnspect_utils.profile_run
+        self.profile = RunProfile()
 
     def group(self):
         return self.tr("Analysis")
@@ -80,6 +83,15 @@ class QNSPECTRunAlgorithm(QNSPECTAlgorithm):
 
         return {}
 
+    def add_run_profile(self, run_dict: dict, run_out_dir, write_trace: bool) -> None:
+        """Add the profile of the run to the run configuration, and write it as a Chrome trace next to it if write_trace"""
+        self.profile.stage(None)
+        run_dict["Profile"] = self.profile.summary()
+        if write_trace:
+            run_dict["Profile"]["Trace"] = self.profile.write_chrome_trace(
+                os.path.join(run_out_dir, f"{self.run_name}.trace.json")
+            )
+
     def extract_lookup_table(
         self,
         parameters,
@@ -1,11 +1,13 @@
-import math
+from QNSPECT.engine.terrain import relief_length_ratio_raster
+from QNSPECT.processing.algorithms.qnspect_utils import (
+    cached_intermediate,
+    memory_budget,
+)
 
-from qgis.core import QgsRasterLayer, QgsProcessing
-import processing
+__all__ = ("RELIEF_LENGTH_RATIO_PARAMS", "create_relief_length_ratio_raster")
 
-from QNSPECT.processing.algorithms.qnspect_utils import perform_raster_math
-
-__all__ = ("create_relief_length_ratio_raster",)
+# Cache parameters of the Relief Length Ratio, shared with the native terrain stage
+RELIEF_LENGTH_RATIO_PARAMS = {"units": "crs"}
 
 
 def create_relief_length_ratio_raster(
@@ -17,34 +19,25 @@ def create_relief_length_ratio_raster(
     """Relief-length ratio is the ratio between the vertical distance and horizontal distance along a slope.
     This algorithm calculates the height between each cell and its neighbor using the pythagorean theorem.
     It uses the cell slope value and cell size to calculate rise.
-    The result is divided by 1000 to yield units of m/km."""
-    slope_raster = create_slope(dem_raster, context, feedback)
-
-    input_dict = {"input_a": slope_raster, "band_a": 1}
-    cell_size_meters = math.sqrt(cell_size_sq_meters)
-
-    adjacent_expr = f"( {cell_size_meters} * tan(A * 3.14159 / 180.0) )"  # meters
-
-    expr = f"{adjacent_expr} / {cell_size_meters} / 1000.0"
-    return perform_raster_math(
-        exprs=expr,
-        input_dict=input_dict,
-        context=context,
-        feedback=feedback,
-    )["OUTPUT"]
-
-
-def create_slope(dem_raster: QgsRasterLayer, context, feedback) -> str:
-    # QGIS Native Slope
-    alg_params = {
-        "INPUT": dem_raster,
-        "Z_FACTOR": 1,
-        "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
-    }
-    return processing.run(
-        "native:slope",
-        alg_params,
-        context=context,
-        feedback=feedback,
-        is_child_algorithm=True,
-    )["OUTPUT"]
+    The result is divided by 1000 to yield units of m/km.
+    The slope is computed from the DEM block by block, without a temporary slope raster. As with
+    native:slope, the horizontal distances are in the CRS units of the DEM.
+    The raster is reused from the intermediate cache for an unchanged DEM."""
+    # the source, the layer may belong to another thread
+    elevation = dem_raster.source()
+
+    def relief_length_ratio(output):
+        return relief_length_ratio_raster(
+            elevation,
+            output,
+            memory_mb=memory_budget(),
+            feedback=feedback,
+        )
+
+    return cached_intermediate(
+        "Relief Length Ratio",
+        relief_length_ratio,
+        feedback,
+        rasters=[elevation],
+        params=RELIEF_LENGTH_RATIO_PARAMS,
+    )
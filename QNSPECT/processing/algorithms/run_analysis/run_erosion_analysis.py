@@ -20,10 +20,9 @@ __copyright__ = "(C) 2022 by NOAA"
 __revision__ = "$Format:%H$"
 
 
-import os
-import math
 import datetime
 import json
+import math
 
 from pathlib import Path
 
@@ -33,34 +32,52 @@ from qgis.core import (
     QgsProcessingParameterRasterLayer,
     QgsProcessingParameterVectorLayer,
     QgsProcessingParameterEnum,
+    QgsProcessingParameterNumber,
     QgsProcessingParameterFolderDestination,
     QgsProcessingParameterBoolean,
     QgsProcessingParameterDefinition,
     QgsUnitTypes,
     QgsProcessingParameterString,
     QgsProcessingException,
+    QgsProcessingUtils,
 )
 import processing
 
+from QNSPECT.engine.blocks import scale_raster
+from QNSPECT.engine.hydrology import D8_BYTES_PER_CELL, terrain_rasters
+from QNSPECT.engine.scheduler import StepGraph
+from QNSPECT.engine.erosion import (
+    compute_sediment_rasters,
+    fill_zero_k_factor_raster,
+    rusle_raster,
+    sediment_delivery_ratio_raster,
+    sediment_yield_raster,
+)
 from QNSPECT.processing.algorithms.qnspect_utils import (
-    perform_raster_math,
-    grass_material_transport,
+    MaterialTransport,
+    FLOW_ROUTING_ENGINES,
+    memory_budget,
+    cached_intermediate,
+    write_outlet_report,
+    run_step_graph,
+    run_grass,
+    profile_run,
+    cancelable,
 )
 from QNSPECT.processing.algorithms.run_analysis.analysis_utils import (
     reclassify_land_cover_raster_by_table_field,
-    convert_raster_data_type_to_float,
     check_raster_values_in_lookup_table,
+    lookup_table_arrays,
 )
 from QNSPECT.processing.algorithms.run_analysis.curve_number import CurveNumber
 from QNSPECT.processing.algorithms.run_analysis.relief_length_ratio import (
+    RELIEF_LENGTH_RATIO_PARAMS,
     create_relief_length_ratio_raster,
 )
 from QNSPECT.processing.algorithms.run_analysis.qnspect_run_algorithm import (
     QNSPECTRunAlgorithm,
 )
 
-DEFAULT_URBAN_K_FACTOR_VALUE = 0.3
-
 
 class RunErosionAnalysis(QNSPECTRunAlgorithm):
     lookupTable = "LookupTable"
@@ -77,7 +94,13 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
     sedimentYieldAccumulated = "Sediment Accumulated"
     runName = "RunName"
     dualSoils = "DualSoils"
+    flowRoutingEngine = "FlowRoutingEngine"
     loadOutputs = "LoadOutputs"
+    outletPoints = "OutletPoints"
+    outletSnapDistance = "OutletSnapDistance"
+    outletReportOnly = "OutletReportOnly"
+    fusedEngine = "FusedEngine"
+    profileTrace = "ProfileTrace"
 
     def __init__(self):
         super().__init__()
@@ -155,6 +178,16 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
         # param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         # self.addParameter(param)
 
+        param = QgsProcessingParameterEnum(
+            self.flowRoutingEngine,
+            "Flow Routing Engine",
+            options=FLOW_ROUTING_ENGINES,
+            allowMultiple=False,
+            defaultValue=[0],
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
         param = QgsProcessingParameterEnum(
             self.dualSoils,
             "Treat Dual Category Soils as",
@@ -165,6 +198,45 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
         )
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.fusedEngine,
+            "Compute Local Rasters in Memory [Fused]",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterVectorLayer(
+            self.outletPoints,
+            "Outlet Points for Load Report",
+            optional=True,
+            types=[QgsProcessing.TypeVectorPoint],
+            defaultValue=None,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.outletSnapDistance,
+            "Outlet Snap Distance (cells)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.outletReportOnly,
+            "Skip Accumulated Raster [Outlet Report Only]",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.profileTrace,
+            "Write Run Profile as Chrome Trace",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.projectLocation,
@@ -174,10 +246,12 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
             )
         )
 
+    @cancelable
+    @profile_run
     def processAlgorithm(self, parameters, context, model_feedback):
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
         # overall progress through the model
-        feedback = QgsProcessingMultiStepFeedback(11, model_feedback)
+        feedback = QgsProcessingMultiStepFeedback(4, model_feedback)
         results = {}
         outputs = {}
         run_dict = {}
@@ -213,108 +287,174 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
         run_out_dir: Path = project_loc / self.run_name
         run_out_dir.mkdir(parents=True, exist_ok=True)
 
-        ## RUSLE calculations
-        # K-factor - soil erodability
-        feedback.setCurrentStep(1)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Preprocessing K-Factor ...")
-        erodability_raster = self.fill_zero_k_factor_cells(
-            parameters, feedback, context
-        )
-
-        # C-factor - land cover
-        feedback.setCurrentStep(2)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Creating C-Factor ...")
-        # All final outputs that are not returned to user should be saved in outputs
-        c_factor_raster = outputs["C-Factor"] = self.create_c_factor_raster(
-            lookup_layer=lookup_layer,
-            land_cover_raster_layer=land_cover_raster,
-            context=context,
-            feedback=feedback,
-        )
-
-        # Length-slope factor
-        feedback.setCurrentStep(3)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Creating LS-Factor ...")
-        ls_factor = outputs["LS-Factor"] = self.create_ls_factor(parameters, context)
-
-        # RUSLE Soil Loss calculation
-        feedback.setCurrentStep(4)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Performing RUSLE calculations ...")
-        rusle = outputs["RUSLE Soil Loss"] = self.run_rusle(
-            c_factor=c_factor_raster,
-            ls_factor=ls_factor,
-            erodability=erodability_raster,
-            cell_size_sq_meters=cell_size_sq_meters,
-            parameters=parameters,
-            context=context,
-            feedback=feedback,
-        )
+        ## RUSLE and Sediment Delivery Ratio calculations
+        # Independent branches (K-Factor, C-Factor, LS-Factor, Relief Length Ratio and Curve Number)
+        # run at the same time up to the Maximum parallel run steps setting
+        k_factor_raster = self.parameterAsRasterLayer(
+            parameters, self.kFactorRaster, context
+        ).source()
+        r_factor_raster = self.parameterAsRasterLayer(
+            parameters, self.rFactorRaster, context
+        ).source()
+        soil_raster = self.parameterAsRasterLayer(
+            parameters, self.soilRaster, context
+        ).source()
+        dual_soil_type = self.parameterAsEnum(parameters, self.dualSoils, context)
+        native = self.native_routing(parameters, context)
+        fused = self.parameterAsBool(parameters, self.fusedEngine, context)
+        sediment_local_path = str(run_out_dir / (self.sedimentYieldLocal + ".tif"))
 
-        ## Sediment Delivery Ratio calculation section
-        # Relief length ratio part
-        feedback.setCurrentStep(5)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Creating Relief Length Ratio ...")
-        rl_raster = outputs["Relief Length Ratio"] = create_relief_length_ratio_raster(
-            dem_raster=elev_raster,
-            cell_size_sq_meters=cell_size_sq_meters,
-            context=context,
-            feedback=feedback,
-        )
+        def curve_number(step_context, step_feedback):
+            cn = CurveNumber(
+                land_cover_raster.source(),
+                soil_raster,
+                dual_soil_type=dual_soil_type,
+                lookup_layer=lookup_layer,
+                context=step_context,
+                feedback=step_feedback,
+            )
+            cn.generate_cn_raster()
+            return cn.cn_raster
+
+        steps = StepGraph()
+        # LS-Factor and Relief Length Ratio need neighboring cells and are written
+        if native:
+            # one read of the DEM for both
+            steps.add(
+                "Terrain",
+                lambda step_context, step_feedback: self.create_terrain_rasters(
+                    elev_raster, step_feedback, cell_size_sq_meters
+                ),
+            )
+            for name in ("LS-Factor", "Relief Length Ratio"):
+                steps.add(
+                    name,
+                    lambda step_context, step_feedback, terrain, name=name: terrain[
+                        name
+                    ],
+                    depends=["Terrain"],
+                )
+        else:
+            steps.add(
+                "LS-Factor",
+                lambda step_context, step_feedback: self.create_ls_factor(
+                    elev_raster, step_context, step_feedback
+                ),
+            )
+            steps.add(
+                "Relief Length Ratio",
+                lambda step_context, step_feedback: create_relief_length_ratio_raster(
+                    dem_raster=elev_raster,
+                    cell_size_sq_meters=cell_size_sq_meters,
+                    context=step_context,
+                    feedback=step_feedback,
+                ),
+            )
+        if fused:
+            # the per cell steps up to the local sediment run in one pass over the rasters
+            steps.add(
+                "Sediment Rasters",
+                lambda step_context, step_feedback, ls_factor, relief_length: self.compute_sediment_fused(
+                    land_cover_raster.source(),
+                    soil_raster,
+                    k_factor_raster,
+                    r_factor_raster,
+                    ls_factor,
+                    relief_length,
+                    lookup_layer,
+                    dual_soil_type,
+                    cell_size_sq_meters,
+                    sediment_local_path,
+                    step_feedback,
+                ),
+                depends=["LS-Factor", "Relief Length Ratio"],
+            )
+        else:
+            # K-factor - soil erodability
+            steps.add(
+                "K-Factor",
+                lambda step_context, step_feedback: self.fill_zero_k_factor_cells(
+                    k_factor_raster, step_feedback
+                ),
+            )
+            # C-factor - land cover
+            steps.add(
+                "C-Factor",
+                lambda step_context, step_feedback: self.create_c_factor_raster(
+                    lookup_layer=lookup_layer,
+                    land_cover_raster_layer=land_cover_raster,
+                    context=step_context,
+                    feedback=step_feedback,
+                ),
+            )
+            # RUSLE Soil Loss calculation
+            steps.add(
+                "RUSLE Soil Loss",
+                lambda step_context, step_feedback, c_factor, ls_factor, erodability: self.run_rusle(
+                    c_factor=c_factor,
+                    ls_factor=ls_factor,
+                    erodability=erodability,
+                    r_factor=r_factor_raster,
+                    cell_size_sq_meters=cell_size_sq_meters,
+                    feedback=step_feedback,
+                ),
+                depends=["C-Factor", "LS-Factor", "K-Factor"],
+            )
+            # Curve number part
+            steps.add("Curve Number", curve_number)
+            # Multiply RL and CN
+            steps.add(
+                "Sediment Delivery Ratio",
+                lambda step_context, step_feedback, relief_length, cn: self.run_sediment_delivery_ratio(
+                    cell_size_sq_meters=cell_size_sq_meters,
+                    relief_length=relief_length,
+                    curve_number=cn,
+                    context=step_context,
+                    feedback=step_feedback,
+                ),
+                depends=["Relief Length Ratio", "Curve Number"],
+            )
+            ## Output results
+            steps.add(
+                self.sedimentYieldLocal,
+                lambda step_context, step_feedback, sdr, rusle: self.run_sediment_yield(
+                    sediment_delivery_ratio=sdr,
+                    rusle=rusle,
+                    context=step_context,
+                    feedback=step_feedback,
+                    output=sediment_local_path,
+                ),
+                depends=["Sediment Delivery Ratio", "RUSLE Soil Loss"],
+            )
 
-        # Curve number part
-        feedback.setCurrentStep(6)
+        feedback.setCurrentStep(1)
         if feedback.isCanceled():
             return {}
-        feedback.pushInfo("Creating curve numbers ...")
-        cn = CurveNumber(
-            parameters[self.landCoverRaster],
-            parameters[self.soilRaster],
-            dual_soil_type=self.parameterAsEnum(parameters, self.dualSoils, context),
-            lookup_layer=lookup_layer,
-            context=context,
-            feedback=feedback,
+        feedback.pushInfo(
+            "Creating K-Factor, C-Factor, LS-Factor, RUSLE, Relief Length Ratio, curve numbers and SDR ..."
         )
-        cn.generate_cn_raster()
-        outputs["Curve Number"] = cn.cn_raster
-
-        # Multiply RL and CN
-        feedback.setCurrentStep(7)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Performing SDR calculations ...")
-        sdr = outputs["Sediment Delivery Ratio"] = self.run_sediment_delivery_ratio(
-            cell_size_sq_meters=cell_size_sq_meters,
-            relief_length=rl_raster,
-            curve_number=cn.cn_raster,
-            context=context,
-            feedback=feedback,
+        self.profile.stage("Sediment Local")
+        # All final outputs that are not returned to user should be saved in outputs
+        # the native LS-Factor holds the whole DEM, r.watershed its memory parameter
+        ls_factor_mb = 300
+        if native:
+            ls_factor_mb = (
+                elev_raster.width()
+                * elev_raster.height()
+                * D8_BYTES_PER_CELL
+                / 1024**2
+            )
+        step_outputs = run_step_graph(
+            steps, context, feedback, step_mb=max(memory_budget(), ls_factor_mb)
         )
-
-        ## Output results
-        feedback.setCurrentStep(8)
-        if feedback.isCanceled():
+        if step_outputs is None:
             return {}
-        feedback.pushInfo("Generating local sediments raster ...")
-        sediment_local_path = str(run_out_dir / (self.sedimentYieldLocal + ".tif"))
-        sediment_local = self.run_sediment_yield(
-            sediment_delivery_ratio=sdr,
-            rusle=rusle,
-            context=context,
-            feedback=feedback,
-            output=sediment_local_path,
-        )
+        step_outputs.pop("Terrain", None)
+        outputs.update(step_outputs)
+        if fused:
+            outputs.update(outputs.pop("Sediment Rasters"))
+        sediment_local = outputs[self.sedimentYieldLocal]
         # because this is an algorithm output this will go in results as well
-        outputs[self.sedimentYieldLocal] = sediment_local
         results[self.sedimentYieldLocal] = sediment_local
 
         if self.load_outputs:
@@ -322,42 +462,75 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
                 "sediment", sediment_local_path, "Sediment Local (kg/year)", context
             )
 
-        feedback.setCurrentStep(9)
+        feedback.setCurrentStep(2)
         if feedback.isCanceled():
             return {}
+        self.profile.stage("Sediment Accumulated")
 
-        # convert to Mg
-        feedback.pushInfo("Generating accumulated sediments raster ...")
-        input_params = {
-            "input_a": sediment_local,
-            "band_a": "1",
-        }
-        sediments_local_Mg = perform_raster_math(
-            "(A / 1000)", input_params, context, feedback
-        )["OUTPUT"]
+        outlet_layer = self.parameterAsVectorLayer(
+            parameters, self.outletPoints, context
+        )
+        report_only = outlet_layer is not None and self.parameterAsBool(
+            parameters, self.outletReportOnly, context
+        )
 
-        sediment_acc_path = str(run_out_dir / (self.sedimentYieldAccumulated + ".tif"))
-        sediment_acc = self.run_sediment_yield_accumulated(
-            sediment_yield=sediments_local_Mg,
-            elev_raster=elev_raster,
+        # convert to Mg, the fused step writes it with the local raster
+        if fused:
+            sediments_local_Mg = outputs[self.sedimentYieldLocal + " Mg"]
+        else:
+            sediments_local_Mg = scale_raster(
+                sediment_local,
+                1 / 1000,
+                QgsProcessingUtils.generateTempFilename("Sediment Local Mg.tif"),
+                memory_mb=memory_budget(),
+                feedback=feedback,
+            )
+
+        transport = MaterialTransport(
+            elev_raster.source(),
+            context,
+            feedback,
             mfd=False,  # self.parameterAsBool(parameters, self.mfd, context),
-            context=context,
-            feedback=feedback,
-            output=sediment_acc_path,
+            native=native,
         )
 
-        outputs[self.sedimentYieldAccumulated] = sediment_acc
-        results[self.sedimentYieldAccumulated] = sediment_acc
+        if not report_only:
+            feedback.pushInfo("Generating accumulated sediments raster ...")
+            sediment_acc_path = str(
+                run_out_dir / (self.sedimentYieldAccumulated + ".tif")
+            )
+            sediment_acc = self.run_sediment_yield_accumulated(
+                sediment_yield=sediments_local_Mg,
+                transport=transport,
+                output=sediment_acc_path,
+            )
 
-        if self.load_outputs:
-            self.handle_post_processing(
-                "sediment", sediment_acc, "Sediment Accumulation (Mg/year)", context
+            outputs[self.sedimentYieldAccumulated] = sediment_acc
+            results[self.sedimentYieldAccumulated] = sediment_acc
+
+            if self.load_outputs:
+                self.handle_post_processing(
+                    "sediment", sediment_acc, "Sediment Accumulation (Mg/year)", context
+                )
+
+        if outlet_layer is not None:
+            feedback.pushInfo("Generating outlet load report ...")
+            self.profile.stage("Outlet Report")
+            results["Outlet Report"] = write_outlet_report(
+                transport,
+                outlet_layer,
+                elev_raster,
+                {"Sediment (Mg/year)": sediments_local_Mg},
+                str(run_out_dir / "Outlet Report.csv"),
+                context,
+                self.parameterAsInt(parameters, self.outletSnapDistance, context),
             )
 
-        feedback.setCurrentStep(10)
+        feedback.setCurrentStep(3)
         if feedback.isCanceled():
             return {}
         feedback.pushInfo("Creating run configuration file ...")
+        self.profile.stage("Configuration File")
         run_dict = self.create_config_file(
             parameters=parameters,
             context=context,
@@ -383,38 +556,61 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
     def createInstance(self):
         return RunErosionAnalysis()
 
-    def fill_zero_k_factor_cells(self, parameters, feedback, context):
+    def fill_zero_k_factor_cells(self, k_factor_raster: str, feedback):
         """Zero values in the K-Factor grid should be assumed "urban" and given a default value."""
-        input_dict = {"input_a": parameters[self.kFactorRaster], "band_a": 1}
-        expr = "((A == 0) * 0.3) + ((A > 0) * A)"
-        return perform_raster_math(
-            exprs=expr,
-            input_dict=input_dict,
-            context=context,
+        return fill_zero_k_factor_raster(
+            k_factor_raster,
+            QgsProcessingUtils.generateTempFilename("K-Factor.tif"),
+            memory_mb=memory_budget(),
             feedback=feedback,
-        )["OUTPUT"]
+        )
+
+    def compute_sediment_fused(
+        self,
+        lc_raster: str,
+        soil_raster: str,
+        k_factor_raster: str,
+        r_factor_raster: str,
+        ls_factor: str,
+        relief_length: str,
+        lookup_layer,
+        dual_soil_type: int,
+        cell_size_sq_meters: float,
+        output: str,
+        feedback,
+    ) -> dict:
+        """Generate the C-Factor, CN, RUSLE, SDR and local sediment in memory with NumPy, block by block.
+        Only Sediment Local (kg) and its Mg accumulation weight are written to disk."""
+        paths = {
+            self.sedimentYieldLocal: output,
+            self.sedimentYieldLocal
+            + " Mg": QgsProcessingUtils.generateTempFilename("Sediment Local Mg.tif"),
+        }
+        return compute_sediment_rasters(
+            lc_raster,
+            soil_raster,
+            k_factor_raster,
+            r_factor_raster,
+            ls_factor,
+            relief_length,
+            lookup_table_arrays(lookup_layer),
+            paths,
+            dual_soil_type=dual_soil_type,
+            cell_size_sq_meters=cell_size_sq_meters,
+            memory_mb=memory_budget(),
+            feedback=feedback,
+        )
 
     def create_c_factor_raster(
         self, lookup_layer, land_cover_raster_layer, context, feedback
     ) -> str:
         """"""
-        # The c-factor raster will have floating-point values.
-        # If the land cover raster used is an integer type,
-        # the assignment process will convert the c-factor values to integers.
-        # Converting the land cover raster to floating point type fixes that.
-        land_cover_raster = convert_raster_data_type_to_float(
-            raster_layer=land_cover_raster_layer,
-            context=context,
-            feedback=feedback,
-            output=QgsProcessing.TEMPORARY_OUTPUT,
-        )
         c_factor_raster = reclassify_land_cover_raster_by_table_field(
-            lc_raster=land_cover_raster,
+            lc_raster=land_cover_raster_layer.source(),
             lookup_layer=lookup_layer,
             value_field="c_factor",
             context=context,
             feedback=feedback,
-            output=QgsProcessing.TEMPORARY_OUTPUT,
         )["OUTPUT"]
         return c_factor_raster
 
@@ -443,39 +639,14 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
         context,
         feedback,
     ) -> str:
-        """Runs a raster calculator using QGIS's native raster calculator class.
-        Modifies given tif names."""
-
-        # GDAL perform raster math function producing correct results but giving RuntimeWarning in power
-        # thus using qgis native raster calculator
-        # expression for GDAL Raster math 1.366 * (10**(-11)) * ((({math.sqrt(cell_size_sq_meters)} / 1000.0) ** 2) **(-0.0998)) * (A **0.3629) * (B**5.444)
-
-        relief_length_new = Path(relief_length).with_stem("relief_length").as_posix()
-        curve_number_new = Path(curve_number).with_stem("curve_number").as_posix()
-        os.rename(relief_length, relief_length_new)
-        os.rename(curve_number, curve_number_new)
-
-        expr = " * ".join(
-            [
-                "1.366",
-                "(10 ^ -11)",
-                f"({(math.sqrt(cell_size_sq_meters) / 1_000.0) ** 2} ^ -0.0998)",  # convert to sq km
-                '("relief_length@1" ^ 0.3629)',
-                '("curve_number@1" ^ 5.444)',
-            ]
-        )
-        alg_params = {
-            "EXPRESSION": expr,
-            "LAYERS": [relief_length_new, curve_number_new],
-            "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
-        }
-        return processing.run(
-            "qgis:rastercalculator",
-            alg_params,
-            context=context,
+        return sediment_delivery_ratio_raster(
+            relief_length,
+            curve_number,
+            cell_size_sq_meters,
+            QgsProcessingUtils.generateTempFilename("Sediment Delivery Ratio.tif"),
+            memory_mb=memory_budget(),
             feedback=feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        )
 
     def run_sediment_yield(
         self,
@@ -485,70 +656,41 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
         feedback,
         output,
     ) -> str:
-        input_dict = {
-            "input_a": sediment_delivery_ratio,
-            "band_a": 1,
-            "input_b": rusle,
-            "band_b": 1,
-        }
-        exprs = "A * B * 907.18474"  # Multiply by 907.18474 to convert from ton to kg
-        return perform_raster_math(
-            exprs=exprs,
-            input_dict=input_dict,
-            context=context,
+        return sediment_yield_raster(
+            sediment_delivery_ratio,
+            rusle,
+            output,
+            memory_mb=memory_budget(),
             feedback=feedback,
-            output=output,
-        )["OUTPUT"]
+        )
 
     def run_sediment_yield_accumulated(
         self,
         sediment_yield,
-        elev_raster,
-        mfd,
-        context,
-        feedback,
+        transport: MaterialTransport,
         output,
     ) -> str:
-        return grass_material_transport(
-            elevation=elev_raster,
-            weight=sediment_yield,
-            context=context,
-            feedback=feedback,
-            output=output,
-            mfd=mfd,
-        )["OUTPUT"]
+        return transport.accumulate(sediment_yield, output)["OUTPUT"]
 
     def run_rusle(
         self,
         c_factor,
         ls_factor,
         erodability,
+        r_factor,
         cell_size_sq_meters,
-        parameters,
-        context,
         feedback,
     ) -> str:
-        ## Unit conversion in this function:
-        ## -- The unit of RUSLE Soil Loss  is ton/acre/year
-        ## -- multiply by 0.0002 to convert from sq meters to acres
-        cell_size_acres = cell_size_sq_meters * 0.000247104369
-        raster_math_params = {
-            "input_a": c_factor,
-            "input_b": ls_factor,
-            "input_c": erodability,  # k-factor
-            "input_d": parameters[self.rFactorRaster],  # r-factor_raster,
-            "band_a": 1,
-            "band_b": 1,
-            "band_c": 1,
-            "band_d": 1,
-        }
-        return perform_raster_math(
-            f"A * B * C * D * {cell_size_acres}",
-            raster_math_params,
-            context,
-            feedback,
-            output=QgsProcessing.TEMPORARY_OUTPUT,
-        )["OUTPUT"]
+        return rusle_raster(
+            c_factor,
+            ls_factor,
+            erodability,  # k-factor
+            r_factor,
+            cell_size_sq_meters,
+            QgsProcessingUtils.generateTempFilename("RUSLE.tif"),
+            memory_mb=memory_budget(),
+            feedback=feedback,
+        )
 
     def create_config_file(
         self,
@@ -580,39 +722,105 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
         config["Outputs"] = results
         config["RunTime"] = str(datetime.datetime.now())
         config["QNSPECTVersion"] = self._version
+        self.add_run_profile(
+            config,
+            run_out_dir,
+            self.parameterAsBool(parameters, self.profileTrace, context),
+        )
         config_file = run_out_dir / f"{self.run_name}.ero.json"
         json.dump(config, config_file.open("w"), indent=4)
         return config
 
-    def create_ls_factor(self, parameters, context):
-        alg_params = {
-            "-4": False,
-            "-a": True,
-            "-b": False,
-            "-m": False,
-            "-s": True,
-            "GRASS_RASTER_FORMAT_META": "",
-            "GRASS_RASTER_FORMAT_OPT": "",
-            "GRASS_REGION_CELLSIZE_PARAMETER": 0,
-            "GRASS_REGION_PARAMETER": None,
-            "blocking": None,
-            "convergence": 5,
-            "depression": None,
-            "disturbed_land": None,
-            "elevation": parameters[self.elevationRaster],
-            "flow": None,
-            "max_slope_length": None,
-            "memory": 300,
-            "threshold": 500,
-            "length_slope": QgsProcessing.TEMPORARY_OUTPUT,
+    def native_routing(self, parameters, context) -> bool:
+        return self.parameterAsEnum(parameters, self.flowRoutingEngine, context) == 1
+
+    def create_terrain_rasters(
+        self, elev_raster, feedback, cell_size_sq_meters
+    ) -> dict:
+        """LS-Factor and Relief Length Ratio of the native engine from one read of the DEM.
+        Each is reused from the intermediate cache for an unchanged DEM, the DEM is only read if
+        one of them is missing."""
+        elevation = elev_raster.source()
+        meters_per_unit = math.sqrt(
+            cell_size_sq_meters
+            / (elev_raster.rasterUnitsPerPixelX() * elev_raster.rasterUnitsPerPixelY())
+        )
+        paths = {
+            name: QgsProcessingUtils.generateTempFilename(f"{name}.tif")
+            for name in ("LS-Factor", "Relief Length Ratio")
+        }
+        computed = []
+
+        def terrain(name):
+            if not computed:
+                try:
+                    terrain_rasters(
+                        elevation,
+                        paths["LS-Factor"],
+                        paths["Relief Length Ratio"],
+                        meters_per_unit,
+                    )
+                except MemoryError as e:
+                    raise QgsProcessingException(
+                        f"{e}. Use the GRASS Flow Routing Engine for this raster."
+                    )
+                computed.append(True)
+            return paths[name]
+
+        return {
+            "LS-Factor": cached_intermediate(
+                "LS-Factor",
+                lambda output: terrain("LS-Factor"),
+                feedback,
+                paths["LS-Factor"],
+                rasters=[elevation],
+                params={"mfd": False, "threshold": 500, "native": True},
+            ),
+            "Relief Length Ratio": cached_intermediate(
+                "Relief Length Ratio",
+                lambda output: terrain("Relief Length Ratio"),
+                feedback,
+                paths["Relief Length Ratio"],
+                rasters=[elevation],
+                params=RELIEF_LENGTH_RATIO_PARAMS,
+            ),
         }
-        return processing.run(
-            "grass7:r.watershed",
-            alg_params,
-            context=context,
-            feedback=None,
-            is_child_algorithm=True,
-        )["length_slope"]
+
+    def create_ls_factor(self, elev_raster, context, feedback):
+        """LS-Factor from r.watershed, reused from the intermediate cache for an unchanged DEM"""
+        elevation = elev_raster.source()
+
+        def ls_factor(output):
+            alg_params = {
+                "-4": False,
+                "-a": True,
+                "-b": False,
+                "-m": False,
+                "-s": True,
+                "GRASS_RASTER_FORMAT_META": "",
+                "GRASS_RASTER_FORMAT_OPT": "",
+                "GRASS_REGION_CELLSIZE_PARAMETER": 0,
+                "GRASS_REGION_PARAMETER": None,
+                "blocking": None,
+                "convergence": 5,
+                "depression": None,
+                "disturbed_land": None,
+                "elevation": elevation,
+                "flow": None,
+                "max_slope_length": None,
+                "memory": 300,
+                "threshold": 500,
+                "length_slope": output,
+            }
+            return run_grass("grass7:r.watershed", alg_params, context)["length_slope"]
+
+        return cached_intermediate(
+            "LS-Factor",
+            ls_factor,
+            feedback,
+            rasters=[elevation],
+            params={"mfd": False, "threshold": 500},
+        )
 
     def shortHelpString(self):
         return """<html><body>
@@ -620,6 +828,7 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
 <h2>Algorithm Description</h2>
 <p>The `Run Erosion Analysis` algorithm estimates annual erosion volume for a given area on per cell and accumulated basis. The volume is calculated using RUSLE and Sediment Delivery Ratio models (see the QNSPECT Technical documentation for details).</p>
 <p>The user must provide Elevation, Land Cover, Hydrologic Soil Group, K-Factor, and R-Factor rasters for the area of interest. The user is also optionally required to provide a lookup table that relates different land cover classes in the provided Land Cover raster with Curve Number and C-Factor values.</p>
+<p>The K-Factor, C-Factor, LS-Factor, Relief Length Ratio, and Curve Number rasters do not depend on each other. They are computed at the same time, up to `Maximum parallel run steps` in the QNSPECT section of the Processing options (default: the number of CPU cores, 1 runs the steps one after the other), limited to the number of steps that fit in the available memory. Each parallel step uses up to the QNSPECT memory budget. GRASS steps run one at a time.</p>
 
 <h2>Input Parameters</h2>
 
@@ -653,10 +862,28 @@ class RunErosionAnalysis(QNSPECTRunAlgorithm):
 <!--h3 >Use Multi Flow Direction [MFD] Routing</h3-->
 <!--p >By default, the Single Flow Direction [SFD] option is used for flow routing. Multi Flow Direction [MFD] routing will be utilized if this option is checked. The algorithm passes these flags to GRASS r.watershed function, which is the computational engine for accumulation calculations</p-->
 
+<h3>Flow Routing Engine</h3>
+<p>Engine used for the LS-Factor and sediment accumulation. GRASS r.watershed [Default] runs GRASS `r.watershed` in a GRASS session. Native computes the flow directions and the LS-Factor from the Elevation Raster directly in QGIS, routing flow through depressions to their spill point, and avoids the GRASS start-up cost, which is faster for small watersheds. With Native, the LS-Factor and the Relief Length Ratio are computed together from one read of the Elevation Raster. The results are close to, but not identical with, each other.</p>
+
 <h3>Treat Dual Category Soils as</h3>
 <p>Certain areas can have dual soil types (A/D, B/D, or C/D). These areas possess characteristics of Hydrologic Soil Group D during undrained conditions and characteristics of Hydrologic Soil Group A/B/C for drained conditions.</p>
 <p>In this parameter, the user can specify if these areas should be treated as drained, undrained, or average of both conditions. If the average option is selected, the algorithm will use the average of drained and undrained Curve Number for Sediment Delivery Ratio calculations.</p>
 
+<h3>Compute Local Rasters in Memory [Fused]</h3>
+<p>If checked, the Land Cover, Soil, K-Factor, and R-Factor rasters are read once with the LS-Factor and Relief Length Ratio rasters, and the C-Factor, Curve Number, RUSLE, Sediment Delivery Ratio, and local sediment are calculated in memory with NumPy instead of a chain of raster steps. Only the local sediment rasters are written to disk. The rasters are processed block by block within the memory budget set in the QNSPECT Processing settings. Default is unchecked.</p>
+
+<h3>Outlet Points for Load Report</h3>
+<p>Optional point layer of outlets, e.g. pour points, outfalls, or monitoring stations. If provided, the total sediment load (Mg) draining to each point is written to `Outlet Report.csv` in the run folder. The loads are summed from the local sediment raster over the upstream cells of each outlet, which is much faster than accumulating the full raster when only a few locations are of interest.</p>
+
+<h3>Outlet Snap Distance (cells)</h3>
+<p>Each outlet is moved to the cell with the largest drainage area within this many cells, so that points digitized next to a stream fall on the stream. Default is 0 (no snapping).</p>
+
+<h3>Skip Accumulated Raster [Outlet Report Only]</h3>
+<p>If checked and Outlet Points are provided, the accumulated sediment raster is not created and only the outlet report is written. Default is unchecked.</p>
+
+<h3>Write Run Profile as Chrome Trace</h3>
+<p>The run configuration file holds the wall time, CPU time, bytes read and written, temporary disk used, and peak memory of each stage, step, and child algorithm of the run under `Profile`. If checked, the profile is also written to `[Run Name].trace.json` in the run folder. The trace can be opened in chrome://tracing or https://ui.perfetto.dev to show the steps of the run, including the steps that ran in parallel, on a timeline. Default is unchecked.</p>
+
 <h2>Outputs</h2>
 
 <h3>Folder for Run Outputs</h3>
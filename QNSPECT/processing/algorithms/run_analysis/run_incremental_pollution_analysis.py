@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "NOAA"
+__date__ = "2022-02-15"
+__copyright__ = "(C) 2021 by NOAA"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import os
+import shutil
+from datetime import datetime
+from json import dumps, load
+
+from qgis.core import (
+    QgsProcessingMultiStepFeedback,
+    QgsProcessingParameterString,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterDefinition,
+    QgsProcessingException,
+)
+
+from QNSPECT.engine.incremental import (
+    changed_window,
+    window_local_rasters,
+    local_change,
+    write_window,
+    mask_window,
+    accumulate_change,
+    add_to_raster,
+    union_window,
+    update_concentration,
+)
+from QNSPECT.processing.algorithms.run_analysis.run_pollution_analysis import (
+    RunPollutionAnalysis,
+)
+from QNSPECT.processing.algorithms.run_analysis.runoff_volume import (
+    cell_area_in_sq_feet,
+)
+from QNSPECT.processing.algorithms.qnspect_utils import (
+    MaterialTransport,
+    filter_matrix,
+    memory_budget,
+    profile_run,
+    cancelable,
+)
+from QNSPECT.processing.algorithms.run_analysis.analysis_utils import (
+    check_raster_values_in_lookup_table,
+    lookup_table_arrays,
+)
+from QNSPECT.processing.algorithms.run_analysis.qnspect_run_algorithm import (
+    QNSPECTRunAlgorithm,
+)
+
+
+class RunIncrementalPollutionAnalysis(QNSPECTRunAlgorithm):
+    def __init__(self):
+        super().__init__()
+        self.run_name = ""
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterString(
+                "RunName",
+                "Run Name",
+                multiLine=False,
+                optional=False,
+                defaultValue="",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "BaselineRunFile",
+                "Baseline Run File",
+                behavior=QgsProcessingParameterFile.File,
+                fileFilter="QNSPECT Pollution Files (*pol.json)",
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                "LandCoverRaster",
+                "Modified Land Cover Raster",
+                optional=False,
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "LoadOutputs",
+                "Open output files after running algorithm",
+                defaultValue=True,
+            )
+        )
+        param = QgsProcessingParameterBoolean(
+            "ProfileTrace",
+            "Write Run Profile as Chrome Trace",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                "ProjectLocation",
+                "Folder for Run Outputs",
+                createByDefault=True,
+                defaultValue=None,
+            )
+        )
+
+    @cancelable
+    @profile_run
+    def processAlgorithm(self, parameters, context, model_feedback):
+        results = {}
+        run_dict = {}
+
+        ## Extract inputs
+        run_file = self.parameterAsString(parameters, "BaselineRunFile", context)
+        self.load_outputs = self.parameterAsBool(parameters, "LoadOutputs", context)
+        self.run_name = self.parameterAsString(parameters, "RunName", context)
+        proj_loc = self.parameterAsString(parameters, "ProjectLocation", context)
+        lc_raster = self.parameterAsRasterLayer(parameters, "LandCoverRaster", context)
+
+        with open(run_file) as f:
+            baseline_run = load(f)
+        inputs = dict(baseline_run["Inputs"])
+        inputs.setdefault("LookupTable", None)
+        baseline_dir = os.path.dirname(os.path.abspath(run_file))
+
+        # the baseline inputs are read through the parameter definitions of the pollution analysis
+        baseline = RunPollutionAnalysis()
+        baseline.initAlgorithm()
+        desired_outputs = filter_matrix(
+            baseline.parameterAsMatrix(inputs, "PollutantOutputs", context)
+        )
+        desired_pollutants = [pol for pol in desired_outputs if pol.lower() != "runoff"]
+        dual_soil_type = baseline.parameterAsEnum(inputs, "DualSoils", context)
+        precip_units = baseline.parameterAsEnum(inputs, "PrecipUnits", context)
+        raining_days = baseline.parameterAsInt(inputs, "RainingDays", context)
+        mfd = baseline.parameterAsBool(inputs, "MFD", context)
+        native_routing = (
+            baseline.parameterAsEnum(inputs, "FlowRoutingEngine", context) == 1
+        )
+        elev_raster = baseline.parameterAsRasterLayer(
+            inputs, "ElevationRaster", context
+        )
+        soil_raster = baseline.parameterAsRasterLayer(inputs, "HSGRaster", context)
+        baseline_lc_raster = baseline.parameterAsRasterLayer(
+            inputs, "LandCoverRaster", context
+        )
+        precip_raster = baseline.parameterAsRasterLayer(inputs, "PrecipRaster", context)
+
+        ## Assertions
+        if mfd and not native_routing:
+            raise QgsProcessingException(
+                "Incremental analysis needs the flow routing network, which GRASS r.watershed does not export for MFD routing. "
+                + "Run the baseline with the Native flow routing engine or run the full pollution analysis.\n"
+            )
+        run_out_dir = os.path.join(proj_loc, self.run_name)
+        if os.path.abspath(run_out_dir) == baseline_dir:
+            raise QgsProcessingException(
+                "The Run Name and Folder for Run Outputs must differ from the baseline run.\n"
+            )
+
+        # baseline outputs, also found next to the run file if the run folder was moved
+        baseline_outputs = {}
+        for name, path in baseline_run["Outputs"].items():
+            if name == "Outlet Report":
+                model_feedback.pushWarning(
+                    "The outlet report of the baseline run is not updated.\n"
+                )
+                continue
+            if not os.path.isfile(path):
+                path = os.path.join(baseline_dir, os.path.basename(path))
+            if not os.path.isfile(path):
+                raise QgsProcessingException(f"Baseline output {name} is missing.\n")
+            baseline_outputs[name] = path
+        conc_outputs = [
+            pol
+            for pol in desired_pollutants
+            if f"{pol} Concentration" in baseline_outputs
+        ]
+        if conc_outputs and "Runoff Accumulated" not in baseline_outputs:
+            model_feedback.pushWarning(
+                "Concentration rasters are not output because the baseline run has no Runoff Accumulated output.\n"
+            )
+            for pol in conc_outputs:
+                del baseline_outputs[f"{pol} Concentration"]
+            conc_outputs = []
+
+        ## Total steps based on necessary steps plus one for each accumulated raster
+        feedback = QgsProcessingMultiStepFeedback(
+            6 + len(desired_pollutants), model_feedback
+        )
+        current_step = 5
+
+        ## Extract Lookup Table
+        lookup_layer = baseline.extract_lookup_table(inputs, context)
+
+        check_raster_values_in_lookup_table(
+            raster=lc_raster,
+            lookup_table_layer=lookup_layer,
+            context=context,
+            feedback=feedback,
+        )
+        lookup_fields = {f.name().lower(): f.name() for f in lookup_layer.fields()}
+
+        # Start from a copy of the baseline outputs
+        feedback.setCurrentStep(1)
+        if feedback.isCanceled():
+            return {}
+        feedback.pushInfo("Copying baseline outputs ...")
+        self.profile.stage("Copy Baseline")
+        os.makedirs(run_out_dir, exist_ok=True)
+        for name, path in baseline_outputs.items():
+            results[name] = shutil.copyfile(
+                path, os.path.join(run_out_dir, os.path.basename(path))
+            )
+
+        # Bounding window of the land cover modification
+        feedback.setCurrentStep(2)
+        if feedback.isCanceled():
+            return {}
+        feedback.pushInfo("Locating land cover modifications ...")
+        self.profile.stage("Land Cover Modifications")
+        try:
+            window = changed_window(
+                baseline_lc_raster.source(), lc_raster.source(), memory_budget()
+            )
+        except ValueError as e:
+            raise QgsProcessingException(
+                f"{e}. The modified Land Cover Raster must be aligned with the baseline Land Cover Raster."
+            )
+
+        if window is None:
+            feedback.pushInfo(
+                "The land cover is not modified, outputs are the baseline outputs.\n"
+            )
+        else:
+            feedback.pushInfo(
+                f"Modified cells lie within columns {window[0]} to {window[0] + window[2] - 1} "
+                + f"and rows {window[1]} to {window[1] + window[3] - 1}."
+            )
+
+            # Local rasters of the baseline and the modified land cover inside the window
+            feedback.setCurrentStep(3)
+            if feedback.isCanceled():
+                return {}
+            feedback.pushInfo("Updating local runoff and pollutant rasters ...")
+            self.profile.stage("Local Rasters")
+            local_args = (
+                soil_raster.source(),
+                precip_raster.source(),
+                window,
+                lookup_table_arrays(lookup_layer),
+                {pol: lookup_fields[pol.lower()] for pol in desired_pollutants},
+                dual_soil_type,
+                precip_units,
+                raining_days,
+                cell_area_in_sq_feet(elev_raster),
+            )
+            base_local = window_local_rasters(baseline_lc_raster.source(), *local_args)
+            new_local = window_local_rasters(lc_raster.source(), *local_args)
+
+            weights = {"Runoff Accumulated": "Runoff Local"}
+            for pol in desired_pollutants:
+                weights[f"{pol} Accumulated"] = f"{pol} Local kg"
+            for local in weights.values():
+                if (new_local[local][1] & ~base_local[local][1]).any():
+                    raise QgsProcessingException(
+                        "The modified land cover gives values to cells that are NoData in the baseline run. "
+                        + "Run the full pollution analysis instead.\n"
+                    )
+
+            for pol in [None] + desired_pollutants:
+                name = f"{pol} Local" if pol else "Runoff Local"
+                if name in results:
+                    write_window(results[name], window, *new_local[name])
+
+            # Accumulated rasters only change downstream of the modified cells
+            feedback.setCurrentStep(4)
+            if feedback.isCanceled():
+                return {}
+            transport = MaterialTransport(
+                elev_raster.source(), context, feedback, mfd, native=native_routing
+            )
+            routing = transport.routing()
+            updated = window
+            for name, local in weights.items():
+                feedback.setCurrentStep(current_step)
+                current_step += 1
+                if feedback.isCanceled():
+                    return {}
+                if name not in results:
+                    continue
+                feedback.pushInfo(f"Updating {name} raster downstream ...")
+                self.profile.stage(name)
+                try:
+                    cells, change = accumulate_change(
+                        routing,
+                        window,
+                        local_change(base_local[local], new_local[local]),
+                    )
+                except ValueError as e:
+                    raise QgsProcessingException(
+                        f"{e}. All input rasters must be aligned with the Elevation Raster."
+                    )
+                updated = union_window(
+                    updated, add_to_raster(results[name], cells, change)
+                )
+                mask_window(results[name], window, new_local[local][1])
+
+            for pol in conc_outputs:
+                feedback.pushInfo(f"Updating {pol} concentration raster ...")
+                update_concentration(
+                    results[f"{pol} Accumulated"],
+                    results["Runoff Accumulated"],
+                    results[f"{pol} Concentration"],
+                    updated,
+                )
+
+        # Load outputs
+        time_unit = "/year" if raining_days > 1 else "/event"
+        if self.load_outputs:
+            for name, path in results.items():
+                entity = name.rsplit(" ", 1)[0]
+                if name.endswith("Concentration"):
+                    unit = "mg/L"
+                elif entity == "Runoff":
+                    unit = "L" + time_unit
+                elif name.endswith("Local"):
+                    unit = "mg" + time_unit
+                else:
+                    unit = "kg" + time_unit
+                self.handle_post_processing(
+                    entity.lower(), path, f"{name} ({unit})", context
+                )
+
+        # Configuration file, a complete run of the modified land cover with the baseline inputs
+        feedback.setCurrentStep(current_step)
+        if feedback.isCanceled():
+            return {}
+        feedback.pushInfo("Creating run configuration file ...")
+        self.profile.stage("Configuration File")
+        run_dict["Inputs"] = inputs
+        run_dict["Inputs"]["RunName"] = self.run_name
+        run_dict["Inputs"]["ProjectLocation"] = proj_loc
+        run_dict["Inputs"]["LandCoverRaster"] = lc_raster.source()
+        run_dict["Inputs"]["LoadOutputs"] = self.load_outputs
+        run_dict["BaselineRun"] = os.path.abspath(run_file)
+        run_dict["Outputs"] = results
+        run_dict["RunTime"] = str(datetime.now())
+        run_dict["QNSPECTVersion"] = self._version
+        self.add_run_profile(
+            run_dict,
+            run_out_dir,
+            self.parameterAsBool(parameters, "ProfileTrace", context),
+        )
+        with open(os.path.join(run_out_dir, f"{self.run_name}.pol.json"), "w") as f:
+            f.write(dumps(run_dict, indent=4))
+
+        return results
+
+    def name(self):
+        return "run_incremental_pollution_analysis"
+
+    def displayName(self):
+        return self.tr("Run Incremental Pollution Analysis")
+
+    def shortHelpString(self):
+        return """<html><body>
+<a href="https://www.noaa.gov/">Documentation</a>
+<h2>Algorithm Description</h2>
+<p>The `Run Incremental Pollution Analysis` algorithm updates the outputs of a previous pollution analysis run (the baseline) for a modified land cover, e.g. the output of the `Modify Land Cover` tools. All other inputs and options are taken from the baseline run.</p>
+<p>Instead of running the whole analysis again, local runoff and pollutant loads are recomputed only inside the bounding box of the modified cells, and accumulated rasters are updated only for the cells downstream of the modification. For small modifications of large watersheds this takes seconds instead of a full analysis. Results match a full run of the modified land cover up to floating point rounding.</p>
+<p>The flow routing of the baseline is reused from the intermediate cache when available. Baseline runs with GRASS MFD routing can not be updated incrementally; use the Native flow routing engine for MFD baselines.</p>
+<h2>Input Parameters</h2>
+<h3>Run Name</h3>
+<p>Name of the run. The algorithm will create a folder with this name, copy the baseline outputs to it, and update them. The Run Name or the Folder for Run Outputs must differ from the baseline run.</p>
+<h3>Baseline Run File</h3>
+<p>`.pol.json` file created by the `Run Pollution Analysis` algorithm for the unmodified land cover. The outputs of the baseline run must still exist.</p>
+<h3>Modified Land Cover Raster</h3>
+<p>Modified Land Cover raster. It must be aligned with the Land Cover Raster of the baseline run and its classes must be in the baseline lookup table.</p>
+<h2>Advanced Parameters</h2>
+<h3>Write Run Profile as Chrome Trace</h3>
+<p>The run configuration file holds the wall time, CPU time, bytes read and written, temporary disk used, and peak memory of each stage, step, and child algorithm of the run under `Profile`. If checked, the profile is also written to `[Run Name].trace.json` in the run folder. The trace can be opened in chrome://tracing or https://ui.perfetto.dev to show the steps of the run, including the steps that ran in parallel, on a timeline. Default is unchecked.</p>
+<h2>Outputs</h2>
+<h3>Folder for Run Outputs</h3>
+<p>The algorithm outputs and configuration file will be saved in this directory in a separate folder. The configuration file describes a complete pollution analysis of the modified land cover and can be loaded with the `Load Previous Run` tool.</p>
+</body></html>"""
+
+    def createInstance(self):
+        return RunIncrementalPollutionAnalysis()
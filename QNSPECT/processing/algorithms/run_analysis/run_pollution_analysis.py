@@ -36,19 +36,37 @@ from qgis.core import (
     QgsProcessingParameterBoolean,
     QgsProcessingParameterDefinition,
     QgsProcessingException,
+    QgsProcessingUtils,
 )
 import processing
 
+from QNSPECT.engine.basis import build_class_basis
+from QNSPECT.engine.scheduler import StepGraph
+from QNSPECT.engine.pollution import (
+    compute_local_rasters,
+    compute_concentration_raster,
+)
+
 from QNSPECT.processing.algorithms.run_analysis.curve_number import CurveNumber
-from QNSPECT.processing.algorithms.run_analysis.runoff_volume import RunoffVolume
+from QNSPECT.processing.algorithms.run_analysis.runoff_volume import (
+    RunoffVolume,
+    cell_area_in_sq_feet,
+)
 from QNSPECT.processing.algorithms.qnspect_utils import (
     perform_raster_math,
-    grass_material_transport,
+    MaterialTransport,
+    FLOW_ROUTING_ENGINES,
     filter_matrix,
+    memory_budget,
+    write_outlet_report,
+    run_step_graph,
+    profile_run,
+    cancelable,
 )
 from QNSPECT.processing.algorithms.run_analysis.analysis_utils import (
-    reclassify_land_cover_raster_by_table_field,
+    reclassify_land_cover_raster_by_table_fields,
     check_raster_values_in_lookup_table,
+    lookup_table_arrays,
 )
 from QNSPECT.processing.algorithms.run_analysis.qnspect_run_algorithm import (
     QNSPECTRunAlgorithm,
@@ -177,6 +195,15 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
         )
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            "FlowRoutingEngine",
+            "Flow Routing Engine",
+            options=FLOW_ROUTING_ENGINES,
+            allowMultiple=False,
+            defaultValue=[0],
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
         param = QgsProcessingParameterEnum(
             "DualSoils",
             "Treat Dual Category Soils as",
@@ -187,6 +214,52 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
         )
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            "FusedEngine",
+            "Compute Local Rasters in Memory [Fused]",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            "ClassBasis",
+            "Store Class Accumulation Basis",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterVectorLayer(
+            "OutletPoints",
+            "Outlet Points for Load Report",
+            optional=True,
+            types=[QgsProcessing.TypeVectorPoint],
+            defaultValue=None,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            "OutletSnapDistance",
+            "Outlet Snap Distance (cells)",
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=0,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            "OutletReportOnly",
+            "Skip Accumulated Rasters [Outlet Report Only]",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            "ProfileTrace",
+            "Write Run Profile as Chrome Trace",
+            defaultValue=False,
+        )
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 "ProjectLocation",
@@ -196,6 +269,8 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
             )
         )
 
+    @cancelable
+    @profile_run
     def processAlgorithm(self, parameters, context, model_feedback):
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
         # overall progress through the model
@@ -214,7 +289,17 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
         raining_days = self.parameterAsInt(parameters, "RainingDays", context)
 
         mfd = self.parameterAsBool(parameters, "MFD", context)
+        native_routing = (
+            self.parameterAsEnum(parameters, "FlowRoutingEngine", context) == 1
+        )
         conc_out = self.parameterAsBool(parameters, "ConcOutputs", context)
+        fused = self.parameterAsBool(parameters, "FusedEngine", context)
+        class_basis = self.parameterAsBool(parameters, "ClassBasis", context)
+        outlet_layer = self.parameterAsVectorLayer(parameters, "OutletPoints", context)
+        snap_distance = self.parameterAsInt(parameters, "OutletSnapDistance", context)
+        report_only = outlet_layer is not None and self.parameterAsBool(
+            parameters, "OutletReportOnly", context
+        )
         self.load_outputs = self.parameterAsBool(parameters, "LoadOutputs", context)
 
         self.run_name = self.parameterAsString(parameters, "RunName", context)
@@ -227,17 +312,18 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
         lc_raster = self.parameterAsRasterLayer(parameters, "LandCoverRaster", context)
         precip_raster = self.parameterAsRasterLayer(parameters, "PrecipRaster", context)
 
-        ## Total steps based on necessary steps plus two times for each pollutant
-        total_steps = 4 + (len(desired_pollutants) * 2)
-        if conc_out:
-            # additional round if concentration is returned
-            total_steps += len(desired_outputs)
+        ## Total steps based on necessary steps, the pollutant pipelines are one step
+        total_steps = 5
+        if class_basis:
+            total_steps += 1
+        if outlet_layer is not None:
+            total_steps += 1
         feedback = QgsProcessingMultiStepFeedback(total_steps, model_feedback)
 
         ## Extract Lookup Table
         lookup_layer = self.extract_lookup_table(parameters, context)
 
-        check_raster_values_in_lookup_table(
+        lc_class_counts = check_raster_values_in_lookup_table(
             raster=lc_raster,
             lookup_table_layer=lookup_layer,
             context=context,
@@ -264,163 +350,290 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
         run_out_dir = os.path.join(proj_loc, self.run_name)
         os.makedirs(run_out_dir, exist_ok=True)
 
-        ## Generate CN Raster
-        feedback.setCurrentStep(1)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Generating curve numbers ...")
-        cn = CurveNumber(
-            parameters["LandCoverRaster"],
-            parameters["HSGRaster"],
-            dual_soil_type,
-            lookup_layer,
-            context,
-            feedback,
-        )
-
-        # All final outputs that are not returned to user should be saved in outputs
-        outputs["CN"] = cn.generate_cn_raster()
-
         # Determine time unit label
         if raining_days > 1:
             time_unit = "/year"
         else:
             time_unit = "/event"
 
-        # Calculate Q (Runoff) (Liters)
-        # using elev layer here because everything should have same units and crs
-        feedback.setCurrentStep(2)
-        if feedback.isCanceled():
-            return {}
-        feedback.pushInfo("Generating local runoff volume ...")
-        runoff_vol = RunoffVolume(
-            parameters["PrecipRaster"],
-            outputs["CN"]["OUTPUT"],
-            elev_raster,
-            precip_units,
-            raining_days,
-            context,
-            feedback,
-        )
-        # not putting (L) in the name because special characs don't go well in file names
-        # should be handled in post processor through display name
-        if "runoff" in [out.lower() for out in desired_outputs]:
-            runoff_output = os.path.join(run_out_dir, f"Runoff Local.tif")
-            outputs["Runoff Local"] = runoff_vol.calculate_Q(runoff_output)
-            results["Runoff Local"] = outputs["Runoff Local"]["OUTPUT"]
-            if self.load_outputs:
-                self.handle_post_processing(
-                    "runoff",
-                    outputs["Runoff Local"]["OUTPUT"],
-                    "Runoff Local (L" + time_unit + ")",
-                    context,
+        if fused:
+            ## Generate CN, Runoff and Pollutant Local rasters in a single pass
+            feedback.setCurrentStep(1)
+            if feedback.isCanceled():
+                return {}
+            feedback.pushInfo("Generating local runoff and pollutant rasters ...")
+            self.profile.stage("Local Rasters")
+            outputs.update(
+                self.compute_local_rasters_fused(
+                    lc_raster,
+                    soil_raster,
+                    precip_raster,
+                    elev_raster,
+                    lookup_layer,
+                    {pol: lookup_fields[pol.lower()] for pol in desired_pollutants},
+                    "runoff" in [out.lower() for out in desired_outputs],
+                    run_out_dir,
+                    dual_soil_type,
+                    precip_units,
+                    raining_days,
+                    feedback,
                 )
+            )
+            if "runoff" in [out.lower() for out in desired_outputs]:
+                results["Runoff Local"] = outputs["Runoff Local"]["OUTPUT"]
+                if self.load_outputs:
+                    self.handle_post_processing(
+                        "runoff",
+                        outputs["Runoff Local"]["OUTPUT"],
+                        "Runoff Local (L" + time_unit + ")",
+                        context,
+                    )
+            for pol in desired_pollutants:
+                results[pol + " Local"] = outputs[pol + " Local"]["OUTPUT"]
+                if self.load_outputs:
+                    self.handle_post_processing(
+                        pol.lower(),
+                        outputs[pol + " Local"]["OUTPUT"],
+                        f"{pol} Local (mg" + time_unit + ")",
+                        context,
+                    )
         else:
-            outputs["Runoff Local"] = runoff_vol.calculate_Q()
-
-        ## Pollutant rasters
-        current_step = 3
-        for pol in desired_pollutants:
-            feedback.setCurrentStep(current_step)
-            current_step += 1
+            ## Generate CN Raster
+            feedback.setCurrentStep(1)
             if feedback.isCanceled():
                 return {}
-            # Calculate pollutant per LU (mg/L)
-            feedback.pushInfo(f"Generating {pol} raster using lookup table ...")
-            outputs[pol + "_lu"] = reclassify_land_cover_raster_by_table_field(
-                parameters["LandCoverRaster"],
+            feedback.pushInfo("Generating curve numbers ...")
+            self.profile.stage("Curve Number")
+            cn = CurveNumber(
+                lc_raster.source(),
+                soil_raster.source(),
+                dual_soil_type,
                 lookup_layer,
-                lookup_fields[pol.lower()],
                 context,
                 feedback,
             )
-            # multiply by Runoff Liters to get local effect (mg)
-            input_params = {
-                "input_a": outputs["Runoff Local"]["OUTPUT"],
-                "band_a": "1",
-                "input_b": outputs[pol + "_lu"]["OUTPUT"],
-                "band_b": "1",
-            }
-            outputs[pol + " Local"] = perform_raster_math(
-                "(A*B)",
-                input_params,
+
+            # All final outputs that are not returned to user should be saved in outputs
+            outputs["CN"] = cn.generate_cn_raster()
+
+            # Calculate Q (Runoff) (Liters)
+            # using elev layer here because everything should have same units and crs
+            feedback.setCurrentStep(2)
+            if feedback.isCanceled():
+                return {}
+            feedback.pushInfo("Generating local runoff volume ...")
+            self.profile.stage("Runoff Local")
+            runoff_vol = RunoffVolume(
+                precip_raster.source(),
+                outputs["CN"]["OUTPUT"],
+                elev_raster,
+                precip_units,
+                raining_days,
                 context,
                 feedback,
-                os.path.join(run_out_dir, f"{pol} Local.tif"),
             )
-            results[pol + " Local"] = outputs[pol + " Local"]["OUTPUT"]
-            if self.load_outputs:
-                self.handle_post_processing(
-                    pol.lower(),
-                    outputs[pol + " Local"]["OUTPUT"],
-                    f"{pol} Local (mg" + time_unit + ")",
-                    context,
-                )
+            # not putting (L) in the name because special characs don't go well in file names
+            # should be handled in post processor through display name
+            if "runoff" in [out.lower() for out in desired_outputs]:
+                runoff_output = os.path.join(run_out_dir, f"Runoff Local.tif")
+                outputs["Runoff Local"] = runoff_vol.calculate_Q(runoff_output)
+                results["Runoff Local"] = outputs["Runoff Local"]["OUTPUT"]
+                if self.load_outputs:
+                    self.handle_post_processing(
+                        "runoff",
+                        outputs["Runoff Local"]["OUTPUT"],
+                        "Runoff Local (L" + time_unit + ")",
+                        context,
+                    )
+            else:
+                outputs["Runoff Local"] = runoff_vol.calculate_Q()
 
-        # Accumulated Runoff Calculation (L)
+        ## Pollutant pipelines: local, accumulated and concentration rasters
+        # Pollutants are independent once local runoff exists, so their pipelines run at the same
+        # time up to the Maximum parallel run steps setting and the available memory
+        current_step = 3
         feedback.setCurrentStep(current_step)
         current_step += 1
         if feedback.isCanceled():
             return {}
-        feedback.pushInfo("Generating accumulated runoff volume ...")
-        if "runoff" in [out.lower() for out in desired_outputs]:
-            runoff_output = os.path.join(run_out_dir, f"Runoff Accumulated.tif")
+        self.profile.stage("Pollutant Pipelines")
 
-            outputs["Runoff Accumulated"] = grass_material_transport(
-                parameters["ElevationRaster"],
-                outputs["Runoff Local"]["OUTPUT"],
-                context,
-                feedback,
-                mfd,
-                runoff_output,
+        # Flow routing is shared by the runoff and all pollutant accumulations
+        transport = MaterialTransport(
+            elev_raster.source(), context, feedback, mfd, native=native_routing
+        )
+        if native_routing or not mfd:
+            # computed once here, then shared by the steps
+            transport.routing()
+
+        def coefficients(step_context, step_feedback):
+            # Pollutant per LU (mg/L) of all pollutants, one band each, from a single land cover read
+            step_feedback.pushInfo(
+                "Generating pollutant rasters using lookup table ..."
             )
-            results["Runoff Accumulated"] = outputs["Runoff Accumulated"]["OUTPUT"]
-            if self.load_outputs:
-                self.handle_post_processing(
-                    "runoff",
-                    outputs["Runoff Accumulated"]["OUTPUT"],
-                    "Runoff Accumulated (L" + time_unit + ")",
-                    context,
-                )
-        else:
-            outputs["Runoff Accumulated"] = grass_material_transport(
-                parameters["ElevationRaster"],
-                outputs["Runoff Local"]["OUTPUT"],
-                context,
-                feedback,
-                mfd,
+            return reclassify_land_cover_raster_by_table_fields(
+                lc_raster.source(),
+                lookup_layer,
+                [lookup_fields[pol.lower()] for pol in desired_pollutants],
+                step_context,
+                step_feedback,
             )
 
-        # Accumulated Pollutants
-        for pol in desired_pollutants:
-            feedback.setCurrentStep(current_step)
-            current_step += 1
-            if feedback.isCanceled():
-                return {}
+        def pollutant_local(pol):
+            def step(step_context, step_feedback, lu):
+                # multiply by Runoff Liters to get local effect (mg)
+                step_feedback.pushInfo(f"Generating {pol} local raster ...")
+                input_params = {
+                    "input_a": outputs["Runoff Local"]["OUTPUT"],
+                    "band_a": "1",
+                    "input_b": lu["OUTPUT"],
+                    "band_b": str(desired_pollutants.index(pol) + 1),
+                }
+                return perform_raster_math(
+                    "(A*B)",
+                    input_params,
+                    step_context,
+                    step_feedback,
+                    os.path.join(run_out_dir, f"{pol} Local.tif"),
+                )
 
-            # convert local pollutants to kg
-            feedback.pushInfo(f"Generating {pol} accumulated raster ...")
-            input_params = {
-                "input_a": outputs[pol + " Local"]["OUTPUT"],
-                "band_a": "1",
-            }
-            outputs[pol + " local_kg"] = perform_raster_math(
-                "(A * 1e-6)",
-                input_params,
-                context,
-                feedback,
+            return step
+
+        def pollutant_accumulated(pol):
+            def step(step_context, step_feedback, local=None):
+                # convert local pollutants to kg
+                local_kg = outputs.get(pol + " local_kg")
+                if local_kg is None:
+                    input_params = {
+                        "input_a": (local or outputs[pol + " Local"])["OUTPUT"],
+                        "band_a": "1",
+                    }
+                    local_kg = perform_raster_math(
+                        "(A * 1e-6)",
+                        input_params,
+                        step_context,
+                        step_feedback,
+                    )
+                if report_only:
+                    # loads are summed at the outlets from the local rasters
+                    return {"local_kg": local_kg}
+
+                # Accumulated Pollutant (kg)
+                step_feedback.pushInfo(f"Generating {pol} accumulated raster ...")
+                accumulated = transport.for_step(
+                    step_context, step_feedback
+                ).accumulate(
+                    local_kg["OUTPUT"],
+                    os.path.join(run_out_dir, f"{pol} Accumulated.tif"),
+                )
+                return {"local_kg": local_kg, "Accumulated": accumulated}
+
+            return step
+
+        def runoff_accumulated(step_context, step_feedback):
+            step_feedback.pushInfo("Generating accumulated runoff volume ...")
+            if "runoff" in [out.lower() for out in desired_outputs]:
+                output = os.path.join(run_out_dir, f"Runoff Accumulated.tif")
+            else:
+                output = QgsProcessing.TEMPORARY_OUTPUT
+            return transport.for_step(step_context, step_feedback).accumulate(
+                outputs["Runoff Local"]["OUTPUT"], output
             )
 
-            # Accumulated Pollutant (kg)
-            outputs[pol + " Accumulated"] = grass_material_transport(
-                parameters["ElevationRaster"],
-                outputs[pol + " local_kg"]["OUTPUT"],
-                context,
-                feedback,
-                mfd,
-                os.path.join(run_out_dir, f"{pol} Accumulated.tif"),
-            )
+        def pollutant_concentration(pol):
+            def step(step_context, step_feedback, accumulated, runoff_acc):
+                # Concentration Pollutant (mg/L)
+                step_feedback.pushInfo(f"Generating {pol} concentration raster ...")
+                conc_output = os.path.join(run_out_dir, f"{pol} Concentration.tif")
+                if fused:
+                    return {
+                        "OUTPUT": compute_concentration_raster(
+                            accumulated["Accumulated"]["OUTPUT"],
+                            runoff_acc["OUTPUT"],
+                            conc_output,
+                            memory_mb=memory_budget(),
+                            feedback=step_feedback,
+                        )
+                    }
+                input_params = {
+                    "input_a": accumulated["Accumulated"]["OUTPUT"],
+                    "band_a": "1",
+                    "input_b": runoff_acc["OUTPUT"],
+                    "band_b": "1",
+                }
+                return perform_raster_math(
+                    "numpy.divide(A, B, out=numpy.zeros_like(A), where=(B!=0)) * 1e6",  # Convert kg back to mg
+                    input_params,
+                    step_context,
+                    step_feedback,
+                    conc_output,
+                )
+
+            return step
+
+        steps = StepGraph()
+        if not report_only:
+            steps.add("Runoff Accumulated", runoff_accumulated)
+        if not fused and desired_pollutants:
+            steps.add("Pollutant Coefficients", coefficients)
+        for pol in desired_pollutants:
+            if fused:
+                steps.add(f"{pol} Accumulated", pollutant_accumulated(pol))
+            else:
+                steps.add(
+                    f"{pol} Local",
+                    pollutant_local(pol),
+                    depends=["Pollutant Coefficients"],
+                )
+                steps.add(
+                    f"{pol} Accumulated",
+                    pollutant_accumulated(pol),
+                    depends=[f"{pol} Local"],
+                )
+            if conc_out and not report_only:
+                steps.add(
+                    f"{pol} Concentration",
+                    pollutant_concentration(pol),
+                    depends=[f"{pol} Accumulated", "Runoff Accumulated"],
+                )
+        pipelines = run_step_graph(
+            steps,
+            context,
+            feedback,
+            step_mb=max(memory_budget(), transport.accumulation_memory_mb()),
+        )
+        if pipelines is None:
+            return {}
 
+        # outputs are collected and loaded from the algorithm thread
+        if not report_only:
+            outputs["Runoff Accumulated"] = pipelines["Runoff Accumulated"]
+            if "runoff" in [out.lower() for out in desired_outputs]:
+                results["Runoff Accumulated"] = outputs["Runoff Accumulated"]["OUTPUT"]
+                if self.load_outputs:
+                    self.handle_post_processing(
+                        "runoff",
+                        outputs["Runoff Accumulated"]["OUTPUT"],
+                        "Runoff Accumulated (L" + time_unit + ")",
+                        context,
+                    )
+        for pol in desired_pollutants:
+            if not fused:
+                outputs[pol + " Local"] = pipelines[f"{pol} Local"]
+                results[pol + " Local"] = outputs[pol + " Local"]["OUTPUT"]
+                if self.load_outputs:
+                    self.handle_post_processing(
+                        pol.lower(),
+                        outputs[pol + " Local"]["OUTPUT"],
+                        f"{pol} Local (mg" + time_unit + ")",
+                        context,
+                    )
+            outputs[pol + " local_kg"] = pipelines[f"{pol} Accumulated"]["local_kg"]
+            if report_only:
+                continue
+            outputs[pol + " Accumulated"] = pipelines[f"{pol} Accumulated"][
+                "Accumulated"
+            ]
             results[pol + " Accumulated"] = outputs[pol + " Accumulated"]["OUTPUT"]
             if self.load_outputs:
                 self.handle_post_processing(
@@ -429,29 +642,9 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
                     f"{pol} Accumulated (kg" + time_unit + ")",
                     context,
                 )
-
-        # Concentration Calculations
-        if conc_out:
+        if conc_out and not report_only:
             for pol in desired_pollutants:
-                feedback.setCurrentStep(current_step)
-                current_step += 1
-                if feedback.isCanceled():
-                    return {}
-                # Concentration Pollutant (mg/L)
-                feedback.pushInfo(f"Generating {pol} concentration raster ...")
-                input_params = {
-                    "input_a": outputs[pol + " Accumulated"]["OUTPUT"],
-                    "band_a": "1",
-                    "input_b": outputs["Runoff Accumulated"]["OUTPUT"],
-                    "band_b": "1",
-                }
-                outputs[pol + " Concentration"] = perform_raster_math(
-                    "numpy.divide(A, B, out=numpy.zeros_like(A), where=(B!=0)) * 1e6",  # Convert kg back to mg
-                    input_params,
-                    context,
-                    feedback,
-                    os.path.join(run_out_dir, f"{pol} Concentration.tif"),
-                )
+                outputs[pol + " Concentration"] = pipelines[f"{pol} Concentration"]
                 results[pol + " Concentration"] = outputs[pol + " Concentration"][
                     "OUTPUT"
                 ]
@@ -463,11 +656,54 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
                         context,
                     )
 
+        # Outlet Load Report
+        if outlet_layer is not None:
+            feedback.setCurrentStep(current_step)
+            current_step += 1
+            if feedback.isCanceled():
+                return {}
+            feedback.pushInfo("Generating outlet load report ...")
+            self.profile.stage("Outlet Report")
+            weights = {"Runoff (L" + time_unit + ")": outputs["Runoff Local"]["OUTPUT"]}
+            for pol in desired_pollutants:
+                weights[f"{pol} (kg" + time_unit + ")"] = outputs[pol + " local_kg"][
+                    "OUTPUT"
+                ]
+            results["Outlet Report"] = write_outlet_report(
+                transport,
+                outlet_layer,
+                elev_raster,
+                weights,
+                os.path.join(run_out_dir, "Outlet Report.csv"),
+                context,
+                snap_distance,
+            )
+
+        # Class Accumulation Basis
+        if class_basis:
+            feedback.setCurrentStep(current_step)
+            current_step += 1
+            if feedback.isCanceled():
+                return {}
+            feedback.pushInfo("Generating class accumulation basis ...")
+            self.profile.stage("Class Basis")
+            run_dict["ClassBasis"] = os.path.join(run_out_dir, "Class Basis")
+            build_class_basis(
+                run_dict["ClassBasis"],
+                lc_raster.source(),
+                outputs["Runoff Local"]["OUTPUT"],
+                lc_class_counts,
+                lambda weight, output: transport.accumulate(weight, output)["OUTPUT"],
+                memory_mb=memory_budget(),
+                feedback=feedback,
+            )
+
         # Configuration file
         feedback.setCurrentStep(current_step)
         if feedback.isCanceled():
             return {}
         feedback.pushInfo("Creating run configuration file ...")
+        self.profile.stage("Configuration File")
         run_dict["Inputs"] = parameters
         run_dict["Inputs"]["ElevationRaster"] = elev_raster.source()
         run_dict["Inputs"]["LandCoverRaster"] = lc_raster.source()
@@ -478,6 +714,11 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
         run_dict["Outputs"] = results
         run_dict["RunTime"] = str(datetime.now())
         run_dict["QNSPECTVersion"] = self._version
+        self.add_run_profile(
+            run_dict,
+            run_out_dir,
+            self.parameterAsBool(parameters, "ProfileTrace", context),
+        )
         with open(os.path.join(run_out_dir, f"{self.run_name}.pol.json"), "w") as f:
             f.write(dumps(run_dict, indent=4))
 
@@ -487,6 +728,58 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
 
         return results
 
+    def compute_local_rasters_fused(
+        self,
+        lc_raster,
+        soil_raster,
+        precip_raster,
+        elev_raster,
+        lookup_layer,
+        pollutant_fields: dict,
+        runoff_out: bool,
+        run_out_dir: str,
+        dual_soil_type: int,
+        precip_units: int,
+        raining_days: int,
+        feedback,
+    ) -> dict:
+        """Generate CN, Runoff Local and Pollutant Local rasters in memory with NumPy, block by block.
+        Only the final rasters and the accumulation weights are written to disk."""
+        paths = {}
+        if runoff_out:
+            paths["Runoff Local"] = os.path.join(run_out_dir, "Runoff Local.tif")
+        else:
+            paths["Runoff Local"] = QgsProcessingUtils.generateTempFilename(
+                "Runoff Local.tif"
+            )
+        for pol in pollutant_fields:
+            paths[f"{pol} Local"] = os.path.join(run_out_dir, f"{pol} Local.tif")
+            paths[f"{pol} Local kg"] = QgsProcessingUtils.generateTempFilename(
+                f"{pol} Local kg.tif"
+            )
+
+        compute_local_rasters(
+            lc_raster.source(),
+            soil_raster.source(),
+            precip_raster.source(),
+            lookup_table_arrays(lookup_layer),
+            pollutant_fields,
+            paths,
+            dual_soil_type=dual_soil_type,
+            precip_units=precip_units,
+            raining_days=raining_days,
+            cell_area_sq_feet=cell_area_in_sq_feet(elev_raster),
+            memory_mb=memory_budget(),
+            feedback=feedback,
+        )
+
+        # same keys as the outputs of the child algorithm steps
+        outputs = {"Runoff Local": {"OUTPUT": paths["Runoff Local"]}}
+        for pol in pollutant_fields:
+            outputs[pol + " Local"] = {"OUTPUT": paths[f"{pol} Local"]}
+            outputs[pol + " local_kg"] = {"OUTPUT": paths[f"{pol} Local kg"]}
+        return outputs
+
     def name(self):
         return "run_pollution_analysis"
 
@@ -501,6 +794,7 @@ class RunPollutionAnalysis(QNSPECTRunAlgorithm):
 The user must provide Elevation, Land Cover, Soil, and Precipitation rasters for the area of interest. The user is also optionally required to provide a lookup table that relates different land cover classes in the provided Land Cover raster with Curve Number and pollutant loading.
 This analysis should be performed on a watershed level to account for all upstream flow at a cell. For accurate results, the area of interest should fully envelop the watershed in consideration.
 GRASS `r.watershed`function is used by the algorithm under the hood to calculate runoff and accumulation.</p>
+<p>Pollutants are processed independently once local runoff exists. Their local, accumulated, and concentration rasters are computed at the same time, up to `Maximum parallel run steps` in the QNSPECT section of the Processing options (default: the number of CPU cores, 1 runs the steps one after the other), limited to the number of accumulations that fit in the available memory. GRASS steps run one at a time.</p>
 <h2>Input Parameters</h2>
 <h3>Run Name</h3>
 <p>Name of the run. The algorithm will create a folder with this name and save all outputs and a configuration file in that folder.</p>
@@ -534,9 +828,23 @@ To exclude an output from the analysis, write N in the Output column. You must c
 <p>The concentration raster will only be outputted if the Output Concentration Raster option is checked in Advanced Parameters. Default is unchecked.</p>
 <h3>Use Multi Flow Direction [MFD] Routing</h3>
 <p>By default, the Single Flow Direction [SFD] option is used for flow routing. Multi Flow Direction [MFD] routing will be utilized for the whole analysis if this option is checked. The algorithm passes these flags to GRASS `r.watershed` function, which is the computational engine for runoff direction and accumulation calculations.</p>
+<h3>Flow Routing Engine</h3>
+<p>Engine used for flow direction and accumulation. GRASS r.watershed [Default] runs GRASS `r.watershed` in a GRASS session. Native computes the flow directions from the Elevation Raster directly in QGIS, routing flow through depressions to their spill point, and avoids the GRASS start-up cost, which is faster for small watersheds. Both engines support SFD and MFD routing; the results are close to, but not identical with, each other.</p>
 <h3>Treat Dual Category Soils as</h3>
 <p>Certain areas can have dual soil types (A/D, B/D, or C/D). These areas possess characteristics of Hydrologic Soil Group D during undrained conditions and characterstics of Hydrologic Soil Group A/B/C for drained conditions.</p>
 <p>In this parameter, user can specify if these areas should be treated as drained, undrained, or average of both conditions. If the average option is selected, the algorithm will use the average of drained and undrained Curve Number for runoff estimations.</p>
+<h3>Compute Local Rasters in Memory [Fused]</h3>
+<p>If checked, Land Cover, Soil, and Precipitation rasters are read once and the Curve Number, runoff, and local pollutant rasters are calculated in memory with NumPy instead of a chain of GDAL Raster Calculator steps. Only the final rasters are written to disk. The rasters are processed block by block within the memory budget set in the QNSPECT Processing settings. Default is unchecked.</p>
+<h3>Store Class Accumulation Basis</h3>
+<p>If checked, the accumulated runoff of each land cover class is saved in a `Class Basis` folder of the run. Accumulated pollutant loads are a weighted sum of these rasters, so the `Evaluate Pollutant Coefficients` tool can compute the rasters of new lookup coefficients or new pollutant columns in seconds, without flow routing. Building the basis accumulates runoff once per land cover class. Default is unchecked.</p>
+<h3>Outlet Points for Load Report</h3>
+<p>Optional point layer of outlets, e.g. pour points, outfalls, or monitoring stations. If provided, the total runoff volume (L) and pollutant loads (kg) draining to each point are written to `Outlet Report.csv` in the run folder. With SFD or Native routing, the loads are summed from the local rasters over the upstream cells of each outlet, which is much faster than accumulating full rasters when only a few locations are of interest.</p>
+<h3>Outlet Snap Distance (cells)</h3>
+<p>Each outlet is moved to the cell with the largest drainage area within this many cells, so that points digitized next to a stream fall on the stream. Not available with GRASS MFD routing. Default is 0 (no snapping).</p>
+<h3>Skip Accumulated Rasters [Outlet Report Only]</h3>
+<p>If checked and Outlet Points are provided, the accumulated and concentration rasters are not created and only the outlet report is written. Default is unchecked.</p>
+<h3>Write Run Profile as Chrome Trace</h3>
+<p>The run configuration file holds the wall time, CPU time, bytes read and written, temporary disk used, and peak memory of each stage, step, and child algorithm of the run under `Profile`. If checked, the profile is also written to `[Run Name].trace.json` in the run folder. The trace can be opened in chrome://tracing or https://ui.perfetto.dev to show the steps of the run, including the steps that ran in parallel, on a timeline. Default is unchecked.</p>
 <h2>Outputs</h2>
 <h3>Folder for Run Outputs</h3>
 <p>The algorithm outputs and configuration file will be saved in this directory in a separate folder.</p>
@@ -35,9 +35,20 @@ import inspect
 
 from qgis.PyQt.QtGui import QIcon
 from qgis.core import QgsProcessingProvider
+from processing.core.ProcessingConfig import ProcessingConfig, Setting
 
 from QNSPECT.processing import algorithms
 from QNSPECT.processing.qnspect_algorithm import QNSPECTAlgorithm
+from QNSPECT.processing.algorithms.qnspect_utils import (
+    MEMORY_BUDGET_SETTING,
+    DEFAULT_MEMORY_MB,
+    CACHE_DIR_SETTING,
+    DEFAULT_CACHE_DIR,
+    CACHE_SIZE_SETTING,
+    DEFAULT_CACHE_MB,
+    MAX_WORKERS_SETTING,
+    DEFAULT_MAX_WORKERS,
+)
 
 
 class QNSPECTProvider(QgsProcessingProvider):
@@ -47,12 +58,60 @@ class QNSPECTProvider(QgsProcessingProvider):
         """
         QgsProcessingProvider.__init__(self)
 
+    def load(self):
+        """
+        Registers the QNSPECT settings in the Processing options and loads the algorithms.
+        """
+        ProcessingConfig.settingIcons[self.name()] = self.icon()
+        ProcessingConfig.addSetting(
+            Setting(
+                self.name(),
+                MEMORY_BUDGET_SETTING,
+                self.tr("Memory budget for raster block processing (MB)"),
+                DEFAULT_MEMORY_MB,
+                valuetype=Setting.INT,
+            )
+        )
+        ProcessingConfig.addSetting(
+            Setting(
+                self.name(),
+                CACHE_DIR_SETTING,
+                self.tr("Folder for cached run intermediates"),
+                DEFAULT_CACHE_DIR,
+                valuetype=Setting.FOLDER,
+            )
+        )
+        ProcessingConfig.addSetting(
+            Setting(
+                self.name(),
+                CACHE_SIZE_SETTING,
+                self.tr("Maximum size of cached run intermediates (MB, 0 disables)"),
+                DEFAULT_CACHE_MB,
+                valuetype=Setting.INT,
+            )
+        )
+        ProcessingConfig.addSetting(
+            Setting(
+                self.name(),
+                MAX_WORKERS_SETTING,
+                self.tr("Maximum parallel run steps"),
+                DEFAULT_MAX_WORKERS,
+                valuetype=Setting.INT,
+            )
+        )
+        ProcessingConfig.readSettings()
+        self.refreshAlgorithms()
+        return True
+
     def unload(self):
         """
         Unloads the provider. Any tear-down steps required by the provider
         should be implemented here.
         """
-        pass
+        ProcessingConfig.removeSetting(MEMORY_BUDGET_SETTING)
+        ProcessingConfig.removeSetting(CACHE_DIR_SETTING)
+        ProcessingConfig.removeSetting(CACHE_SIZE_SETTING)
+        ProcessingConfig.removeSetting(MAX_WORKERS_SETTING)
 
     def loadAlgorithms(self):
         """
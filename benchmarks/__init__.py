@@ -0,0 +1,3 @@
+"""
+QNSPECT benchmarks. Run from the repository root, e.g. `python -m benchmarks.bench_curve_number`
+"""
@@ -0,0 +1,295 @@
+"""
+Time the QNSPECT algorithms on synthetic watersheds of several sizes and write the results as JSON.
+
+For each size a watershed is generated (see benchmarks.synthetic) and the algorithms run in the
+order of a scenario study: Align Rasters, pollution and erosion runs of two land covers, and the
+comparison of each pair. Every algorithm runs in a new headless QGIS process, so that its peak
+memory is its own. Each record holds the wall and CPU time, throughput (cells/s), peak RSS, bytes
+written, and the time of each stage as announced by the algorithm messages.
+
+    python -m benchmarks.bench_analyses --sizes 1000 5000 20000 --output bench.json
+
+Compare the JSON of two QNSPECT releases to find the stages that got faster or slower.
+The QGIS Python libraries must be on the PYTHONPATH, as for the command line interface.
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks.synthetic import generate_watershed
+from QNSPECT.batch import needs_grass, python_executable
+from QNSPECT.cli import COMMANDS, parse_override
+
+CASES = [
+    "align",
+    "pollution",
+    "pollution-b",
+    "compare-pollution",
+    "erosion",
+    "erosion-b",
+    "compare-erosion",
+]
+POLLUTANTS = ["Runoff", "Lead", "Nitrogen", "Phosphorus", "Zinc", "TSS"]
+METADATA = Path(__file__).parents[1] / "QNSPECT" / "metadata.txt"
+
+
+def qnspect_version() -> str:
+    with METADATA.open() as f:
+        for line in f:
+            if line.startswith("version="):
+                return line.strip().split("=", 1)[1]
+    return ""
+
+
+def case_parameters(case: str, data: dict, folder: Path, options: dict) -> tuple:
+    """Algorithm and parameters of a benchmark case.
+    data are the synthetic rasters, options the parameters added to the analyses."""
+    aligned = folder / "aligned"
+    runs = folder / "runs"
+
+    def raster(name: str) -> str:
+        return str(aligned / f"{name}.tif")
+
+    if case == "align":
+        return COMMANDS["align"], {
+            "ReferenceRaster": data["dem"],
+            "RastersToAlign": [
+                data[name]
+                for name in [
+                    "land_cover",
+                    "land_cover_b",
+                    "hsg",
+                    "k_factor",
+                    "r_factor",
+                    "precipitation",
+                ]
+            ],
+            "ResamplingMethod": 0,
+            "LoadOutputs": False,
+            "OutputDirectory": str(aligned),
+        }
+
+    scenario = "land_cover_b" if case.endswith("-b") else "land_cover"
+    run_name = case if case.endswith("-b") else f"{case}-a"
+    if case.startswith("pollution"):
+        return COMMANDS["pollution"], {
+            "RunName": run_name,
+            "LandCoverRaster": raster(scenario),
+            "LandCoverType": 2,  # NLCD
+            "ElevationRaster": raster("dem"),
+            "PrecipRaster": raster("precipitation"),
+            "PrecipUnits": 1,  # Millimeters
+            "RainingDays": 100,
+            "HSGRaster": raster("hsg"),
+            "PollutantOutputs": [v for pol in POLLUTANTS for v in (pol, "Y")],
+            "LoadOutputs": False,
+            "ProjectLocation": str(runs),
+            **options,
+        }
+    if case.startswith("erosion"):
+        return COMMANDS["erosion"], {
+            "RunName": run_name,
+            "LandCoverRaster": raster(scenario),
+            "LandCoverType": 2,  # NLCD
+            "ElevationRaster": raster("dem"),
+            "RFactorRaster": raster("r_factor"),
+            "HSGRaster": raster("hsg"),
+            "KFactorRaster": raster("k_factor"),
+            "LoadOutputs": False,
+            "ProjectLocation": str(runs),
+            **options,
+        }
+
+    analysis = case[len("compare-") :]
+    parameters = {
+        "ScenarioA": str(runs / f"{analysis}-a"),
+        "ScenarioB": str(runs / f"{analysis}-b"),
+        "Local": True,
+        "Accumulated": True,
+        "LoadOutputs": False,
+        "Output": str(folder / case),
+    }
+    if analysis == "pollution":
+        parameters["Concentration"] = True
+        parameters["Grid"] = [
+            v for pol in ["Everything"] + POLLUTANTS for v in (pol, "Y")
+        ]
+    return COMMANDS[case], parameters
+
+
+def folder_bytes(folder: str) -> int:
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def io_write_bytes():
+    """Bytes this process caused to be written to storage, None where the OS does not report it"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_bytes():
+    """Peak resident memory of this process and of its waited-for children (e.g. GRASS)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return scale * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def run_case(algorithm: str, parameters: dict, output_folder: str) -> dict:
+    """Run one algorithm in this (worker) process and measure it"""
+    from QNSPECT.headless import LogFeedback, run_algorithm, start_qgis
+
+    class StageFeedback(LogFeedback):
+        """Marks the start of a stage at each `... ...` message of the algorithm"""
+
+        def __init__(self, stream):
+            super().__init__(stream)
+            self.marks = []
+
+        def pushInfo(self, info):
+            if info.endswith("..."):
+                self.marks.append((time.perf_counter(), info.rstrip(". ")))
+            super().pushInfo(info)
+
+    start_qgis(grass=needs_grass(algorithm, parameters))
+    record = {"baseline_rss_bytes": peak_rss_bytes()}
+    written = io_write_bytes()
+    with open(os.devnull, "w") as log:
+        feedback = StageFeedback(log)
+        start, cpu = time.perf_counter(), os.times()
+        try:
+            run_algorithm(algorithm, parameters, feedback)
+            record["status"] = "succeeded"
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = str(e)
+        end, cpu_end = time.perf_counter(), os.times()
+
+    record["seconds"] = end - start
+    # children are GRASS and GDAL command line tools
+    record["cpu_seconds"] = sum(cpu_end[:4]) - sum(cpu[:4])
+    record["peak_rss_bytes"] = peak_rss_bytes()
+    if written is not None:
+        record["io_write_bytes"] = io_write_bytes() - written
+    record["output_bytes"] = folder_bytes(output_folder)
+    # the time before the first message (input checks, loading) is the Setup stage
+    marks = [(start, "Setup")] + feedback.marks + [(end, None)]
+    record["stages"] = [
+        {"name": name, "seconds": next_time - time_}
+        for (time_, name), (next_time, _) in zip(marks, marks[1:])
+    ]
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 5000], help="raster rows/columns"
+    )
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument(
+        "--engine",
+        choices=["grass", "native"],
+        default="grass",
+        help="flow routing engine of the analyses",
+    )
+    parser.add_argument(
+        "--set",
+        metavar="KEY=VALUE",
+        type=parse_override,
+        action="append",
+        default=[],
+        help="add a parameter to the analyses (e.g. FusedEngine=true), can be repeated",
+    )
+    parser.add_argument(
+        "--data", default="qnspect_bench", help="folder for the rasters and outputs"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench.json", help="JSON results file")
+    args = parser.parse_args()
+
+    options = {"FlowRoutingEngine": 1 if args.engine == "native" else 0}
+    options.update(dict(args.set))
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python_executable())
+
+    report = {
+        "qnspect_version": qnspect_version(),
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "options": options,
+        "results": [],
+    }
+    for size in args.sizes:
+        folder = Path(args.data) / str(size)
+        print(f"Generating {size} x {size} watershed ...", file=sys.stderr)
+        data = generate_watershed(folder / "inputs", size, args.seed)
+
+        for case in args.cases:
+            algorithm, parameters = case_parameters(case, data, folder, options)
+            output = parameters.get("OutputDirectory") or parameters.get("Output")
+            if case.startswith(("pollution", "erosion")):
+                output = str(
+                    Path(parameters["ProjectLocation"]) / parameters["RunName"]
+                )
+
+            # outputs of a previous benchmark would count as written bytes
+            shutil.rmtree(output, ignore_errors=True)
+            print(f"{size}: {case} ...", file=sys.stderr)
+            # a new process per case, so that the peak memory is the peak of the case
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                record = pool.submit(run_case, algorithm, parameters, output).result()
+            cells = size * size
+            record = {
+                "size": size,
+                "cells": cells,
+                "case": case,
+                "algorithm": algorithm,
+                "cells_per_second": cells / record["seconds"],
+                **record,
+            }
+            report["results"].append(record)
+            print(
+                f"{size}: {case} {record['status']} in {record['seconds']:.1f} s",
+                file=sys.stderr,
+            )
+
+            # written after each case, so that an interrupted run keeps its results
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
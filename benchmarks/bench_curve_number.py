@@ -0,0 +1,130 @@
+"""
+Compare Curve Number generation through the lookup array gather against the
+previous `logical_and(A==lu,B==i)*cn` GDAL Raster Calculator expression.
+
+The expression is evaluated with NumPy the same way gdal_calc evaluates it, after the
+previous Reclassify by Table step with its original range tables, so the timings only
+compare the computation and not the raster I/O. The soil raster has NoData, dual category
+and out of range soil groups, so the check covers all the cases the lookup rewrite handles.
+"""
+
+import argparse
+import csv
+import time
+from pathlib import Path
+
+import numpy as np
+
+from QNSPECT.engine.curve_number import curve_number
+from QNSPECT.engine.lookup import LookupTable
+
+COEFFICIENTS_DIR = Path(__file__).parents[1] / "QNSPECT" / "resources" / "coefficients"
+
+# [min, max, value] rows of the previous CurveNumber.dual_soil_reclass
+LEGACY_DUAL_SOIL_RECLASS = {
+    0: [5, 9, 4],
+    1: [5, 5, 1, 6, 6, 2, 7, 7, 3, 8, 9, 4],
+}
+# NoData of the soil raster and of the Reclassify by Table output
+HSG_NODATA = 255
+# valid soil groups, dual category soil groups and values outside of 1-9
+HSG_VALUES = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 10, 12, 200, HSG_NODATA])
+
+
+def legacy_cn_expression(records: list) -> str:
+    """CN expression as built by the previous CurveNumber.generate_cn_exprs"""
+    cn_calc_expr = []
+    for feat in records:
+        lu = feat["lc_value"]
+        for i, hsg in enumerate(["a", "b", "c", "d"]):
+            cn = feat[f"cn_{hsg}"]
+            cn_calc_expr.append(f"logical_and(A=={lu},B=={i+1})*{cn}")
+    return " + ".join(cn_calc_expr)
+
+
+def reclass_soil(hsg, table: list):
+    """Soil reclassification as done by the previous native:reclassifybytable step:
+    min <= value <= max, first matching row, unmatched values kept, NoData to 255"""
+    out = hsg.copy()
+    matched = np.zeros(hsg.shape, dtype=bool)
+    for low, high, new in np.reshape(table, (-1, 3)):
+        rows = ~matched & (hsg >= low) & (hsg <= high)
+        out[rows] = new
+        matched |= rows
+    out[hsg == HSG_NODATA] = HSG_NODATA
+    return out
+
+
+def legacy_curve_number(expr: str, lc, hsg, dual_soil_type: int):
+    """CN and valid mask of the previous steps. gdal_calc writes NoData where an input is NoData."""
+    namespace = {"logical_and": np.logical_and, "A": lc}
+    if dual_soil_type in [0, 1]:
+        namespace["B"] = reclass_soil(hsg, LEGACY_DUAL_SOIL_RECLASS[dual_soil_type])
+        return eval(expr, namespace), namespace["B"] != HSG_NODATA
+    namespace["B"] = reclass_soil(hsg, LEGACY_DUAL_SOIL_RECLASS[0])
+    cn_undrain = eval(expr, namespace)
+    namespace["B"] = reclass_soil(hsg, LEGACY_DUAL_SOIL_RECLASS[1])
+    cn_drain = eval(expr, namespace)
+    # Cell Statistics mean, both rasters have the NoData of the soil raster
+    return (cn_undrain + cn_drain) / 2, namespace["B"] != HSG_NODATA
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=2000, help="raster rows/columns")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    hsg = rng.choice(HSG_VALUES, (args.size, args.size)).astype(np.uint8)
+    # as write_curve_number_raster, NoData soil cells are NoData in the CN raster
+    hsg_valid = hsg != HSG_NODATA
+
+    print(f"Raster size: {args.size} x {args.size}")
+    print(
+        f"{'Table':8}{'Dual Soils':>12}{'Expression [s]':>16}{'Lookup [s]':>12}{'Speedup':>10}"
+    )
+    for table in ["NLCD", "C-CAP"]:
+        with (COEFFICIENTS_DIR / f"{table}.csv").open(newline="") as f:
+            records = list(csv.DictReader(f))
+        lookup = LookupTable(records)
+        expr = legacy_cn_expression(records)
+        lc = rng.choice(lookup.lc_values.astype(np.uint8), hsg.shape)
+
+        for dual_soil_type in [0, 1, 2]:
+            expected, expected_valid = legacy_curve_number(
+                expr, lc, hsg, dual_soil_type
+            )
+            actual = curve_number(lookup, lookup.class_index(lc), hsg, dual_soil_type)
+            if not np.array_equal(expected_valid, hsg_valid) or not np.array_equal(
+                expected[hsg_valid], actual[hsg_valid]
+            ):
+                raise AssertionError(
+                    f"{table} CN differs from the expression output for dual soil type {dual_soil_type}"
+                )
+
+            t_expr = best_time(
+                lambda: legacy_curve_number(expr, lc, hsg, dual_soil_type), args.repeat
+            )
+            t_lookup = best_time(
+                lambda: curve_number(
+                    lookup, lookup.class_index(lc), hsg, dual_soil_type
+                ),
+                args.repeat,
+            )
+            print(
+                f"{table:8}{dual_soil_type:>12}{t_expr:>16.3f}{t_lookup:>12.3f}{t_expr / t_lookup:>9.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
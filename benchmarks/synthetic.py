@@ -0,0 +1,228 @@
+"""
+Synthetic watersheds for the benchmarks.
+
+The DEM is a tilted surface cut by a dendritic-looking pattern of valleys, so that flow
+converges into channels as in a real watershed. Land cover follows elevation and distance
+to the valleys (water and wetlands in the valleys, developed land and crops on the lower
+slopes, forest higher up). HSG and K-Factor are smooth fields, and the R-Factor and
+precipitation are coarse grids that need alignment, as the NOAA downloads do.
+Rasters are written strip by strip, so any size can be generated in bounded memory.
+
+    python -m benchmarks.synthetic bench_data --size 5000
+"""
+
+import argparse
+import os
+from pathlib import Path
+from typing import Callable, Dict
+
+import numpy as np
+from osgeo import gdal, osr
+
+# NAD83 / Conus Albers, meters
+EPSG = 5070
+CELL_SIZE = 30.0
+ORIGIN = (1_500_000.0, 2_000_000.0)
+STRIP_ROWS = 256
+# the R-Factor and precipitation grids are this many times coarser than the DEM
+COARSE_FACTOR = 4
+NO_DATA = -999999
+
+# NLCD classes from the valley floor (0) to the ridges (1)
+LAND_COVER_BANDS = [
+    (0.08, 11),  # Water
+    (0.12, 90),  # Woody Wetland
+    (0.16, 95),  # Emergent Wetland
+    (0.24, 23),  # Medium Intensity Developed
+    (0.30, 22),  # Low Intensity Developed
+    (0.36, 21),  # Developed Open Space
+    (0.46, 82),  # Cultivated Land
+    (0.56, 81),  # Pasture/Hay
+    (0.63, 71),  # Grassland
+    (0.70, 52),  # Scrub/Shrub
+    (0.80, 41),  # Deciduous Forest
+    (0.90, 43),  # Mixed Forest
+    (1.01, 42),  # Evergreen Forest
+]
+URBAN_CLASSES = (21, 22, 23, 24)
+# developed class of the scenario B land cover
+SCENARIO_CLASS = 24
+
+
+class Fields:
+    """Smooth random fields of the normalized coordinates (u, v) in [0, 1], fixed by the seed"""
+
+    def __init__(self, seed: int):
+        rng = np.random.default_rng(seed)
+        self.waves = {
+            name: (rng.uniform(1, 6, (6, 2)), rng.uniform(0, 2 * np.pi, 6))
+            for name in ["terrain", "valley", "land", "soil", "k"]
+        }
+
+    def wave(self, name: str, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """Sum of plane waves in [-1, 1]"""
+        frequencies, phases = self.waves[name]
+        total = np.zeros(u.shape)
+        for (fu, fv), phase in zip(frequencies, phases):
+            total += np.sin(2 * np.pi * (fu * u + fv * v) + phase)
+        return total / len(phases)
+
+    def valley(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """0 on the valley floors, 1 on the ridges. Valleys meander down the slope (north to south)."""
+        meander = 0.08 * self.wave("valley", u, v)
+        trunk = np.abs(np.sin(np.pi * 3 * (u + meander)))
+        tributary = np.abs(np.sin(np.pi * 11 * (u + 0.4 * v + meander)))
+        return np.minimum(trunk, 0.35 + 0.65 * tributary)
+
+    def elevation(self, u, v, noise) -> np.ndarray:
+        """Meters, from about 400 m in the north to 50 m at the southern outlet"""
+        return (
+            50.0
+            + 350.0 * (1 - v)
+            + 60.0 * self.valley(u, v)
+            + 15.0 * self.wave("terrain", u, v)
+            + noise
+        )
+
+
+def _create(
+    path: Path, xsize: int, ysize: int, cell_size: float, dtype
+) -> gdal.Dataset:
+    ds = gdal.GetDriverByName("GTiff").Create(
+        str(path),
+        xsize,
+        ysize,
+        1,
+        dtype,
+        options=["TILED=YES", "BIGTIFF=IF_SAFER", "COMPRESS=LZW"],
+    )
+    ds.SetGeoTransform((ORIGIN[0], cell_size, 0, ORIGIN[1], 0, -cell_size))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).SetNoDataValue(NO_DATA if dtype == gdal.GDT_Float32 else 0)
+    return ds
+
+
+def _write_strips(
+    path: Path,
+    size: int,
+    cell_size: float,
+    dtype,
+    strip: Callable[[np.ndarray, np.ndarray, int], np.ndarray],
+) -> str:
+    """Write strip(u, v, first row) for each strip of rows of a size x size raster.
+    u and v are the normalized column and row coordinates of the cells of the strip."""
+    ds = _create(path, size, size, cell_size, dtype)
+    band = ds.GetRasterBand(1)
+    u = (np.arange(size) + 0.5) / size
+    for row in range(0, size, STRIP_ROWS):
+        rows = min(STRIP_ROWS, size - row)
+        v = ((np.arange(rows) + row + 0.5) / size)[:, None]
+        band.WriteArray(strip(*np.broadcast_arrays(u[None, :], v), row), 0, row)
+    ds.FlushCache()
+    return str(path)
+
+
+def generate_watershed(directory: str, size: int, seed: int = 42) -> Dict[str, str]:
+    """Write the synthetic rasters of a size x size watershed to directory and return their paths.
+    Keys are dem, land_cover, land_cover_b (scenario with a developed block), hsg, k_factor,
+    r_factor and precipitation (millimeters)."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    fields = Fields(seed)
+
+    def noise(row: int, shape) -> np.ndarray:
+        # seeded per strip, so the rasters do not depend on the order they are written in
+        return np.random.default_rng((seed, row)).normal(0, 0.3, shape)
+
+    def dem(u, v, row):
+        z = fields.elevation(u, v, noise(row, u.shape))
+        return z.astype(np.float32)
+
+    def land_position(u, v):
+        position = fields.valley(u, v) * 0.8 + 0.2 * (fields.wave("land", u, v) + 1) / 2
+        return np.clip(position, 0, 1)
+
+    def land_cover(u, v, row):
+        limits = np.array([limit for limit, _ in LAND_COVER_BANDS])
+        classes = np.array([lc for _, lc in LAND_COVER_BANDS], dtype=np.uint8)
+        return classes[np.searchsorted(limits, land_position(u, v), side="right")]
+
+    def land_cover_b(u, v, row):
+        lc = land_cover(u, v, row)
+        # scenario B develops a block in the middle of the watershed
+        block = (np.abs(u - 0.5) < 0.15) & (np.abs(v - 0.5) < 0.15) & (lc != 11)
+        return np.where(block, SCENARIO_CLASS, lc).astype(np.uint8)
+
+    def hsg(u, v, row):
+        field = (fields.wave("soil", u, v) + 1) / 2  # 0 - 1
+        groups = np.array([1, 2, 3, 4, 5, 6, 7], dtype=np.uint8)
+        limits = np.array([0.2, 0.45, 0.7, 0.85, 0.9, 0.95])
+        return groups[np.searchsorted(limits, field)]
+
+    def k_factor(u, v, row):
+        k = 0.25 + 0.2 * fields.wave("k", u, v)
+        # urban cells have no K-Factor in the soil surveys
+        urban = np.isin(land_cover(u, v, row), URBAN_CLASSES)
+        return np.where(urban, 0, k).astype(np.float32)
+
+    coarse = max(size // COARSE_FACTOR, 1)
+    coarse_cell = CELL_SIZE * size / coarse
+
+    def r_factor(u, v, row):
+        return (100.0 + 150.0 * u).astype(np.float32)
+
+    def precipitation(u, v, row):
+        return (900.0 + 400.0 * v + 50.0 * np.sin(4 * u)).astype(np.float32)
+
+    paths = {
+        "dem": _write_strips(
+            directory / "dem.tif", size, CELL_SIZE, gdal.GDT_Float32, dem
+        ),
+        "land_cover": _write_strips(
+            directory / "land_cover.tif", size, CELL_SIZE, gdal.GDT_Byte, land_cover
+        ),
+        "land_cover_b": _write_strips(
+            directory / "land_cover_b.tif",
+            size,
+            CELL_SIZE,
+            gdal.GDT_Byte,
+            land_cover_b,
+        ),
+        "hsg": _write_strips(
+            directory / "hsg.tif", size, CELL_SIZE, gdal.GDT_Byte, hsg
+        ),
+        "k_factor": _write_strips(
+            directory / "k_factor.tif", size, CELL_SIZE, gdal.GDT_Float32, k_factor
+        ),
+        "r_factor": _write_strips(
+            directory / "r_factor.tif",
+            coarse,
+            coarse_cell,
+            gdal.GDT_Float32,
+            r_factor,
+        ),
+        "precipitation": _write_strips(
+            directory / "precipitation.tif",
+            coarse,
+            coarse_cell,
+            gdal.GDT_Float32,
+            precipitation,
+        ),
+    }
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", help="output folder")
+    parser.add_argument("--size", type=int, default=1000, help="raster rows/columns")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    for name, path in generate_watershed(args.directory, args.size, args.seed).items():
+        print(f"{name}: {os.path.abspath(path)}")
+
+
+if __name__ == "__main__":
+    main()
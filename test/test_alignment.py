@@ -0,0 +1,82 @@
+# coding=utf-8
+"""Tests of the alignment shortcuts."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import osr
+
+from QNSPECT.engine.alignment import is_aligned, same_crs, target_grid
+from QNSPECT.engine.raster_io import RasterGrid, write_array
+
+
+def projection(epsg, pretty=False):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToPrettyWkt() if pretty else srs.ExportToWkt()
+
+
+class TestAlignment(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.grid = RasterGrid(
+            300, 200, (1000.0, 30.0, 0.0, 9000.0, 0.0, -30.0), projection(5070)
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def raster(self, grid, name="raster.tif"):
+        return write_array(
+            os.path.join(self.folder, name), np.zeros((grid.ysize, grid.xsize)), grid
+        )
+
+    def test_target_grid(self):
+        reference = self.raster(self.grid)
+        grid = target_grid(reference, 10.0, 10.0)
+        self.assertEqual((grid.xsize, grid.ysize), (900, 600))
+        self.assertEqual(grid.geotransform, (1000.0, 10.0, 0.0, 9000.0, 0.0, -10.0))
+        self.assertEqual(grid.projection, self.grid.projection)
+
+        # partial cells are rounded to the nearest number of cells, as gdalwarp -tr
+        grid = target_grid(reference, 45.0, 45.0)
+        self.assertEqual((grid.xsize, grid.ysize), (200, 133))
+
+    def test_is_aligned_within_tolerance(self):
+        self.assertTrue(is_aligned(self.raster(self.grid), self.grid))
+
+        x, cell, _, y, _, _ = self.grid.geotransform
+        for shift, aligned in ((1e-7 * cell, True), (1e-3 * cell, False)):
+            grid = self.grid._replace(
+                geotransform=(x + shift, cell, 0.0, y - shift, 0.0, -cell)
+            )
+            self.assertEqual(is_aligned(self.raster(grid), self.grid), aligned)
+
+        for grid in (
+            self.grid._replace(xsize=301),
+            self.grid._replace(geotransform=(x, 10.0, 0.0, y, 0.0, -10.0)),
+        ):
+            self.assertFalse(is_aligned(self.raster(grid), self.grid))
+        self.assertFalse(
+            is_aligned(os.path.join(self.folder, "missing.tif"), self.grid)
+        )
+
+    def test_equivalent_crs(self):
+        wkt = projection(5070)
+        self.assertTrue(same_crs(wkt, wkt))
+        self.assertTrue(same_crs(wkt, projection(5070, pretty=True)))
+        self.assertFalse(same_crs(wkt, projection(4326)))
+        self.assertFalse(same_crs(wkt, ""))
+
+        # a differently written but equivalent CRS is aligned
+        other = self.raster(self.grid._replace(projection=projection(5070, True)))
+        self.assertTrue(is_aligned(other, self.grid))
+        other = self.raster(self.grid._replace(projection=projection(4326)))
+        self.assertFalse(is_aligned(other, self.grid))
+
+
+if __name__ == "__main__":
+    unittest.main()
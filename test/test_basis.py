@@ -0,0 +1,78 @@
+# coding=utf-8
+"""Tests of the class accumulation basis."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.basis import (
+    BASIS_FILE,
+    build_class_basis,
+    evaluate_class_basis,
+)
+from QNSPECT.engine.blocks import Canceled
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.raster_io import RasterGrid, read_array, write_array
+from QNSPECT.engine.routing import FlowRouting, accumulate_raster
+from .utilities import CancelAfter
+
+GRID = RasterGrid(6, 4, (0.0, 30.0, 0.0, 120.0, 0.0, -30.0), "")
+
+
+class TestClassBasis(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.lc = rng.choice([11.0, 21.0, 41.0], size=(GRID.ysize, GRID.xsize))
+        self.runoff = rng.uniform(0, 10, self.lc.shape)
+        self.lc_raster = write_array(os.path.join(self.folder, "lc.tif"), self.lc, GRID)
+        self.runoff_raster = write_array(
+            os.path.join(self.folder, "runoff.tif"), self.runoff, GRID
+        )
+        # every cell drains east, then south along the last column
+        cells = np.arange(self.lc.size).reshape(self.lc.shape)
+        sources = np.concatenate([cells[:, :-1].ravel(), cells[:-1, -1]])
+        targets = np.concatenate([cells[:, 1:].ravel(), cells[1:, -1]])
+        self.routing = FlowRouting(self.lc.shape, sources, targets)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def build(self, feedback=None):
+        return build_class_basis(
+            os.path.join(self.folder, "basis"),
+            self.lc_raster,
+            self.runoff_raster,
+            [11.0, 21.0, 41.0],
+            lambda weight, output: accumulate_raster(self.routing, weight, output),
+            feedback=feedback,
+        )
+
+    def test_evaluate_matches_accumulation(self):
+        self.build()
+        lookup = LookupTable(
+            [
+                {"lc_value": 11, "N": 0.5},
+                {"lc_value": 21, "N": 2.0},
+                {"lc_value": 41, "N": 1.5},
+            ]
+        )
+        output = os.path.join(self.folder, "N.tif")
+        evaluate_class_basis(
+            os.path.join(self.folder, "basis"), lookup, "n", {"Accumulated": output}
+        )
+        coefficient = lookup.field_values("n", lookup.class_index(self.lc))
+        expected = self.routing.accumulate(self.runoff * coefficient) * 1e-6
+        np.testing.assert_allclose(read_array(output)[0], expected, rtol=1e-5)
+
+    def test_canceled_basis_is_not_written(self):
+        with self.assertRaises(Canceled):
+            self.build(CancelAfter(2))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "basis", BASIS_FILE)))
+
+
+if __name__ == "__main__":
+    unittest.main()
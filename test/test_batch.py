@@ -0,0 +1,167 @@
+# coding=utf-8
+"""Tests of the batch scenario runner."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from QNSPECT.batch import BatchRun, load_manifest, routing_groups, run_batch
+from .utilities import CancelAfter
+
+POLLUTION = "qnspect:run_pollution_analysis"
+
+
+def fake_pool(crashes=None, hang=False):
+    """Process pool class completing the runs at once, a run in crashes breaks that many pools.
+    With hang no run ever completes. Returns the class and the list of created pools."""
+    crashes = dict(crashes or {})
+    pools = []
+
+    class Pool:
+        def __init__(self, **kwargs):
+            self.terminated = False
+            self.waited = None
+            pools.append(self)
+
+        def submit(self, func, run, log_dir):
+            future = Future()
+            if hang:
+                return future
+            if crashes.get(run.name, 0) > 0:
+                crashes[run.name] -= 1
+                future.set_exception(BrokenProcessPool("crash"))
+            else:
+                future.set_result(
+                    {
+                        "RunName": run.name,
+                        "Algorithm": run.algorithm,
+                        "Status": "succeeded",
+                    }
+                )
+            return future
+
+        def terminate_workers(self):
+            self.terminated = True
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.waited = wait
+
+    return Pool, pools
+
+
+class Feedback(CancelAfter):
+    def pushInfo(self, info):
+        pass
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, "w") as f:
+            json.dump(data, f)
+        return path
+
+    def run_batch(self, runs, pool, feedback=None):
+        with mock.patch("QNSPECT.batch.ProcessPoolExecutor", pool):
+            return run_batch(runs, os.path.join(self.folder, "logs"), 2, feedback)
+
+    def test_manifest_parameters(self):
+        run_file = self.write(
+            "baseline.ero.json",
+            {"Inputs": {"ElevationRaster": "dem.tif", "RunName": "baseline"}},
+        )
+        manifest = self.write(
+            "manifest.json",
+            {
+                "defaults": {"ProjectLocation": "out", "MFD": True},
+                "runs": [
+                    {"RunFile": run_file, "RunName": "a", "MFD": False},
+                    {"Algorithm": "pollution", "RunName": "b"},
+                ],
+            },
+        )
+        a, b = load_manifest(manifest)
+        self.assertEqual(a.algorithm, "qnspect:run_erosion_analysis")
+        self.assertEqual(
+            a.parameters,
+            {
+                "ProjectLocation": "out",
+                "MFD": False,
+                "ElevationRaster": "dem.tif",
+                "RunName": "a",
+                "LoadOutputs": False,
+            },
+        )
+        self.assertEqual(b.algorithm, POLLUTION)
+        self.assertTrue(b.parameters["MFD"])
+
+    def test_invalid_manifests(self):
+        for runs in (
+            [{"RunName": "a"}],
+            [{"Algorithm": "sediment", "RunName": "a"}],
+            [{"Algorithm": "pollution"}],
+            [{"Algorithm": "pollution", "RunName": "a"}] * 2,
+        ):
+            manifest = self.write(
+                "manifest.json", {"defaults": {"ProjectLocation": "out"}, "runs": runs}
+            )
+            with self.assertRaises(ValueError):
+                load_manifest(manifest)
+
+    def test_routing_groups(self):
+        def run(name, dem, mfd=True):
+            return BatchRun(name, POLLUTION, {"ElevationRaster": dem, "MFD": mfd})
+
+        runs = [run("a", "1.tif"), run("b", "2.tif"), run("c", "1.tif")]
+        runs.append(run("d", "1.tif", mfd=False))
+        groups = routing_groups(runs)
+        self.assertEqual(
+            [[r.name for r in group] for group in groups], [["a", "c"], ["b"], ["d"]]
+        )
+
+    def runs(self):
+        return [
+            BatchRun(name, POLLUTION, {"ElevationRaster": f"{name}.tif"})
+            for name in ("a", "b")
+        ]
+
+    def test_runs_of_a_broken_pool_are_retried(self):
+        pool, pools = fake_pool({"a": 1})
+        summaries = self.run_batch(self.runs(), pool)
+        self.assertEqual(
+            sorted((s["RunName"], s["Status"]) for s in summaries),
+            [("a", "succeeded"), ("b", "succeeded")],
+        )
+        self.assertEqual(len(pools), 2)
+
+    def test_run_breaking_two_pools_fails(self):
+        pool, _ = fake_pool({"a": 2})
+        summaries = {s["RunName"]: s for s in self.run_batch(self.runs(), pool)}
+        self.assertEqual(summaries["a"]["Status"], "failed")
+        self.assertEqual(summaries["b"]["Status"], "succeeded")
+
+    def test_cancel_terminates_the_workers(self):
+        pool, pools = fake_pool(hang=True)
+        runs = self.runs() + [BatchRun("c", POLLUTION, {"ElevationRaster": "a.tif"})]
+        summaries = self.run_batch(runs, pool, Feedback(1))
+        self.assertEqual(
+            sorted((s["RunName"], s["Status"]) for s in summaries),
+            [("a", "canceled"), ("b", "canceled"), ("c", "canceled")],
+        )
+        self.assertTrue(pools[0].terminated)
+        self.assertFalse(pools[0].waited)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# coding=utf-8
+"""Tests of the block streaming."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.blocks import Canceled, block_windows, map_rasters
+from QNSPECT.engine.raster_io import RasterGrid, open_raster, read_array, write_array
+from .utilities import CancelAfter
+
+GRID = RasterGrid(300, 200, (0.0, 30.0, 0.0, 6000.0, 0.0, -30.0), "")
+
+
+class TestBlocks(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.values = rng.uniform(size=(GRID.ysize, GRID.xsize))
+        self.valid = rng.uniform(size=self.values.shape) > 0.1
+        self.raster = write_array(
+            os.path.join(self.folder, "input.tif"), self.values, GRID, self.valid
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_windows_cover_the_raster_once(self):
+        covered = np.zeros(self.values.shape, dtype=int)
+        for xoff, yoff, xsize, ysize in block_windows(
+            open_raster(self.raster), 8 * 1024, 1
+        ):
+            covered[yoff : yoff + ysize, xoff : xoff + xsize] += 1
+        np.testing.assert_array_equal(covered, 1)
+
+    def test_blocks_match_whole_raster(self):
+        output = map_rasters(
+            lambda a: 2 * a,
+            {"a": self.raster},
+            os.path.join(self.folder, "output.tif"),
+            memory_mb=0.1,
+        )
+        values, valid = read_array(output)
+        np.testing.assert_array_equal(valid, self.valid)
+        np.testing.assert_allclose(
+            values[valid], 2 * self.values[valid].astype(np.float32), rtol=1e-6
+        )
+
+    def test_canceled_blocks_raise(self):
+        with self.assertRaises(Canceled):
+            map_rasters(
+                lambda a: a,
+                {"a": self.raster},
+                os.path.join(self.folder, "output.tif"),
+                memory_mb=0.1,
+                feedback=CancelAfter(2),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# coding=utf-8
+"""Tests of the intermediate cache."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.cache import IntermediateCache, vrt_sources
+from QNSPECT.engine.routing import FlowRouting
+
+
+class TestIntermediateCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = IntermediateCache(os.path.join(self.folder, "cache"), 1)
+        self.raster = self.write("input.tif", b"elevation")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_key_follows_inputs(self):
+        key = self.cache.key("CN", [self.raster], {"a": np.ones(3)}, {"units": 1})
+        self.assertEqual(
+            key, self.cache.key("CN", [self.raster], {"a": np.ones(3)}, {"units": 1})
+        )
+        self.assertNotEqual(
+            key, self.cache.key("CN", [self.raster], {"a": np.ones(3)}, {"units": 2})
+        )
+        self.assertNotEqual(
+            key, self.cache.key("CN", [self.raster], {"a": np.zeros(3)}, {"units": 1})
+        )
+        self.assertNotEqual(
+            key, self.cache.key("LS", [self.raster], {"a": np.ones(3)}, {"units": 1})
+        )
+
+        # new content under the same path
+        self.write("input.tif", b"new elevation")
+        self.assertNotEqual(
+            key, self.cache.key("CN", [self.raster], {"a": np.ones(3)}, {"units": 1})
+        )
+
+    def test_fetch_and_store(self):
+        key = self.cache.key("CN", [self.raster])
+        output = os.path.join(self.folder, "output.tif")
+        self.assertIsNone(self.cache.fetch(key, output))
+
+        self.cache.store(key, self.write("computed.tif", b"curve numbers"))
+        self.assertEqual(self.cache.fetch(key, output), output)
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), b"curve numbers")
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.max_size_mb = 2.5
+        entry = self.write("entry.tif", bytes(1024**2))
+        now = time.time()
+        for age, name in ((20, "first"), (10, "second")):
+            stored = self.cache.store(name, entry)
+            os.utime(stored, (now - age, now - age))
+        # a fetch makes first the most recently used entry
+        self.cache.fetch("first", os.path.join(self.folder, "output.tif"))
+        self.cache.store("third", entry)
+
+        output = os.path.join(self.folder, "output.tif")
+        self.assertIsNone(self.cache.fetch("second", output))
+        self.assertIsNotNone(self.cache.fetch("first", output))
+        self.assertIsNotNone(self.cache.fetch("third", output))
+        self.assertLessEqual(self.cache.size_mb(), 2.5)
+
+    def test_entries_above_the_cap_are_not_stored(self):
+        entry = self.write("entry.tif", bytes(2 * 1024**2))
+        self.assertIsNone(self.cache.store("large", entry))
+        self.assertIsNone(
+            self.cache.fetch("large", os.path.join(self.folder, "output.tif"))
+        )
+
+        routing = FlowRouting(
+            (512, 512), np.arange(1, 512**2), np.zeros(512**2 - 1)
+        )
+        self.cache.store_routing("large", routing)
+        self.assertIsNone(self.cache.fetch_routing("large"))
+        self.assertEqual(self.cache.size_mb(), 0)
+
+    def test_routing_round_trip(self):
+        # a chain 0 -> 1 -> 2 -> 3 split at 1
+        routing = FlowRouting(
+            (2, 2), [0, 1, 1, 2], [1, 2, 3, 3], [1.0, 0.25, 0.75, 1.0]
+        )
+        self.assertIsNone(self.cache.fetch_routing("DEM"))
+        self.cache.store_routing("DEM", routing)
+
+        loaded = self.cache.fetch_routing("DEM")
+        weight = np.arange(1.0, 5.0).reshape(2, 2)
+        np.testing.assert_allclose(
+            loaded.accumulate(weight), routing.accumulate(weight)
+        )
+        self.assertEqual(loaded.levels, routing.levels)
+
+    def test_fingerprints_of_runs_are_merged(self):
+        other = IntermediateCache(self.cache.directory, 1)
+        second = self.write("second.tif", b"land cover")
+        self.cache.fingerprint(self.raster)
+        other.fingerprint(second)
+
+        known = IntermediateCache(self.cache.directory, 1)._fingerprints
+        self.assertEqual(sorted(known), sorted([self.raster, second]))
+
+        # fingerprints of deleted files are dropped by the eviction only
+        os.remove(second)
+        self.cache.fingerprint(self.write("third.tif", b"soils"))
+        self.assertIn(second, IntermediateCache(self.cache.directory, 1)._fingerprints)
+        self.cache.evict()
+        self.assertNotIn(
+            second, IntermediateCache(self.cache.directory, 1)._fingerprints
+        )
+
+    def test_vrt_follows_its_sources(self):
+        vrt = self.write(
+            "aligned.vrt",
+            b'<VRTDataset rasterXSize="1" rasterYSize="1"><VRTRasterBand band="1">'
+            b'<SimpleSource><SourceFilename relativeToVRT="1">input.tif</SourceFilename>'
+            b"</SimpleSource></VRTRasterBand></VRTDataset>",
+        )
+        self.assertEqual(vrt_sources(vrt), [self.raster])
+
+        fingerprint = self.cache.fingerprint(vrt)
+        self.assertEqual(fingerprint, self.cache.fingerprint(vrt))
+        self.write("input.tif", b"new elevation")
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(vrt))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""Tests of the fused sediment rasters of the erosion analysis."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.curve_number import write_curve_number_raster
+from QNSPECT.engine.erosion import (
+    compute_sediment_rasters,
+    fill_zero_k_factor_raster,
+    rusle_raster,
+    sediment_delivery_ratio_raster,
+    sediment_yield_raster,
+)
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.raster_io import RasterGrid, read_array, write_array
+from QNSPECT.engine.reclassify import reclassify_by_lookup
+
+GRID = RasterGrid(30, 20, (0.0, 30.0, 0.0, 600.0, 0.0, -30.0), "")
+CELL_SIZE_SQ_METERS = 900.0
+
+LOOKUP = LookupTable(
+    [
+        {
+            "lc_value": 11,
+            "cn_a": 100,
+            "cn_b": 100,
+            "cn_c": 100,
+            "cn_d": 100,
+            "c_factor": 0,
+        },
+        {
+            "lc_value": 21,
+            "cn_a": 49,
+            "cn_b": 69,
+            "cn_c": 79,
+            "cn_d": 84,
+            "c_factor": 0.2,
+        },
+        {
+            "lc_value": 41,
+            "cn_a": 30,
+            "cn_b": 55,
+            "cn_c": 70,
+            "cn_d": 77,
+            "c_factor": 0.005,
+        },
+    ]
+)
+
+NAMES = [
+    "C-Factor",
+    "Curve Number",
+    "RUSLE",
+    "Sediment Delivery Ratio",
+    "Sediment Local",
+    "Sediment Local Mg",
+]
+
+
+class TestSedimentRasters(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        shape = (GRID.ysize, GRID.xsize)
+        # 31 is missing from the lookup table, soil groups 5-9 are dual
+        self.inputs = {
+            "lc": rng.choice([11, 21, 41, 31], shape),
+            "hsg": rng.integers(1, 10, shape),
+            # zero K-Factors are urban, negative ones are 0
+            "k": rng.choice([0.0, -0.1, 0.2, 0.43], shape),
+            "r": rng.uniform(100, 300, shape),
+            "ls": rng.uniform(0, 10, shape),
+            "rl": rng.uniform(0.01, 1, shape),
+        }
+        for name, values in self.inputs.items():
+            valid = rng.uniform(size=shape) > 0.1
+            self.inputs[name] = write_array(self.path(name), values, GRID, valid)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.folder, f"{name}.tif")
+
+    def step_by_step(self, dual_soil_type):
+        i = self.inputs
+        c = reclassify_by_lookup(i["lc"], LOOKUP, "c_factor", self.path("C"))
+        cn = write_curve_number_raster(
+            i["lc"], i["hsg"], LOOKUP, dual_soil_type, self.path("CN")
+        )
+        k = fill_zero_k_factor_raster(i["k"], self.path("K filled"))
+        soil_loss = rusle_raster(
+            c, i["ls"], k, i["r"], CELL_SIZE_SQ_METERS, self.path("RUSLE")
+        )
+        sdr = sediment_delivery_ratio_raster(
+            i["rl"], cn, CELL_SIZE_SQ_METERS, self.path("SDR")
+        )
+        sediment = sediment_yield_raster(sdr, soil_loss, self.path("Sediment"))
+        return {
+            "C-Factor": c,
+            "Curve Number": cn,
+            "RUSLE": soil_loss,
+            "Sediment Delivery Ratio": sdr,
+            "Sediment Local": sediment,
+        }
+
+    def test_fused_matches_step_by_step(self):
+        for dual_soil_type in (0, 1, 2):
+            i = self.inputs
+            fused = compute_sediment_rasters(
+                i["lc"],
+                i["hsg"],
+                i["k"],
+                i["r"],
+                i["ls"],
+                i["rl"],
+                LOOKUP,
+                {name: self.path(f"fused {name}") for name in NAMES},
+                dual_soil_type=dual_soil_type,
+                cell_size_sq_meters=CELL_SIZE_SQ_METERS,
+                memory_mb=0.01,
+            )
+            for name, path in self.step_by_step(dual_soil_type).items():
+                expected, expected_valid = read_array(path)
+                values, valid = read_array(fused[name])
+                np.testing.assert_array_equal(valid, expected_valid, name)
+                np.testing.assert_allclose(
+                    values[valid], expected[valid], rtol=1e-5, err_msg=name
+                )
+
+            kg, kg_valid = read_array(fused["Sediment Local"])
+            mg, mg_valid = read_array(fused["Sediment Local Mg"])
+            np.testing.assert_array_equal(mg_valid, kg_valid)
+            np.testing.assert_allclose(mg[mg_valid], kg[kg_valid] / 1000, rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
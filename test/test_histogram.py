@@ -0,0 +1,61 @@
+# coding=utf-8
+"""Tests of the raster class counts."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.blocks import Canceled
+from QNSPECT.engine.histogram import block_counts, class_counts
+from QNSPECT.engine.raster_io import RasterGrid, write_array
+from .utilities import CancelAfter
+
+GRID = RasterGrid(300, 200, (0.0, 30.0, 0.0, 6000.0, 0.0, -30.0), "")
+
+
+def unique_counts(values):
+    return dict(zip(*(a.tolist() for a in np.unique(values, return_counts=True))))
+
+
+class TestClassCounts(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_block_counts(self):
+        rng = np.random.default_rng(0)
+        for values in (
+            rng.choice([11, 21, 41, 82], 1000),
+            rng.choice([-5, 0, 7], 1000),
+            # a range too wide for np.bincount
+            rng.choice([-(2**40), 3, 2**40], 1000),
+            rng.choice([0.5, 1.25, 3.0], 1000),
+        ):
+            classes, counts = block_counts(values)
+            self.assertEqual(
+                dict(zip(classes.tolist(), counts.tolist())), unique_counts(values)
+            )
+        classes, counts = block_counts(np.zeros(0, dtype=np.int32))
+        self.assertEqual((classes.size, counts.size), (0, 0))
+
+    def test_class_counts_exclude_nodata(self):
+        rng = np.random.default_rng(1)
+        values = rng.choice([11, 21, 41, 82], (GRID.ysize, GRID.xsize))
+        valid = rng.uniform(size=values.shape) > 0.1
+        raster = write_array(os.path.join(self.folder, "lc.tif"), values, GRID, valid)
+        # a small memory budget streams the raster in several windows
+        counts = class_counts(raster, memory_mb=0.1)
+        self.assertEqual(counts, unique_counts(values[valid]))
+        self.assertEqual(list(counts), sorted(counts))
+
+        with self.assertRaises(Canceled):
+            class_counts(raster, memory_mb=0.1, feedback=CancelAfter(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
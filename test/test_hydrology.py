@@ -0,0 +1,131 @@
+# coding=utf-8
+"""Tests of the native flow routing."""
+
+import heapq
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from QNSPECT.engine.hydrology import (
+    NEIGHBOR_OFFSETS,
+    d8_routing,
+    flow_routing,
+    mfd_routing,
+    priority_flood,
+)
+from QNSPECT.engine.raster_io import RasterGrid, write_array
+
+
+def random_dem(rows=40, cols=50, seed=0):
+    rng = np.random.default_rng(seed)
+    r, c = np.indices((rows, cols))
+    # a tilted plane with noise, so that there are both slopes and depressions
+    dem = 0.5 * r + 0.2 * c + rng.uniform(0, 5, (rows, cols))
+    valid = rng.uniform(size=(rows, cols)) > 0.05
+    return dem, valid
+
+
+def reference_flood(dem, valid):
+    """Flooded surface of the priority queue of Barnes et al. 2014, cell by cell"""
+    rows, cols = dem.shape
+    level = np.where(valid, dem, 0.0)
+    closed = ~valid.copy()
+    queue = []
+    for r in range(rows):
+        for c in range(cols):
+            neighbors = [(r + dr, c + dc) for dr, dc in NEIGHBOR_OFFSETS]
+            if valid[r, c] and any(
+                not (0 <= nr < rows and 0 <= nc < cols) or not valid[nr, nc]
+                for nr, nc in neighbors
+            ):
+                closed[r, c] = True
+                queue.append((level[r, c], r, c))
+    heapq.heapify(queue)
+    while queue:
+        cell_level, r, c = heapq.heappop(queue)
+        for dr, dc in NEIGHBOR_OFFSETS:
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < rows and 0 <= nc < cols and not closed[nr, nc]:
+                closed[nr, nc] = True
+                level[nr, nc] = max(level[nr, nc], cell_level)
+                heapq.heappush(queue, (level[nr, nc], nr, nc))
+    return level
+
+
+def outflow(routing, weight):
+    """Accumulated weight of the cells without outgoing edges"""
+    acc = routing.accumulate(weight).ravel()
+    sinks = np.ones(acc.size, dtype=bool)
+    sinks[routing.sources] = False
+    return acc[sinks].sum()
+
+
+class TestHydrology(unittest.TestCase):
+    def check_mass_balance(self, routing, valid):
+        weight = np.where(valid, np.random.default_rng(1).uniform(size=valid.shape), 0)
+        self.assertAlmostEqual(outflow(routing, weight), weight.sum(), places=6)
+
+    def test_d8_mass_balance(self):
+        dem, valid = random_dem()
+        self.check_mass_balance(d8_routing(dem, valid, (10.0, 10.0)), valid)
+
+    def test_mfd_mass_balance(self):
+        dem, valid = random_dem()
+        routing = mfd_routing(dem, valid, (10.0, 10.0))
+        self.check_mass_balance(routing, valid)
+        totals = np.bincount(routing.sources, routing.fractions)
+        np.testing.assert_allclose(totals[routing.sources], 1.0)
+
+    def test_mfd_underflow(self):
+        # slopes so small that slope ** convergence underflows still drain
+        dem, valid = random_dem()
+        routing = mfd_routing(dem * 1e-60, valid, (10.0, 10.0), convergence=10)
+        self.check_mass_balance(routing, valid)
+
+    def test_flood_fills_depressions(self):
+        dem = np.full((5, 5), 10.0)
+        dem[1:4, 1:4] = 5.0
+        dem[2, 2] = 1.0
+        dem[0, 2] = 7.0
+        flooded, parent = priority_flood(dem, np.ones(dem.shape, dtype=bool))
+        np.testing.assert_array_equal(flooded[1:4, 1:4], 7.0)
+        self.assertEqual(parent[0, 2], -1)
+        self.assertTrue((parent[1:4, 1:4] >= 0).all())
+
+    def test_flood_matches_priority_queue(self):
+        for seed in range(5):
+            dem, valid = random_dem(seed=seed)
+            # rounding makes flats
+            dem = np.round(dem)
+            flooded, parent = priority_flood(dem, valid)
+            np.testing.assert_array_equal(
+                np.where(valid, flooded, 0), reference_flood(dem, valid)
+            )
+            # flats drain to a neighbor at the same level
+            flat = np.flatnonzero(parent >= 0)
+            np.testing.assert_array_equal(
+                flooded.ravel()[parent.ravel()[flat]], flooded.ravel()[flat]
+            )
+
+    def test_routing_larger_than_memory_is_refused(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        dem, valid = random_dem()
+        grid = RasterGrid(50, 40, (0.0, 10.0, 0.0, 400.0, 0.0, -10.0), "")
+        raster = write_array(os.path.join(folder, "dem.tif"), dem, grid, valid)
+
+        # 2000 cells of 400 bytes are about 0.76 MB
+        with mock.patch(
+            "QNSPECT.engine.hydrology.available_memory_mb", return_value=0.5
+        ):
+            with self.assertRaises(MemoryError):
+                flow_routing(raster, mfd=True)
+            self.check_mass_balance(flow_routing(raster, mfd=False), valid)
+
+
+if __name__ == "__main__":
+    unittest.main()
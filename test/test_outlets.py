@@ -0,0 +1,58 @@
+# coding=utf-8
+"""Tests of the outlet loads."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.outlets import OutletIndex
+from QNSPECT.engine.raster_io import RasterGrid, write_array
+from QNSPECT.engine.routing import FlowRouting
+from test.test_routing import random_drainage, random_split_routing
+
+GRID = RasterGrid(40, 30, (0.0, 30.0, 0.0, 900.0, 0.0, -30.0), "")
+
+
+class TestOutletIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(3)
+        self.weight = rng.uniform(size=(GRID.ysize, GRID.xsize))
+        self.valid = rng.uniform(size=self.weight.shape) > 0.1
+        self.raster = write_array(
+            os.path.join(self.folder, "weight.tif"), self.weight, GRID, self.valid
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def check_totals(self, routing):
+        accumulated = routing.accumulate(np.where(self.valid, self.weight, 0)).ravel()
+        # outlets all along a few flow paths drain into each other, one is repeated
+        downstream = np.full(self.weight.size, -1)
+        downstream[routing.sources[::-1]] = routing.targets[::-1]
+        cells = [-1]
+        for cell in np.random.default_rng(4).choice(self.weight.size, 5):
+            while cell >= 0:
+                cells.append(cell)
+                cell = downstream[cell]
+        cells = np.array(cells + cells[-1:])
+
+        totals = OutletIndex(routing, cells).totals(self.raster)
+        np.testing.assert_allclose(
+            totals[cells >= 0], accumulated[cells[cells >= 0]], rtol=1e-6
+        )
+        self.assertTrue(np.isnan(totals[cells < 0]).all())
+
+    def test_single_flow_totals(self):
+        self.check_totals(FlowRouting.from_drainage(random_drainage()))
+
+    def test_split_flow_totals(self):
+        self.check_totals(random_split_routing())
+
+
+if __name__ == "__main__":
+    unittest.main()
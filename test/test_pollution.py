@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Tests of the fused local rasters of the pollution analysis."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.blocks import map_rasters
+from QNSPECT.engine.curve_number import write_curve_number_raster
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.pollution import compute_local_rasters, compute_runoff_raster
+from QNSPECT.engine.raster_io import RasterGrid, read_array, write_array
+from QNSPECT.engine.reclassify import reclassify_by_lookup
+
+GRID = RasterGrid(30, 20, (0.0, 30.0, 0.0, 600.0, 0.0, -30.0), "")
+CELL_AREA_SQ_FEET = 30.0 * 30.0 * 10.7639
+
+LOOKUP = LookupTable(
+    [
+        {"lc_value": 11, "cn_a": 100, "cn_b": 100, "cn_c": 100, "cn_d": 100, "N": 0},
+        {"lc_value": 21, "cn_a": 49, "cn_b": 69, "cn_c": 79, "cn_d": 84, "N": 1.2},
+        {"lc_value": 41, "cn_a": 30, "cn_b": 55, "cn_c": 70, "cn_d": 77, "N": 0.8},
+    ]
+)
+
+
+class TestLocalRasters(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        shape = (GRID.ysize, GRID.xsize)
+        # 31 is missing from the lookup table, soil groups 5-9 are dual, 0 is not a group
+        self.lc = self.raster("lc", rng.choice([11, 21, 41, 31], shape), rng)
+        self.hsg = self.raster("hsg", rng.integers(0, 10, shape), rng)
+        self.precip = self.raster("precip", rng.uniform(300, 1500, shape), rng)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def raster(self, name, values, rng):
+        valid = rng.uniform(size=values.shape) > 0.1
+        return write_array(
+            os.path.join(self.folder, f"{name}.tif"), values, GRID, valid
+        )
+
+    def path(self, name):
+        return os.path.join(self.folder, f"{name}.tif")
+
+    def fused(self, dual_soil_type, precip_units):
+        names = ["CN", "Runoff Local", "N Local", "N Local kg"]
+        return compute_local_rasters(
+            self.lc,
+            self.hsg,
+            self.precip,
+            LOOKUP,
+            {"N": "n"},
+            {name: self.path(f"fused {name}") for name in names},
+            dual_soil_type,
+            precip_units,
+            raining_days=2,
+            cell_area_sq_feet=CELL_AREA_SQ_FEET,
+        )
+
+    def step_by_step(self, dual_soil_type, precip_units):
+        cn = write_curve_number_raster(
+            self.lc, self.hsg, LOOKUP, dual_soil_type, self.path("CN")
+        )
+        runoff = compute_runoff_raster(
+            self.precip, cn, self.path("Runoff"), precip_units, 2, CELL_AREA_SQ_FEET
+        )
+        coefficient = reclassify_by_lookup(
+            self.lc, LOOKUP, "n", self.path("N coefficient")
+        )
+        mg = map_rasters(
+            lambda q, n: q * n,
+            {"q": runoff, "n": coefficient},
+            self.path("N mg"),
+        )
+        kg = map_rasters(lambda a: a * 1e-6, {"a": mg}, self.path("N kg"))
+        return {"CN": cn, "Runoff Local": runoff, "N Local": mg, "N Local kg": kg}
+
+    def test_fused_matches_step_by_step(self):
+        for dual_soil_type in (0, 1, 2):
+            for precip_units in (0, 1):
+                fused = self.fused(dual_soil_type, precip_units)
+                steps = self.step_by_step(dual_soil_type, precip_units)
+                for name, path in steps.items():
+                    expected, expected_valid = read_array(path)
+                    values, valid = read_array(fused[name])
+                    np.testing.assert_array_equal(valid, expected_valid, name)
+                    np.testing.assert_allclose(
+                        values[valid], expected[valid], rtol=1e-6, err_msg=name
+                    )
+
+    def test_runoff_of_millimeters(self):
+        runoff, valid = read_array(self.fused(0, 1)["Runoff Local"])
+        cn, _ = read_array(self.path("fused CN"))
+        precip, _ = read_array(self.precip)
+
+        # SCS runoff of the precipitation in inches, 2 raining days
+        p = precip.astype(np.float64) / 25.4
+        s = np.where(cn > 0, 1000.0 / np.where(cn > 0, cn, 1) - 10, 0)
+        q = np.where(p > 0.4 * s, (p - 0.4 * s) ** 2 / (p + 1.6 * s), 0)
+        expected = q * CELL_AREA_SQ_FEET * 2.35973722
+        expected[cn == 0] = 0
+        np.testing.assert_allclose(runoff[valid], expected[valid], rtol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
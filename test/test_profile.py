@@ -0,0 +1,61 @@
+# coding=utf-8
+"""Tests of the run profiles."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from QNSPECT.engine import profile
+from QNSPECT.engine.profile import RunProfile, profiled
+
+# a child process burning about a second of CPU
+BUSY_CHILD = [sys.executable, "-c", "sum(range(30_000_000))"]
+
+
+class TestRunProfile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.profile = RunProfile("run", self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def spans(self):
+        return {span["Name"]: span for span in self.profile.summary()["Spans"]}
+
+    def test_temporary_folder_is_measured_per_stage(self):
+        with mock.patch.object(
+            profile, "folder_bytes", wraps=profile.folder_bytes
+        ) as folder_bytes, self.profile.active():
+            self.profile.stage("Stage")
+            with profiled("Step"), profiled("Child", "child algorithm"):
+                with open(os.path.join(self.folder, "output.tif"), "wb") as f:
+                    f.write(bytes(1000))
+            self.profile.stage(None)
+        # once at the start and once at the end of the stage
+        self.assertEqual(folder_bytes.call_count, 2)
+
+        spans = self.spans()
+        self.assertEqual(spans["Stage"]["TempBytes"], 1000)
+        self.assertNotIn("TempBytes", spans["Step"])
+        self.assertNotIn("TempBytes", spans["Child"])
+
+    def test_child_cpu_only_in_spans_running_a_child(self):
+        with self.profile.active():
+            with profiled("Step"):
+                subprocess.run(BUSY_CHILD, check=True)
+            with profiled("Child", "child algorithm"):
+                subprocess.run(BUSY_CHILD, check=True)
+
+        spans = self.spans()
+        child_cpu = spans["Child"]["CPUSeconds"]
+        self.assertGreater(child_cpu, 0.2)
+        self.assertLess(spans["Step"]["CPUSeconds"], child_cpu / 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Tests of the lookup table reclassification."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.lookup import LookupTable
+from QNSPECT.engine.raster_io import RasterGrid, open_raster, read_array, write_array
+from QNSPECT.engine.reclassify import (
+    reclassify_by_lookup,
+    reclassify_by_lookup_fields,
+)
+
+GRID = RasterGrid(300, 200, (0.0, 30.0, 0.0, 6000.0, 0.0, -30.0), "")
+
+LOOKUP = LookupTable(
+    [
+        {"lc_value": 11, "N": 0, "P": 0.1, "BOD": 2},
+        {"lc_value": 21, "N": 1.2, "P": 0.25, "BOD": 3},
+        {"lc_value": 41, "N": 0.8, "P": 0.05, "BOD": 4},
+    ]
+)
+FIELDS = ["N", "P", "BOD"]
+
+
+class TestReclassify(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        # 31 is missing from the lookup table
+        self.lc = rng.choice([11, 21, 41, 31], (GRID.ysize, GRID.xsize))
+        self.valid = rng.uniform(size=self.lc.shape) > 0.1
+        self.raster = write_array(
+            os.path.join(self.folder, "lc.tif"), self.lc, GRID, self.valid
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_bands_match_single_fields(self):
+        # a small memory budget streams the raster in several windows
+        stack = reclassify_by_lookup_fields(
+            self.raster,
+            LOOKUP,
+            FIELDS,
+            os.path.join(self.folder, "coefficients.tif"),
+            memory_mb=0.1,
+        )
+        ds = open_raster(stack)
+        self.assertEqual(ds.RasterCount, len(FIELDS))
+        for i, field in enumerate(FIELDS):
+            self.assertEqual(ds.GetRasterBand(i + 1).GetDescription(), field)
+            single = reclassify_by_lookup(
+                self.raster, LOOKUP, field, os.path.join(self.folder, f"{field}.tif")
+            )
+            expected, expected_valid = read_array(single)
+            values, valid = read_array(stack, i + 1)
+            np.testing.assert_array_equal(valid, expected_valid, field)
+            np.testing.assert_array_equal(values[valid], expected[valid], field)
+
+    def test_missing_classes_are_nodata(self):
+        stack = reclassify_by_lookup_fields(
+            self.raster, LOOKUP, FIELDS, os.path.join(self.folder, "coefficients.tif")
+        )
+        for i, field in enumerate(FIELDS):
+            _, valid = read_array(stack, i + 1)
+            np.testing.assert_array_equal(valid, self.valid & (self.lc != 31), field)
+
+        values, valid = read_array(stack, FIELDS.index("P") + 1)
+        for lc_value, coefficient in ((11, 0.1), (21, 0.25), (41, 0.05)):
+            cells = valid & (self.lc == lc_value)
+            np.testing.assert_allclose(values[cells], coefficient, rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Tests of the flow routing network."""
+
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.routing import DRAINAGE_OFFSETS, FlowRouting
+
+
+def random_drainage(rows=30, cols=40, seed=0):
+    """r.watershed drainage directions toward the lowest lower neighbor of a random surface,
+    -1 (out of the region) for pits"""
+    rng = np.random.default_rng(seed)
+    surface = rng.uniform(size=(rows, cols))
+    padded = np.pad(surface, 1, constant_values=np.inf)
+    drainage = np.full((rows, cols), -1)
+    lowest = surface.copy()
+    for code, (drow, dcol) in DRAINAGE_OFFSETS.items():
+        neighbor = padded[1 + drow : rows + 1 + drow, 1 + dcol : cols + 1 + dcol]
+        lower = neighbor < lowest
+        drainage[lower] = code
+        lowest[lower] = neighbor[lower]
+    return drainage
+
+
+def random_split_routing(rows=30, cols=40, seed=0):
+    """Multiple flow direction network draining each cell to its lower neighbors"""
+    rng = np.random.default_rng(seed)
+    surface = rng.uniform(size=(rows, cols))
+    sources, targets = [], []
+    for drow, dcol in DRAINAGE_OFFSETS.values():
+        r, c = np.indices((rows, cols))
+        r_to, c_to = r + drow, c + dcol
+        inside = (r_to >= 0) & (r_to < rows) & (c_to >= 0) & (c_to < cols)
+        r, c, r_to, c_to = r[inside], c[inside], r_to[inside], c_to[inside]
+        lower = surface[r_to, c_to] < surface[r, c]
+        sources.append(r[lower] * cols + c[lower])
+        targets.append(r_to[lower] * cols + c_to[lower])
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+    shares = rng.uniform(0.1, 1, sources.size)
+    fractions = shares / np.bincount(sources, shares)[sources]
+    return FlowRouting((rows, cols), sources, targets, fractions)
+
+
+def sink_total(routing, accumulated):
+    """Accumulated weight of the cells without outgoing edges"""
+    sinks = np.ones(accumulated.size, dtype=bool)
+    sinks[routing.sources] = False
+    return accumulated.ravel()[sinks].sum()
+
+
+class TestFlowRouting(unittest.TestCase):
+    def setUp(self):
+        self.weight = np.random.default_rng(1).uniform(size=(30, 40))
+
+    def test_single_flow_conserves_weight(self):
+        routing = FlowRouting.from_drainage(random_drainage())
+        accumulated = routing.accumulate(self.weight)
+        self.assertAlmostEqual(sink_total(routing, accumulated), self.weight.sum())
+        self.assertTrue((accumulated >= self.weight).all())
+
+    def test_split_flow_conserves_weight(self):
+        routing = random_split_routing()
+        accumulated = routing.accumulate(self.weight)
+        self.assertAlmostEqual(sink_total(routing, accumulated), self.weight.sum())
+
+    def test_levels_are_topological(self):
+        routing = random_split_routing()
+        level = np.full(self.weight.size, -1)
+        for i, (start, stop) in enumerate(routing.levels):
+            level[routing.sources[start:stop]] = i
+        # a cell sends its flow at a later level than all of its upstream cells
+        received_from = level[routing.sources]
+        sends_at = level[routing.targets]
+        sending = sends_at >= 0
+        self.assertTrue((received_from[sending] < sends_at[sending]).all())
+
+    def test_downstream_update_matches_full_accumulation(self):
+        for routing in (
+            FlowRouting.from_drainage(random_drainage()),
+            random_split_routing(),
+        ):
+            change = np.zeros(self.weight.shape)
+            change[10:14, 5:9] = np.random.default_rng(2).normal(size=(4, 4))
+            cells = np.flatnonzero(change)
+            affected, accumulated = routing.accumulate_downstream(
+                cells, change.ravel()[cells]
+            )
+
+            updated = routing.accumulate(self.weight).ravel()
+            updated[affected] += accumulated
+            np.testing.assert_allclose(
+                updated, routing.accumulate(self.weight + change).ravel()
+            )
+
+    def test_transfer_is_adjoint_of_accumulate(self):
+        for routing in (
+            FlowRouting.from_drainage(random_drainage()),
+            random_split_routing(),
+        ):
+            accumulated = routing.accumulate(self.weight).ravel()
+            for cell in np.random.default_rng(3).choice(self.weight.size, 10):
+                transfer = routing.transfer([cell])
+                self.assertAlmostEqual(
+                    (self.weight * transfer).sum(), accumulated[cell]
+                )
+                self.assertEqual(transfer.ravel()[cell], 1.0)
+                self.assertTrue((transfer <= 1 + 1e-12).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Tests of the step graph."""
+
+import threading
+import unittest
+
+from QNSPECT.engine.scheduler import StepGraph, bounded_workers
+from .utilities import CancelAfterSteps
+
+
+def diamond(log):
+    """a -> (b, c) -> d, each step logs its name and returns it with its inputs"""
+    lock = threading.Lock()
+
+    def step(name):
+        def func(feedback, *inputs):
+            with lock:
+                log.append(name)
+            if feedback is not None and hasattr(feedback, "done"):
+                feedback.done += 1
+            return name + "".join(inputs)
+
+        return func
+
+    graph = StepGraph()
+    graph.add("a", step("a"))
+    graph.add("b", step("b"), ["a"])
+    graph.add("c", step("c"), ["a"])
+    graph.add("d", step("d"), ["b", "c"])
+    return graph
+
+
+class TestStepGraph(unittest.TestCase):
+    def test_dependencies_run_first(self):
+        for workers in (1, 3):
+            log = []
+            results = diamond(log).run(max_workers=workers)
+            self.assertEqual(results["d"], "dbaca")
+            self.assertEqual(log[0], "a")
+            self.assertEqual(log[-1], "d")
+            self.assertEqual(sorted(log), ["a", "b", "c", "d"])
+
+    def test_unknown_and_repeated_steps(self):
+        graph = StepGraph()
+        graph.add("a", lambda feedback: None)
+        with self.assertRaises(ValueError):
+            graph.add("a", lambda feedback: None)
+        with self.assertRaises(ValueError):
+            graph.add("b", lambda feedback, x: None, ["x"])
+
+    def test_no_step_starts_once_canceled(self):
+        for workers in (1, 3):
+            log = []
+            results = diamond(log).run(
+                max_workers=workers, feedback=CancelAfterSteps(1)
+            )
+            self.assertEqual(log, ["a"])
+            self.assertEqual(list(results), ["a"])
+
+    def test_step_error_is_raised(self):
+        def fail(feedback, _):
+            raise RuntimeError("step failed")
+
+        for workers in (1, 3):
+            log = []
+            graph = diamond(log)
+            graph.add("e", fail, ["a"])
+            graph.add("f", lambda feedback, _: log.append("f"), ["e"])
+            with self.assertRaises(RuntimeError):
+                graph.run(max_workers=workers)
+            self.assertNotIn("f", log)
+
+    def test_bounded_workers(self):
+        self.assertEqual(bounded_workers(4, 1000, 2500), 2)
+        self.assertEqual(bounded_workers(4, 1000, 500), 1)
+        self.assertEqual(bounded_workers(4, 1000, None), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# coding=utf-8
+"""Tests of the slope kernel and the terrain rasters."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from QNSPECT.engine.hydrology import ls_factor_raster, terrain_rasters
+from QNSPECT.engine.raster_io import RasterGrid, read_array, write_array
+from QNSPECT.engine.terrain import horn_gradient, relief_length_ratio_raster
+
+
+class TestHornGradient(unittest.TestCase):
+    def test_plane_with_nodata(self):
+        # one sided differences keep the gradient of a plane next to NoData
+        rows, cols = np.indices((8, 9))
+        z = 3.0 * cols * 10 + 4.0 * rows * 10
+        valid = np.ones(z.shape, dtype=bool)
+        valid[3:5, 4] = False
+        valid[[0, -1], :] = False
+        gradient, gradient_valid = horn_gradient(z, valid, 10.0, 10.0)
+        np.testing.assert_array_equal(gradient_valid, valid[1:-1, 1:-1])
+        np.testing.assert_allclose(gradient[gradient_valid], 5.0)
+
+    def test_isolated_cell_is_nodata(self):
+        z = np.arange(9.0).reshape(3, 3)
+        valid = np.zeros(z.shape, dtype=bool)
+        valid[1, 1] = True
+        _, gradient_valid = horn_gradient(z, valid, 1.0, 1.0)
+        self.assertFalse(gradient_valid.any())
+
+
+class TestTerrainRasters(unittest.TestCase):
+    def test_shared_stage_matches_single_rasters(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        rng = np.random.default_rng(0)
+        rows, cols = np.indices((40, 50))
+        dem = 0.5 * rows + 0.2 * cols + rng.uniform(0, 5, rows.shape)
+        valid = rng.uniform(size=dem.shape) > 0.05
+        # a CRS in feet: the LS-Factor converts the cell size, the ratio does not
+        grid = RasterGrid(50, 40, (0.0, 10.0, 0.0, 400.0, 0.0, -10.0), "")
+        raster = write_array(os.path.join(folder, "dem.tif"), dem, grid, valid)
+
+        def path(name):
+            return os.path.join(folder, f"{name}.tif")
+
+        ls, rl = terrain_rasters(raster, path("ls"), path("rl"), 0.3048)
+        for shared, single in (
+            (ls, ls_factor_raster(raster, path("single ls"), 0.3048)),
+            # one window at a time
+            (rl, relief_length_ratio_raster(raster, path("single rl"), memory_mb=0.01)),
+        ):
+            expected, expected_valid = read_array(single)
+            values, values_valid = read_array(shared)
+            np.testing.assert_array_equal(values_valid, expected_valid)
+            np.testing.assert_allclose(
+                values[values_valid], expected[expected_valid], rtol=1e-6
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -59,3 +59,28 @@ def get_qgis_app():
         IFACE = QgisInterface(CANVAS)
 
     return QGIS_APP, CANVAS, IFACE, PARENT
+
+
+class CancelAfter:
+    """Feedback canceled after a number of checks"""
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def isCanceled(self):
+        self.checks -= 1
+        return self.checks < 0
+
+    def setProgress(self, progress):
+        pass
+
+
+class CancelAfterSteps(CancelAfter):
+    """Feedback canceled once a number of steps are done, the steps count themselves"""
+
+    def __init__(self, steps):
+        super().__init__(steps)
+        self.done = 0
+
+    def isCanceled(self):
+        return self.done >= self.checks